@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+模型调用准入控制模块
+按提供商对上游模型请求做并发限制和令牌桶限流（请求数/分钟、token数/分钟），
+等待时间超过SLO的请求直接拒绝，避免触发提供商限流后连锁失败
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+try:
+    from .token_counter import estimate_messages_tokens
+    from .log_manager import log_manager
+except ImportError:
+    from token_counter import estimate_messages_tokens
+    from log_manager import log_manager
+
+
+class AdmissionRejectedError(Exception):
+    """请求未获准入，调用方应返回HTTP 429"""
+
+    def __init__(self, provider: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"模型服务繁忙（{provider}: {reason}），请稍后再试")
+        self.provider = provider
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class TokenBucket:
+    """令牌桶：按分钟速率匀速补充，容量即允许的突发量"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """初始化令牌桶"""
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        """按流逝时间补充令牌"""
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate_per_second)
+            self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """获取指定数量令牌还需等待的秒数，超过容量的请求按容量计算"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        if self.rate_per_second <= 0:
+            return float("inf")
+        return (amount - self.tokens) / self.rate_per_second
+
+    def consume(self, amount: float):
+        """扣除令牌（允许为负，表示透支，后续补充时先偿还）"""
+        self.tokens -= amount
+
+
+class _ProviderLimiter:
+    """单个提供商的限流状态"""
+
+    def __init__(self, rpm: float, tpm: float, max_concurrency: int):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_slo": 0,
+                      "rejected_timeout": 0, "total_wait_ms": 0.0, "tokens_used": 0}
+
+
+class AdmissionTicket:
+    """一次已获准入的调用，用于在调用结束后按实际用量校正token桶"""
+
+    def __init__(self, provider: str, estimated_tokens: int):
+        self.provider = provider
+        self.estimated_tokens = estimated_tokens
+        self.actual_tokens: Optional[int] = None
+        self.wait_ms = 0.0
+
+    def record_usage(self, total_tokens: int):
+        """记录 response.usage 中的实际token数"""
+        self.actual_tokens = total_tokens
+
+
+class AdmissionController:
+    """
+    上游模型调用准入控制器
+
+    每个提供商维护：请求数令牌桶、token数令牌桶、最大并发数和有界等待队列。
+    1. 排队请求数达到 max_queue 时立即拒绝
+    2. 按令牌桶计算的等待时间超过 max_wait_seconds（SLO）时立即拒绝，不进入等待
+    3. 调用结束后用实际 usage 校正预估的token扣减
+    """
+
+    def __init__(self, provider_limits: Dict[str, Dict[str, Any]], max_queue: int = 32,
+                 max_wait_seconds: float = 15.0, default_limits: Optional[Dict[str, Any]] = None):
+        """初始化准入控制器"""
+        self.provider_limits = provider_limits or {}
+        self.default_limits = default_limits or {"rpm": 60, "tpm": 100000, "max_concurrency": 8}
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self._limiters: Dict[str, _ProviderLimiter] = {}
+        self._condition = threading.Condition()
+
+    def _get_limiter(self, provider: str) -> _ProviderLimiter:
+        """获取或创建提供商的限流器（调用方需持有锁）"""
+        limiter = self._limiters.get(provider)
+        if limiter is None:
+            limits = {**self.default_limits, **self.provider_limits.get(provider, {})}
+            limiter = _ProviderLimiter(limits["rpm"], limits["tpm"], limits["max_concurrency"])
+            self._limiters[provider] = limiter
+        return limiter
+
+    def _reject(self, limiter: _ProviderLimiter, provider: str, reason: str, retry_after: float):
+        """记录并抛出拒绝（调用方需持有锁）"""
+        limiter.stats[f"rejected_{reason}"] += 1
+        log_manager.log_error("system", "admission_rejected", f"{provider}: {reason}", "api")
+        raise AdmissionRejectedError(provider, reason, retry_after)
+
+    @contextmanager
+    def admit(self, provider: str, estimated_tokens: int):
+        """
+        申请一次模型调用
+
+        Args:
+            provider (str): 提供商名称
+            estimated_tokens (int): 预估的token总量（提示词+最大生成长度）
+
+        Yields:
+            AdmissionTicket: 调用结束前可通过 record_usage 提交实际用量
+
+        Raises:
+            AdmissionRejectedError: 队列已满或预计等待超过SLO
+        """
+        ticket = AdmissionTicket(provider, estimated_tokens)
+        started = time.monotonic()
+        deadline = started + self.max_wait_seconds
+
+        with self._condition:
+            limiter = self._get_limiter(provider)
+            if limiter.waiting >= self.max_queue:
+                self._reject(limiter, provider, "queue_full", 1.0)
+
+            limiter.waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    rate_wait = max(limiter.requests.wait_time(1, now),
+                                    limiter.tokens.wait_time(estimated_tokens, now))
+                    if rate_wait == 0 and limiter.in_flight < limiter.max_concurrency:
+                        break
+                    if now + rate_wait > deadline:
+                        # 按当前速率无法在SLO内获得准入，快速失败
+                        self._reject(limiter, provider, "slo", rate_wait)
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self._reject(limiter, provider, "timeout", 1.0)
+                    self._condition.wait(timeout=min(rate_wait, remaining) if rate_wait > 0 else remaining)
+            finally:
+                limiter.waiting -= 1
+
+            limiter.requests.consume(1)
+            limiter.tokens.consume(estimated_tokens)
+            limiter.in_flight += 1
+            ticket.wait_ms = (time.monotonic() - started) * 1000
+            limiter.stats["admitted"] += 1
+            limiter.stats["total_wait_ms"] += ticket.wait_ms
+
+        try:
+            yield ticket
+        finally:
+            with self._condition:
+                limiter.in_flight -= 1
+                if ticket.actual_tokens is not None:
+                    # 退还或补扣预估与实际用量的差额
+                    limiter.tokens.consume(ticket.actual_tokens - estimated_tokens)
+                    limiter.stats["tokens_used"] += ticket.actual_tokens
+                self._condition.notify_all()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各提供商的准入统计"""
+        with self._condition:
+            stats = {}
+            for provider, limiter in self._limiters.items():
+                provider_stats = dict(limiter.stats)
+                provider_stats["total_wait_ms"] = round(provider_stats["total_wait_ms"], 2)
+                provider_stats["in_flight"] = limiter.in_flight
+                provider_stats["waiting"] = limiter.waiting
+                provider_stats["available_requests"] = round(limiter.requests.tokens, 2)
+                provider_stats["available_tokens"] = round(limiter.tokens.tokens, 2)
+                stats[provider] = provider_stats
+            return stats
+
+
+class _AdmittedCompletions:
+    """chat.completions 的准入代理"""
+
+    def __init__(self, completions, controller: AdmissionController, provider: str):
+        self._completions = completions
+        self._controller = controller
+        self._provider = provider
+
+    def create(self, **kwargs):
+        """申请准入后调用上游接口，并按 response.usage 校正token用量"""
+        estimated = estimate_messages_tokens(kwargs.get("messages", [])) + (kwargs.get("max_tokens") or 0)
+        with self._controller.admit(self._provider, estimated) as ticket:
+            response = self._completions.create(**kwargs)
+            usage = getattr(response, "usage", None)
+            if usage is not None and getattr(usage, "total_tokens", None) is not None:
+                ticket.record_usage(usage.total_tokens)
+            return response
+
+
+class _AdmittedChat:
+    """chat 命名空间代理"""
+
+    def __init__(self, chat, controller: AdmissionController, provider: str):
+        self.completions = _AdmittedCompletions(chat.completions, controller, provider)
+
+
+class AdmittedChatClient:
+    """
+    OpenAI客户端包装器
+
+    chat.completions.create 经过准入控制，其余属性（如 embeddings）直接透传。
+    """
+
+    def __init__(self, client, controller: AdmissionController, provider: str):
+        self._client = client
+        self.controller = controller
+        self.provider = provider
+        self.chat = _AdmittedChat(client.chat, controller, provider)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
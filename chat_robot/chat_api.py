@@ -1,11 +1,25 @@
 import os
+import time
 from typing import List, Dict, Any
 from openai import OpenAI
 from openai.types.chat import ChatCompletionMessageParam
-from .data_manager import DataManager
+from .shard_manager import create_data_manager
 from .prompt_manager import PromptManager
 from .config_manager import config_manager
 from .log_manager import log_manager
+from .embedding import create_embedder
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .search_manager import SearchManager
+from .long_term_memory import LongTermMemory
+from .vector_store import VectorStore
+from .admission_controller import AdmissionController, AdmittedChatClient, AdmissionRejectedError
+from .usage_ledger import UsageLedger, SYSTEM_USER_ID
+from .quota_manager import QuotaManager, QuotaExceededError
+from .message_archive import MessageArchive
+from .content_compression import ContentCompressor
+from .session_purger import SessionPurger
+from .token_counter import estimate_messages_tokens, MESSAGE_OVERHEAD_TOKENS
 
 class ChatAPI:
     """聊天API接口，集成数据管理、提示词管理和模型调用"""
@@ -13,7 +27,8 @@ class ChatAPI:
     def __init__(self):
         """初始化聊天API"""
         # 初始化组件
-        self.data_manager = DataManager()
+        self.data_manager = create_data_manager(**config_manager.get_shard_config(),
+                                                **config_manager.get_replica_config())
 
         # 获取配置
         self.ai_config = config_manager.get_ai_config()
@@ -21,13 +36,94 @@ class ChatAPI:
 
         # 初始化OpenAI客户端
         self.client = self._initialize_client()
+
+        # 上游模型调用准入控制：包装客户端，所有 chat.completions 调用都需先获得准入
+        self.admission_controller = None
+        admission_config = config_manager.get_admission_config()
+        if admission_config["enabled"]:
+            self.admission_controller = AdmissionController(
+                admission_config["provider_limits"],
+                max_queue=admission_config["max_queue"],
+                max_wait_seconds=admission_config["max_wait_seconds"]
+            )
+            self.client = AdmittedChatClient(self.client, self.admission_controller, self._get_provider_name())
         
         # 初始化提示词管理器
         self.prompt_manager = PromptManager(self.client)
 
+        # 初始化响应缓存（可选）
+        self.response_cache = self._initialize_response_cache()
+
+        # 同一会话的并发摘要请求只生成一次
+        self.summary_flight = SingleFlight()
+
+        # 聊天记录搜索（内存后端时随消息写入增量更新索引）
+        search_config = config_manager.get_search_config()
+        self.search_manager = SearchManager(self.data_manager, search_config["backend"], search_config["max_results"],
+                                            search_config["refresh_seconds"])
+
+        # 长期记忆（可选）：召回最近窗口之外的相关历史消息
+        self.long_term_memory = self._initialize_long_term_memory()
+
+        # 用量账本：按模型返回的usage记录token数和费用
+        usage_config = config_manager.get_usage_config()
+        self.usage_ledger = None
+        if usage_config["enabled"]:
+            self.usage_ledger = UsageLedger(self.data_manager, usage_config["pricing"], usage_config["currency"],
+                                            refresh_seconds=usage_config["refresh_seconds"])
+
+        # 用户配额（依赖用量账本的计数）
+        quota_config = config_manager.get_quota_config()
+        self.quota_manager = None
+        if quota_config["enabled"] and self.usage_ledger is not None:
+            self.quota_manager = QuotaManager(
+                self.usage_ledger,
+                self.data_manager,
+                default_limits=quota_config["default_limits"],
+                soft_ratio=quota_config["soft_ratio"],
+                limits_ttl=quota_config["limits_ttl"],
+                allow_anonymous=quota_config["allow_anonymous"]
+            )
+
+        # 冷会话消息归档（可选）：后台把长期不活跃会话的消息压缩移出热表
+        # 分片部署时每个分片各自运行归档、清理和压缩
+        archive_config = config_manager.get_archive_config()
+        purge_config = config_manager.get_purge_config()
+        compression_config = config_manager.get_content_compression_config()
+        for shard in self.data_manager.shards:
+            if archive_config["enabled"]:
+                shard.message_archive = MessageArchive(
+                    shard,
+                    inactive_days=archive_config["inactive_days"],
+                    batch_sessions=archive_config["batch_sessions"],
+                    level=archive_config["level"]
+                )
+                shard.message_archive.start(archive_config["interval_seconds"])
+
+            # 后台分批删除已软删除的会话和消息
+            if purge_config["enabled"]:
+                shard.session_purger = SessionPurger(
+                    shard,
+                    batch_size=purge_config["batch_size"],
+                    batch_pause=purge_config["batch_pause"]
+                )
+                shard.session_purger.start(purge_config["interval_seconds"])
+
+            # 长消息内容压缩（可选）
+            shard.content_compressor = ContentCompressor(
+                shard,
+                enabled=compression_config["enabled"],
+                min_bytes=compression_config["min_bytes"],
+                level=compression_config["level"],
+                dict_size=compression_config["dict_size"],
+                search_prefix_chars=compression_config["search_prefix_chars"]
+            )
+
         # 创建数据表
         try:
-            self.data_manager.create_tables()
+            self.data_manager.create_tables(**config_manager.get_migration_config())
+            for shard in self.data_manager.shards:
+                shard.content_compressor.ensure_dictionary(compression_config["train_samples"])
             # 记录API初始化成功
             log_manager.log_api_request("system", [{"role": "system", "content": "ChatAPI initialized"}], 
                                       self.ai_config["model_name"], 0, 0, "api")
@@ -68,6 +164,122 @@ class ChatAPI:
                 base_url=self.ai_config["openai_base_url"] or "http://localhost:8001/v1"
             )
     
+    def _initialize_response_cache(self):
+        """根据配置初始化响应缓存，未启用时返回None"""
+        cache_config = config_manager.get_response_cache_config()
+        if not cache_config["enabled"]:
+            return None
+
+        embedder = self._create_embedder() if cache_config["semantic_enabled"] else None
+        if cache_config["semantic_enabled"] and embedder is None:
+            print("向量模型不可用，语义缓存已禁用")
+
+        return ResponseCache(
+            embedder=embedder,
+            ttl_seconds=cache_config["ttl_seconds"],
+            max_entries=cache_config["max_entries"],
+            max_memory_bytes=cache_config["max_memory_bytes"],
+            similarity_threshold=cache_config["similarity_threshold"],
+            context_messages=cache_config["context_messages"],
+        )
+
+    def _create_embedder(self):
+        """按配置创建向量模型，失败时返回None"""
+        embedding_config = config_manager.get_embedding_config()
+        try:
+            return create_embedder(embedding_config["provider"], self.client,
+                                   embedding_config["model"], embedding_config["dim"])
+        except Exception as e:
+            print(f"初始化向量模型失败: {e}")
+            return None
+
+    def _initialize_long_term_memory(self):
+        """根据配置初始化长期记忆，未启用或缺少依赖时返回None"""
+        memory_config = config_manager.get_long_term_memory_config()
+        if not memory_config["enabled"]:
+            return None
+        embedder = self._create_embedder()
+        if embedder is None:
+            print("向量模型不可用，长期记忆已禁用")
+            return None
+        store_config = config_manager.get_vector_store_config()
+        try:
+            # 远程向量模型的维度在第一次调用后才能确定，创建向量存储前先探测
+            if embedder.dim is None:
+                embedder.ensure_dim()
+            vector_store = VectorStore(store_config["root_dir"], dim=embedder.dim,
+                                       segment_rows=store_config["segment_rows"])
+        except Exception as e:
+            print(f"初始化向量存储失败，长期记忆已禁用: {e}")
+            log_manager.log_error("system", "long_term_memory_error", str(e), "api")
+            return None
+        vector_store.start_compaction(store_config["compaction_interval"], store_config["min_dead_ratio"])
+        return LongTermMemory(
+            embedder,
+            vector_store=vector_store,
+            top_k=memory_config["top_k"],
+            min_similarity=memory_config["min_similarity"],
+        )
+
+    def _on_message_saved(self, session_id: str, role: str, content: str, saved: Dict[str, Any] | None):
+        """消息保存后更新搜索索引和长期记忆，失败不影响主流程（saved 为 save_message 的返回值）"""
+        saved = saved or {}
+        self.search_manager.index_message(session_id, role, content, saved.get("user_id"), saved.get("title"),
+                                          saved.get("created_at"), saved.get("id"))
+        if self.long_term_memory is not None:
+            try:
+                self.long_term_memory.remember(session_id, role, content, saved.get("id"))
+            except Exception as e:
+                print(f"写入长期记忆失败: {e}")
+                log_manager.log_error(session_id, "long_term_memory_error", str(e), "api")
+
+    def _discard_message(self, session_id: str, saved: Dict[str, Any] | None):
+        """撤销本轮已保存但未得到回复的用户消息（准入或配额拒绝时），避免客户端重试后上下文中重复出现该提问"""
+        if not saved:
+            return
+        if not self.data_manager.delete_message(session_id, saved["id"]):
+            log_manager.log_error(session_id, "discard_message_error", str(saved["id"]), "api")
+
+    def _enforce_quota(self, session_id: str, user_id: int, estimated_tokens: int, saved: Dict[str, Any] | None):
+        """按预估token数检查配额，超出时撤销本轮的用户消息并抛出 QuotaExceededError"""
+        if self.quota_manager is None:
+            return
+        try:
+            self.quota_manager.enforce(user_id, estimated_tokens)
+        except QuotaExceededError as e:
+            log_manager.log_error(session_id, "quota_exceeded", str(e), "api")
+            self._discard_message(session_id, saved)
+            raise
+
+    def _record_usage(self, session_id: str, user_id: int, model_name: str, usage) -> Dict[str, Any]:
+        """将模型响应的usage记入用量账本，返回本次调用的token数和费用"""
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        if self.usage_ledger is None:
+            return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens, "cost": 0.0}
+        return self.usage_ledger.record(session_id, user_id, self._get_provider_name(), model_name,
+                                        prompt_tokens, completion_tokens)
+
+    def forget_session(self, session_id: str):
+        """会话删除或清空后移除其搜索索引和长期记忆"""
+        self.search_manager.remove_session(session_id)
+        if self.long_term_memory is not None:
+            self.long_term_memory.forget(session_id)
+
+    def _get_provider_name(self) -> str:
+        """获取当前启用的AI提供商名称"""
+        if self.ai_config["local_model_enabled"]:
+            return "local"
+        elif self.ai_config["openai_api_enabled"]:
+            return "openai"
+        elif self.ai_config["deepseek_api_enabled"]:
+            return "deepseek"
+        elif self.ai_config["zhipu_api_enabled"]:
+            return "zhipu"
+        else:
+            return "local"
+
     def _get_model_name(self):
         """根据当前启用的AI提供商获取相应的模型名称"""
         if self.ai_config["local_model_enabled"]:
@@ -103,12 +315,13 @@ class ChatAPI:
             print(f"❌ 模型连接测试失败: {e}")
             return False
     
-    def summarize_history(self, session_id: str) -> str:
+    def summarize_history(self, session_id: str, user_id: int = None) -> str:
         """
         对历史聊天记录进行摘要
 
         Args:
             session_id (str): 会话ID
+            user_id (int): 摘要调用的用量记在该用户名下
 
         Returns:
             str: 历史记录摘要
@@ -130,6 +343,39 @@ class ChatAPI:
         if existing_summary:
             return existing_summary
 
+        # 同一会话的并发请求合并为一次摘要生成，其他请求等待并共享结果
+        return self.summary_flight.do(session_id, self._generate_summary_once, session_id, message_count, user_id)
+
+    def _generate_summary_once(self, session_id: str, message_count: int, user_id: int = None) -> str:
+        """
+        在合并调用内生成摘要，按配置使用MySQL命名锁防止多进程重复生成
+
+        Args:
+            session_id (str): 会话ID
+            message_count (int): 当前消息总数
+            user_id (int): 摘要调用的用量记在该用户名下
+
+        Returns:
+            str: 历史记录摘要
+        """
+        if self.context_config.get("summary_lock_backend") != "mysql":
+            return self._generate_summary(session_id, message_count, user_id)
+
+        lock_name = f"summary:{session_id}"
+        with self.data_manager.advisory_lock(lock_name, self.context_config["summary_lock_timeout"]) as acquired:
+            if not acquired:
+                # 其他进程长时间持锁，本轮不重复生成，直接使用已有摘要
+                log_manager.log_error(session_id, "summary_lock_timeout", lock_name, "api")
+                return self.data_manager.get_recent_summary(session_id)
+            return self._generate_summary(session_id, message_count, user_id)
+
+    def _generate_summary(self, session_id: str, message_count: int, user_id: int = None) -> str:
+        """调用模型生成摘要并保存"""
+        # 等锁期间其他请求或进程可能已经写入了摘要
+        existing_summary = self.data_manager.get_recent_summary(session_id)
+        if existing_summary:
+            return existing_summary
+
         # 计算需要摘要的消息数量（除了最近的消息）
         window_size = self.context_config["window_size"]
         summary_limit = max(0, message_count - window_size)
@@ -148,12 +394,15 @@ class ChatAPI:
         # 使用PromptManager生成摘要
         summary_model_name = self._get_model_name()
         try:
-            summary = self.prompt_manager.summarize_history(
-                session_id, 
-                history_messages, 
-                summary_model_name, 
+            summary, usage = self.prompt_manager.summarize_history_with_usage(
+                session_id,
+                history_messages,
+                summary_model_name,
                 512
             )
+            # 摘要是最大的提示词之一，用量和对话调用一样记入账本和配额
+            if usage is not None:
+                self._record_usage(session_id, user_id, summary_model_name, usage)
             # 构造用于日志记录的消息
             log_messages = [
                 {"role": "system", "content": "你是一个专业的对话摘要助手。请将用户与AI的对话历史总结成简洁的摘要，保留关键信息和上下文。摘要应该清晰、准确、便于后续对话参考。"},
@@ -171,8 +420,8 @@ class ChatAPI:
             print(f"生成摘要时出错: {e}")
             return ""
 
-    async def call_api_directly(self, prompt: str, ai_config: Dict[str, Any] = None) -> str:
-        """直接调用AI模型，不保存到数据库（用于系统内部调用）"""
+    def call_api_directly(self, prompt: str, ai_config: Dict[str, Any] = None) -> str:
+        """直接调用AI模型，不保存到数据库（用于系统内部调用）；同步阻塞，异步接口中需放到线程池执行"""
         try:
             # 使用提供的配置或默认配置
             config = ai_config or self.ai_config
@@ -206,6 +455,9 @@ class ChatAPI:
             content = response.choices[0].message.content
             assistant_response = content if content else ""
 
+            # 系统内部调用单独计数，不占用匿名用户的配额
+            self._record_usage("system_internal", SYSTEM_USER_ID, model_name, getattr(response, "usage", None))
+
             # 记录API响应
             log_manager.log_api_response(
                 "system_internal",
@@ -222,7 +474,8 @@ class ChatAPI:
             log_manager.log_error("system_internal", "direct_api_call_error", str(e), "api")
             raise
 
-    def chat_with_history(self, session_id: str, user_input: str, persona_id: int = None) -> str:
+    def chat_with_history(self, session_id: str, user_input: str, persona_id: int = None,
+                          user_id: int = None) -> str:
         """
         带历史记录的聊天
 
@@ -230,6 +483,7 @@ class ChatAPI:
             session_id (str): 会话ID
             user_input (str): 用户输入
             persona_id (int): 人设ID，可选
+            user_id (int): 用户ID，用于用量统计，可选
 
         Returns:
             str: 模型回复
@@ -242,11 +496,16 @@ class ChatAPI:
                                   model_name, 0, 0, "api")
         # 首先获取人设信息
         persona_system_prompt = ""
+        # 编译后的人设提示词按人设ID和版本缓存，旧版内联提示词按内容缓存
+        compiled_persona_id = None
+        persona_version = None
         if persona_id:
             try:
                 persona = self.data_manager.get_persona_by_id(persona_id)
                 if persona and persona.get("system_prompt"):
                     persona_system_prompt = persona["system_prompt"]
+                    compiled_persona_id = persona_id
+                    persona_version = persona.get("updated_at")
                     # 更新会话的人设信息
                     self.data_manager.update_session(session_id, persona_id=persona_id)
             except Exception as e:
@@ -267,14 +526,14 @@ class ChatAPI:
 
         # 确保会话存在
         try:
-            self.data_manager.save_session(session_id, "新对话", persona_id=persona_id)
+            self.data_manager.save_session(session_id, "新对话", persona_id=persona_id, user_id=user_id)
         except Exception as e:
             # 如果会话已存在或其他问题，继续执行
             print(f"会话处理信息: {e}")
             
-        # 保存用户消息
+        # 保存用户消息（本轮被拒绝时撤销，因此得到回复后才写入搜索索引和长期记忆）
         try:
-            self.data_manager.save_message(session_id, "user", user_input)
+            user_saved = self.data_manager.save_message(session_id, "user", user_input)
             # 记录用户消息保存成功
             log_manager.log_database_operation(session_id, "save", "user_message", {
                 "content_length": len(user_input)
@@ -288,20 +547,43 @@ class ChatAPI:
         window_size = self.context_config["window_size"]
         recent_messages = self.data_manager.get_recent_messages(session_id, limit=window_size)
 
+        # 使用PromptManager构建系统提示词：人设部分取编译缓存，每轮只附加摘要和召回的消息
+        base_system_prompt = "你是一个AI助手，请根据用户的需求提供准确、有用的回答。"
+        compiled_prompt = self.prompt_manager.compile_persona_prompt(
+            base_system_prompt,
+            persona_system_prompt,
+            compiled_persona_id,
+            persona_version,
+            session_id
+        )
+
+        # 生成摘要前按人设提示词、最近消息和当前输入先检查一次配额，避免为超出配额的请求调用摘要模型
+        self._enforce_quota(session_id, user_id, compiled_prompt.tokens + MESSAGE_OVERHEAD_TOKENS
+                            + estimate_messages_tokens(recent_messages + [{"content": user_input}]), user_saved)
+
         # 生成历史摘要
-        history_summary = self.summarize_history(session_id)
+        history_summary = self.summarize_history(session_id, user_id)
         # 记录历史摘要生成结果
         log_manager.log_system_prompt(session_id, f"History summary generated: {len(history_summary) if history_summary else 0} characters", "api")
 
-        # 使用PromptManager构建系统提示词
-        base_system_prompt = "你是一个AI助手，请根据用户的需求提供准确、有用的回答。"
-        full_system_prompt = self.prompt_manager.build_system_prompt(
-            base_system_prompt, 
-            persona_system_prompt, 
-            history_summary
+        # 从长期记忆中召回最近窗口之外的相关历史消息
+        relevant_memories = []
+        if self.long_term_memory is not None:
+            try:
+                # 按消息ID排除上下文窗口中的消息（当前用户消息此时还没有写入长期记忆，按条数排除会多排除一条）
+                relevant_memories = self.long_term_memory.recall(
+                    session_id, user_input,
+                    exclude_ids=self.data_manager.get_recent_message_ids(session_id, limit=window_size))
+            except Exception as e:
+                print(f"召回长期记忆失败: {e}")
+                log_manager.log_error(session_id, "long_term_memory_error", str(e), "api")
+
+        full_system_prompt = self.prompt_manager.render_system_prompt(
+            compiled_prompt,
+            history_summary,
+            relevant_memories,
+            session_id
         )
-        # 记录系统提示词构建
-        log_manager.log_system_prompt(session_id, f"System prompt built with {len(full_system_prompt)} characters", "api")
 
         # 使用PromptManager构建完整的消息列表
         messages: List[ChatCompletionMessageParam] = self.prompt_manager.build_messages(
@@ -310,14 +592,46 @@ class ChatAPI:
             user_input
         )  # type: ignore
 
+        # 查询响应缓存：上下文取系统提示词和当前输入之前的最近消息
+        cache_partition = None
+        if self.response_cache is not None:
+            context_messages = recent_messages
+            if context_messages and context_messages[-1]["role"] == "user" and context_messages[-1]["content"] == user_input:
+                context_messages = context_messages[:-1]
+            cache_partition = self.response_cache.make_partition_key(
+                persona_id, model_name, [messages[0]] + context_messages
+            )
+            try:
+                cache_hit = self.response_cache.lookup(cache_partition, user_input)
+            except Exception as e:
+                # 语义层的向量化失败（例如远程Embedder超时）时按未命中处理
+                cache_hit = None
+                print(f"查询响应缓存失败: {e}")
+                log_manager.log_error(session_id, "response_cache_error", str(e), "api")
+            if cache_hit is not None:
+                log_manager.log_system_prompt(session_id, f"Response cache hit ({cache_hit.tier}, similarity={cache_hit.similarity:.3f})", "api")
+                self._on_message_saved(session_id, "user", user_input, user_saved)
+                try:
+                    saved = self.data_manager.save_message(session_id, "assistant", cache_hit.response)
+                    self._on_message_saved(session_id, "assistant", cache_hit.response, saved)
+                except Exception as e:
+                    print(f"保存模型回复失败: {e}")
+                    log_manager.log_error(session_id, "save_response_error", str(e), "api")
+                return cache_hit.response
+
+        # 按完整提示词（含摘要和召回的消息）的预估token数再检查一次配额，拒绝超出剩余配额的超长上下文
+        self._enforce_quota(session_id, user_id,
+                            self.prompt_manager.estimate_system_prompt_tokens(compiled_prompt, full_system_prompt)
+                            + MESSAGE_OVERHEAD_TOKENS + estimate_messages_tokens(messages[1:]), user_saved)
+
+        user_indexed = False
         try:
-            # 记录系统提示词
-            log_manager.log_system_prompt(session_id, full_system_prompt, "api")
-            
-            # 记录API请求
+            # 记录API请求（系统提示词的人设前缀已在编译时记录，这里只记录前缀哈希和本轮附加的部分）
+            log_messages = [{"role": "system", "content": f"<compiled:{compiled_prompt.prefix_hash[:12]}>"
+                                                          f"{full_system_prompt[len(compiled_prompt.text):]}"}]
             log_manager.log_api_request(
                 session_id, 
-                [{"role": msg["role"], "content": msg["content"]} for msg in messages], 
+                log_messages + [{"role": msg["role"], "content": msg["content"]} for msg in messages[1:]], 
                 model_name, 
                 self.ai_config["max_tokens"], 
                 self.ai_config["temperature"],
@@ -325,26 +639,45 @@ class ChatAPI:
             )
             
             # 调用模型
+            call_started = time.perf_counter()
             response = self.client.chat.completions.create(
                 model=model_name,
                 messages=messages,
                 max_tokens=self.ai_config["max_tokens"],
                 temperature=self.ai_config["temperature"]
             )
+            call_latency_ms = (time.perf_counter() - call_started) * 1000
+            self._on_message_saved(session_id, "user", user_input, user_saved)
+            user_indexed = True
 
             # 获取模型回复
             content = response.choices[0].message.content
             assistant_response = content if content else ""
+
+            # 写入响应缓存
+            if cache_partition is not None:
+                try:
+                    self.response_cache.store(cache_partition, user_input, assistant_response, call_latency_ms)
+                except Exception as e:
+                    # 缓存写入失败不影响本轮回复
+                    print(f"写入响应缓存失败: {e}")
+                    log_manager.log_error(session_id, "response_cache_error", str(e), "api")
+
+            # 记入用量账本
+            usage = self._record_usage(session_id, user_id, model_name, getattr(response, "usage", None))
             
             # 记录API响应
             log_manager.log_api_response(session_id, assistant_response, 
-                                       response.usage.prompt_tokens if response.usage else 0,
-                                       response.usage.completion_tokens if response.usage else 0,
+                                       usage["prompt_tokens"],
+                                       usage["completion_tokens"],
                                        "api")
 
-            # 保存模型回复
+            # 保存模型回复（本轮调用的token数和费用记在回复消息上）
             try:
-                self.data_manager.save_message(session_id, "assistant", assistant_response)
+                saved = self.data_manager.save_message(session_id, "assistant", assistant_response,
+                                                       tokens_used=usage["total_tokens"], cost=usage["cost"],
+                                                       model_name=model_name)
+                self._on_message_saved(session_id, "assistant", assistant_response, saved)
                 # 记录模型回复保存成功
                 log_manager.log_database_operation(session_id, "save", "assistant_response", {
                     "content_length": len(assistant_response)
@@ -354,11 +687,19 @@ class ChatAPI:
                 log_manager.log_error(session_id, "save_response_error", str(e), "api")
 
             return assistant_response
+        except AdmissionRejectedError as e:
+            # 上游繁忙时快速失败，由接口层返回429，不写入降级回复并撤销本轮的用户消息
+            print(f"模型调用未获准入: {e}")
+            log_manager.log_error(session_id, "admission_rejected", str(e), "api")
+            self._discard_message(session_id, user_saved)
+            raise
         except Exception as e:
             error_msg = f"调用模型时出错: {e}"
             print(error_msg)
             # 记录错误日志
             log_manager.log_error(session_id, "model_call_error", str(e))
+            if not user_indexed:
+                self._on_message_saved(session_id, "user", user_input, user_saved)
             # 提供降级响应
             fallback_response = "您好！我是Qwen AI助手。我暂时无法处理您的请求，请稍后再试。您可以尝试重新启动服务或检查网络连接。"
             # 保存错误信息到数据库
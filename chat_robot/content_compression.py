@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+消息内容压缩模块
+超过阈值的消息内容使用zstd压缩后存入 chat_messages.content_blob，content_compressed 标记该行已压缩，
+content 列只保留开头 search_prefix_chars 个字符供MySQL全文索引使用：压缩消息只有这部分能被全文搜索命中
+（内存倒排索引后端读取解压后的全文，不受影响），以少量冗余存储换取长消息仍可被搜索到。压缩字典用本库的聊天记录训练，保存在 compression_dictionaries 表中；
+zstd帧头记录了所用字典的ID，因此更换字典后旧消息仍可解压。读取时由 decode_rows() 透明解压。
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard为可选依赖，缺失时不压缩新消息
+    zstandard = None
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+# 训练字典时至少需要的样本数，样本太少时训练会失败或字典没有收益
+MIN_TRAINING_SAMPLES = 100
+
+
+class ContentCompressor:
+    """
+    消息内容压缩器
+
+    encode() 返回写入 chat_messages 的 content / content_compressed / content_blob 三列，
+    decode_rows() 是查询结果的行映射，把压缩行还原为原文。未启用时只解压不压缩，
+    已压缩的历史消息始终可读。zstd的压缩/解压对象不是线程安全的，按线程缓存。
+    """
+
+    def __init__(self, data_manager, enabled: bool = False, min_bytes: int = 2048, level: int = 3,
+                 dict_size: int = 112640, search_prefix_chars: int = 512):
+        """初始化压缩器"""
+        self.data_manager = data_manager
+        self.enabled = enabled and zstandard is not None
+        if enabled and zstandard is None:
+            print("未安装 zstandard，消息内容压缩已禁用")
+        self.min_bytes = min_bytes
+        self.level = level
+        self.dict_size = dict_size
+        self.search_prefix_chars = max(0, int(search_prefix_chars))
+        self._dictionaries: Dict[int, Any] = {}
+        self._active_dict_id: Optional[int] = None
+        self._dictionaries_loaded = False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stats = {"compressed_messages": 0, "raw_bytes": 0, "stored_bytes": 0, "compress_seconds": 0.0,
+                       "decompressed_messages": 0, "decompress_seconds": 0.0}
+
+    # ===== 字典 =====
+
+    def _load_dictionaries(self):
+        """从数据库加载全部字典，最新的字典用于压缩"""
+        rows = self.data_manager._query("SELECT dict_id, dict_data FROM compression_dictionaries "
+                                        "ORDER BY created_at ASC, dict_id ASC")
+        with self._lock:
+            for row in rows:
+                self._dictionaries[int(row["dict_id"])] = zstandard.ZstdCompressionDict(bytes(row["dict_data"]))
+            if rows:
+                self._active_dict_id = int(rows[-1]["dict_id"])
+            self._dictionaries_loaded = True
+            self._local = threading.local()
+
+    def _dictionary(self, dict_id: int):
+        if dict_id not in self._dictionaries:
+            # 其他进程训练的新字典
+            self._load_dictionaries()
+        if dict_id not in self._dictionaries:
+            raise RuntimeError(f"找不到压缩字典 {dict_id}")
+        return self._dictionaries[dict_id]
+
+    def train_dictionary(self, sample_limit: int = 2000) -> Optional[Dict[str, Any]]:
+        """
+        用最近的消息训练压缩字典并设为当前字典
+
+        Args:
+            sample_limit (int): 最多使用的样本消息数
+
+        Returns:
+            Dict: 字典ID、样本数和字典大小，样本不足或训练失败时返回None
+        """
+        if zstandard is None:
+            return None
+        rows = self.data_manager._query("""
+        SELECT content, content_compressed, content_blob FROM chat_messages
+        ORDER BY id DESC
+        LIMIT :limit
+        """, {"limit": int(sample_limit)})
+        samples = [row["content"].encode("utf-8") for row in self.decode_rows(rows) if row["content"]]
+        if len(samples) < MIN_TRAINING_SAMPLES:
+            return None
+        try:
+            dictionary = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+        except zstandard.ZstdError as e:
+            print(f"训练压缩字典失败: {e}")
+            return None
+
+        dict_id = dictionary.dict_id()
+        self.data_manager._query("""
+        INSERT INTO compression_dictionaries (dict_id, dict_data, sample_count, sample_bytes)
+        VALUES (:dict_id, :dict_data, :sample_count, :sample_bytes)
+        """, {"dict_id": dict_id, "dict_data": dictionary.as_bytes(), "sample_count": len(samples),
+              "sample_bytes": sum(len(sample) for sample in samples)})
+        self._load_dictionaries()
+        info = {"dict_id": dict_id, "samples": len(samples), "dict_bytes": len(dictionary.as_bytes())}
+        log_manager.log_database_operation("system", "train_dictionary", "compression_dictionaries", info, "database")
+        return info
+
+    def ensure_dictionary(self, sample_limit: int = 2000) -> Optional[int]:
+        """启用压缩且还没有字典时尝试训练一个，返回当前字典ID"""
+        if not self.enabled:
+            return None
+        self._load_dictionaries()
+        if self._active_dict_id is None:
+            self.train_dictionary(sample_limit)
+        return self._active_dict_id
+
+    # ===== 压缩和解压 =====
+
+    def _compressor(self):
+        compressors = getattr(self._local, "compressors", None)
+        if compressors is None:
+            compressors = self._local.compressors = {}
+        dict_id = self._active_dict_id
+        if dict_id not in compressors:
+            dictionary = self._dictionaries.get(dict_id) if dict_id is not None else None
+            compressors[dict_id] = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+        return compressors[dict_id]
+
+    def _decompressor(self, dict_id: int):
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        if dict_id not in decompressors:
+            dictionary = self._dictionary(dict_id) if dict_id else None
+            decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressors[dict_id]
+
+    def encode(self, content: str) -> Dict[str, Any]:
+        """
+        生成写入 chat_messages 的内容列
+
+        Returns:
+            Dict: content（压缩时为供全文索引的开头部分）、content_compressed、content_blob，
+                未达到阈值或压缩无收益时原样保存
+        """
+        raw = content.encode("utf-8")
+        if not self.enabled or len(raw) < self.min_bytes:
+            return {"content": content, "content_compressed": False, "content_blob": None}
+        if not self._dictionaries_loaded:
+            self._load_dictionaries()
+
+        started = time.process_time()
+        blob = self._compressor().compress(raw)
+        elapsed = time.process_time() - started
+        prefix = content[:self.search_prefix_chars]
+        stored = len(blob) + len(prefix.encode("utf-8"))
+        if stored >= len(raw):
+            return {"content": content, "content_compressed": False, "content_blob": None}
+        with self._lock:
+            self._stats["compressed_messages"] += 1
+            self._stats["raw_bytes"] += len(raw)
+            self._stats["stored_bytes"] += stored
+            self._stats["compress_seconds"] += elapsed
+        return {"content": prefix, "content_compressed": True, "content_blob": blob}
+
+    def decompress(self, blob: bytes) -> str:
+        """解压一条消息内容，字典ID从zstd帧头读取"""
+        if zstandard is None:
+            raise RuntimeError("读取压缩消息需要安装 zstandard")
+        blob = bytes(blob)
+        started = time.process_time()
+        dict_id = zstandard.get_frame_parameters(blob).dict_id
+        content = self._decompressor(dict_id).decompress(blob).decode("utf-8")
+        with self._lock:
+            self._stats["decompressed_messages"] += 1
+            self._stats["decompress_seconds"] += time.process_time() - started
+        return content
+
+    def decode_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        查询结果的行映射：还原压缩行的 content，并去掉 content_compressed / content_blob 两列
+        """
+        for row in rows:
+            compressed = row.pop("content_compressed", False)
+            blob = row.pop("content_blob", None)
+            if compressed:
+                row["content"] = self.decompress(blob)
+        return rows
+
+    # ===== 统计 =====
+
+    def benchmark(self, sample_limit: int = 2000, min_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """
+        用最近的消息比较不压缩、zstd和zstd+字典三种方式的存储大小与CPU耗时
+
+        Args:
+            sample_limit (int): 使用的消息数
+            min_bytes (int): 只统计不小于该字节数的消息，默认为压缩阈值
+
+        Returns:
+            Dict: 每种方式的存储字节数、节省比例、每MB压缩和解压的CPU毫秒数
+        """
+        if zstandard is None:
+            raise RuntimeError("基准测试需要安装 zstandard")
+        min_bytes = self.min_bytes if min_bytes is None else min_bytes
+        rows = self.data_manager._query("""
+        SELECT content, content_compressed, content_blob FROM chat_messages
+        ORDER BY id DESC
+        LIMIT :limit
+        """, {"limit": int(sample_limit)})
+        samples = [row["content"].encode("utf-8") for row in self.decode_rows(rows)]
+        samples = [sample for sample in samples if len(sample) >= min_bytes]
+        raw_bytes = sum(len(sample) for sample in samples)
+        result = {"messages": len(samples), "raw_bytes": raw_bytes}
+        if not samples:
+            return result
+
+        if not self._dictionaries_loaded:
+            self._load_dictionaries()
+        dictionary = self._dictionaries.get(self._active_dict_id)
+        variants = {"zstd": None}
+        if dictionary is not None:
+            variants["zstd_dict"] = dictionary
+        for name, dict_data in variants.items():
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dict_data)
+            decompressor = zstandard.ZstdDecompressor(dict_data=dict_data)
+            started = time.process_time()
+            blobs = [compressor.compress(sample) for sample in samples]
+            compress_seconds = time.process_time() - started
+            started = time.process_time()
+            for blob in blobs:
+                decompressor.decompress(blob)
+            decompress_seconds = time.process_time() - started
+            stored = sum(min(len(blob), len(sample)) for blob, sample in zip(blobs, samples))
+            megabytes = raw_bytes / 1024 / 1024
+            result[name] = {
+                "stored_bytes": stored,
+                "saved_ratio": round(1 - stored / raw_bytes, 4),
+                "compress_ms_per_mb": round(compress_seconds * 1000 / megabytes, 2),
+                "decompress_ms_per_mb": round(decompress_seconds * 1000 / megabytes, 2),
+            }
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取压缩统计：节省的字节数和压缩/解压耗费的CPU时间"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["enabled"] = self.enabled
+        stats["min_bytes"] = self.min_bytes
+        stats["dict_id"] = self._active_dict_id
+        stats["saved_bytes"] = stats["raw_bytes"] - stats["stored_bytes"]
+        stats["compress_seconds"] = round(stats["compress_seconds"], 4)
+        stats["decompress_seconds"] = round(stats["decompress_seconds"], 4)
+        return stats
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+文本向量化模块
+提供可插拔的Embedder实现，用于语义缓存、长期记忆等基于向量的功能
+"""
+
+import re
+import zlib
+import unicodedata
+from typing import List, Any, Optional
+
+try:
+    import numpy as np
+except ImportError:  # numpy为可选依赖，缺失时向量功能自动关闭
+    np = None
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+
+# 英文单词/数字与中日韩字符的切分规则
+_WORD_PATTERN = re.compile(r"[a-z0-9_]+|[\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7af]")
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角转半角、转小写、合并空白"""
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return " ".join(text.split())
+
+
+def tokenize_for_embedding(text: str) -> List[str]:
+    """将文本切分为特征词：英文按单词，中文按单字和相邻双字"""
+    tokens = _WORD_PATTERN.findall(normalize_text(text))
+    features = list(tokens)
+    for first, second in zip(tokens, tokens[1:]):
+        features.append(f"{first}|{second}")
+    return features
+
+
+class HashingEmbedder:
+    """
+    基于特征哈希的本地Embedder
+
+    不依赖外部服务，结果在不同进程间完全确定，适合测试环境和离线部署。
+    """
+
+    def __init__(self, dim: int = 256):
+        """初始化哈希Embedder"""
+        if np is None:
+            raise ImportError("HashingEmbedder 需要安装 numpy")
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> Any:
+        """将文本列表编码为L2归一化后的float32矩阵"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in tokenize_for_embedding(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                # 最高位决定符号，减少哈希冲突带来的偏差
+                sign = 1.0 if digest & 0x80000000 else -1.0
+                vectors[row, digest % self.dim] += sign
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class OpenAIEmbedder:
+    """基于OpenAI兼容接口的Embedder（智谱、OpenAI等均可使用）"""
+
+    def __init__(self, client, model: str, dim: Optional[int] = None):
+        """初始化远程Embedder"""
+        if np is None:
+            raise ImportError("OpenAIEmbedder 需要安装 numpy")
+        self.client = client
+        self.model = model
+        self.dim = dim
+        self.name = f"openai-{model}"
+
+    def embed(self, texts: List[str]) -> Any:
+        """调用远程接口获取向量并做L2归一化"""
+        response = self.client.embeddings.create(model=self.model, input=texts)
+        vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def ensure_dim(self) -> int:
+        """向量维度未知时用一条探测文本调用一次接口确定维度（创建向量存储前需要）"""
+        if self.dim is None:
+            self.embed(["维度探测"])
+        return self.dim
+
+
+def create_embedder(provider: str = "local", client=None, model: str = "", dim: int = 256):
+    """
+    根据配置创建Embedder
+
+    Args:
+        provider (str): local 使用本地哈希向量，openai 使用OpenAI兼容接口
+        client: OpenAI客户端（provider为openai时必需）
+        model (str): 远程向量模型名称
+        dim (int): 本地向量维度
+
+    Returns:
+        Embedder实例，numpy不可用时返回None
+    """
+    if np is None:
+        print("未安装numpy，向量相关功能已禁用")
+        return None
+
+    if provider == "openai" and client is not None and model:
+        log_manager.log_config_change("embedder", None, f"openai:{model}", "config")
+        return OpenAIEmbedder(client, model)
+
+    return HashingEmbedder(dim)
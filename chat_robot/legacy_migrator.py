@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+旧版数据迁移模块
+把 *_old 旧表（会话以字符串session_id关联）中的数据按块迁移到v2.0.0表结构，
+作为分块迁移步骤由 MigrationRunner 执行：每块一次按主键分页的读取和批量写入，检查点与写入在同一事务中提交。
+"""
+
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+# 迁移阶段：(旧表, 可作为分页键的列，按优先级)
+LEGACY_PHASES = (
+    ("ai_personas_old", ("id", "name")),
+    ("chat_sessions_old", ("id", "session_id")),
+    ("chat_messages_old", ("id",)),
+    ("chat_summaries_old", ("id",)),
+)
+
+VALID_ROLES = ("system", "user", "assistant", "tool")
+
+
+class LegacyMigrator:
+    """
+    旧版数据的流式迁移
+
+    每块按分页键读取 chunk_size 行（WHERE key > 上一块末尾 ORDER BY key LIMIT n），
+    整块用一条批量INSERT写入。会话ID映射（字符串session_id -> chat_sessions.id）首次使用时整体加载，
+    之后只增量读取新插入的会话，消息和摘要不再逐行子查询。
+    检查点记录当前阶段、分页位置、已处理行数、进度和预计剩余时间。
+    """
+
+    def __init__(self, data_manager, clock: Callable[[], float] = time.monotonic):
+        """初始化迁移器"""
+        self.data_manager = data_manager
+        self.backend = data_manager.backend
+        self._clock = clock
+        self._reset()
+
+    def _reset(self):
+        """清空缓存（上一块未提交时缓存中可能有已回滚的数据）"""
+        self._columns: Dict[str, List[str]] = {}
+        self._session_map: Optional[Dict[str, int]] = None
+        self._session_map_last_id = 0
+        self._persona_names: Optional[set] = None
+        self._persona_map: Optional[Dict[Any, Optional[int]]] = None
+        self._last_checkpoint: Optional[Dict[str, Any]] = None
+        self._last_chunk_end: Optional[float] = None
+
+    def start(self) -> Dict[str, Any]:
+        """统计各旧表行数，返回初始检查点"""
+        totals = {}
+        for table, _ in LEGACY_PHASES:
+            if self.backend.table_exists(table):
+                rows = self.backend.query(f"SELECT COUNT(*) AS count FROM {table}")
+                totals[table] = int(rows[0]["count"]) if rows else 0
+        if totals:
+            print(f"发现需要迁移的旧表: {', '.join(f'{table}({count}行)' for table, count in totals.items())}")
+        return {"phase": 0, "after": None, "totals": totals, "processed": {table: 0 for table in totals},
+                "copied": 0, "skipped": 0, "elapsed_seconds": 0.0, "progress": 0.0, "eta_seconds": None}
+
+    def apply_chunk(self, checkpoint: Optional[Dict[str, Any]], chunk_size: int) -> Tuple[Dict[str, Any], bool]:
+        """
+        迁移一块数据
+
+        Returns:
+            Tuple: (新检查点, 是否全部完成)
+        """
+        if checkpoint is None or checkpoint != self._last_checkpoint:
+            self._reset()
+        try:
+            return self._apply_chunk(checkpoint, chunk_size)
+        except Exception:
+            # 本块的事务会回滚，缓存的会话映射可能包含未提交的会话
+            self._reset()
+            raise
+
+    def _apply_chunk(self, checkpoint: Optional[Dict[str, Any]], chunk_size: int) -> Tuple[Dict[str, Any], bool]:
+        checkpoint = dict(checkpoint) if checkpoint is not None else self.start()
+        checkpoint["processed"] = dict(checkpoint["processed"])
+        chunk_started = self._clock()
+
+        while checkpoint["phase"] < len(LEGACY_PHASES):
+            table, key_candidates = LEGACY_PHASES[checkpoint["phase"]]
+            key = self._key_column(table, key_candidates) if table in checkpoint["totals"] else None
+            if key is None:
+                if table in checkpoint["totals"]:
+                    print(f"{table} 没有可用于分页的列（{', '.join(key_candidates)}），跳过")
+                self._next_phase(checkpoint)
+                continue
+
+            where = f"WHERE {key} > :after" if checkpoint["after"] is not None else ""
+            rows = self.backend.query(f"SELECT * FROM {table} {where} ORDER BY {key} LIMIT :limit",
+                                      {"after": checkpoint["after"], "limit": int(chunk_size)})
+            if rows:
+                copied = self._copy(table, rows)
+                checkpoint["after"] = rows[-1][key]
+                checkpoint["processed"][table] += len(rows)
+                checkpoint["copied"] += copied
+                checkpoint["skipped"] += len(rows) - copied
+            if len(rows) < chunk_size:
+                self._next_phase(checkpoint)
+            if rows:
+                break
+
+        done = checkpoint["phase"] >= len(LEGACY_PHASES)
+        self._update_progress(checkpoint, chunk_started)
+        if checkpoint["totals"]:
+            self._report(checkpoint, done)
+        self._last_checkpoint = checkpoint
+        return checkpoint, done
+
+    @staticmethod
+    def _next_phase(checkpoint: Dict[str, Any]):
+        checkpoint["phase"] += 1
+        checkpoint["after"] = None
+
+    def _update_progress(self, checkpoint: Dict[str, Any], chunk_started: float):
+        """累计耗时（包括块之间的限流暂停）并计算进度和预计剩余时间"""
+        now = self._clock()
+        checkpoint["elapsed_seconds"] = round(
+            checkpoint["elapsed_seconds"] + now - (self._last_chunk_end or chunk_started), 3)
+        self._last_chunk_end = now
+
+        total = sum(checkpoint["totals"].values())
+        processed = sum(checkpoint["processed"].values())
+        checkpoint["progress"] = round(processed / total, 4) if total else 1.0
+        if checkpoint["phase"] >= len(LEGACY_PHASES):
+            checkpoint["progress"] = 1.0
+            checkpoint["eta_seconds"] = 0
+        elif processed and checkpoint["elapsed_seconds"] > 0:
+            rate = processed / checkpoint["elapsed_seconds"]
+            checkpoint["eta_seconds"] = int(max(total - processed, 0) / rate)
+
+    def _report(self, checkpoint: Dict[str, Any], done: bool):
+        processed = sum(checkpoint["processed"].values())
+        total = sum(checkpoint["totals"].values())
+        if done:
+            print(f"旧版数据迁移完成: 处理 {processed} 行，写入 {checkpoint['copied']} 行，"
+                  f"跳过 {checkpoint['skipped']} 行，耗时 {checkpoint['elapsed_seconds']:.1f} 秒")
+        else:
+            print(f"旧版数据迁移 {checkpoint['progress']:.1%}（{processed}/{total} 行），"
+                  f"预计剩余 {checkpoint['eta_seconds'] if checkpoint['eta_seconds'] is not None else '-'} 秒")
+        log_manager.log_database_operation("system", "migrate", "legacy_data", {
+            "phase": checkpoint["phase"],
+            "processed": processed,
+            "total": total,
+            "copied": checkpoint["copied"],
+            "eta_seconds": checkpoint["eta_seconds"]
+        }, "database")
+
+    def _key_column(self, table: str, candidates: Iterable[str]) -> Optional[str]:
+        columns = self._table_columns(table)
+        return next((column for column in candidates if column in columns), None)
+
+    def _table_columns(self, table: str) -> List[str]:
+        if table not in self._columns:
+            self._columns[table] = self.backend.table_columns(table)
+        return self._columns[table]
+
+    def _optional_columns(self, table: str, candidates: Iterable[str]) -> List[str]:
+        """旧表中存在的可选列（不存在的列使用新表默认值）"""
+        columns = self._table_columns(table)
+        return [column for column in candidates if column in columns]
+
+    def _insert(self, table: str, columns: List[str], rows: List[Dict[str, Any]]) -> int:
+        if not rows:
+            return 0
+        self.backend.execute_many(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(':' + column for column in columns)})",
+            rows)
+        return len(rows)
+
+    def _copy(self, table: str, rows: List[Dict[str, Any]]) -> int:
+        """把一块旧数据写入新表，返回写入的行数"""
+        if table == "ai_personas_old":
+            return self._copy_personas(rows)
+        if table == "chat_sessions_old":
+            return self._copy_sessions(rows)
+        if table == "chat_messages_old":
+            return self._copy_messages(rows)
+        return self._copy_summaries(rows)
+
+    # ===== 映射 =====
+
+    def _refresh_session_map(self) -> Dict[str, int]:
+        """首次调用时加载全部会话ID映射，之后只读取新插入的会话"""
+        if self._session_map is None:
+            self._session_map = {}
+        while True:
+            rows = self.backend.query("SELECT id, session_id FROM chat_sessions WHERE id > :last_id "
+                                      "ORDER BY id LIMIT 10000", {"last_id": self._session_map_last_id})
+            for row in rows:
+                self._session_map[row["session_id"]] = row["id"]
+            if rows:
+                self._session_map_last_id = rows[-1]["id"]
+            if len(rows) < 10000:
+                return self._session_map
+
+    def _ensure_sessions(self, session_ids: Iterable[str]) -> Dict[str, int]:
+        """为消息和摘要引用但不存在的会话批量创建会话，返回会话ID映射"""
+        session_map = self._refresh_session_map()
+        missing = sorted({session_id for session_id in session_ids if session_id not in session_map})
+        if missing:
+            self._insert("chat_sessions", ["session_id", "title"],
+                         [{"session_id": session_id, "title": "新对话"} for session_id in missing])
+            session_map = self._refresh_session_map()
+        return session_map
+
+    def _map_persona(self, old_persona_id: Any) -> Optional[int]:
+        """旧人设ID按名称映射到新人设ID，没有旧人设表时保留仍然有效的ID"""
+        if old_persona_id in (None, "", 0):
+            return None
+        if self._persona_map is None:
+            new_ids = {row["name"]: row["id"] for row in self.backend.query("SELECT id, name FROM ai_personas")}
+            if self.backend.table_exists("ai_personas_old") and \
+                    {"id", "name"} <= set(self._table_columns("ai_personas_old")):
+                self._persona_map = {row["id"]: new_ids.get(row["name"]) for row in
+                                     self.backend.query("SELECT id, name FROM ai_personas_old")}
+            else:
+                self._persona_map = {persona_id: persona_id for persona_id in new_ids.values()}
+        return self._persona_map.get(old_persona_id)
+
+    # ===== 各表 =====
+
+    def _copy_personas(self, rows: List[Dict[str, Any]]) -> int:
+        if self._persona_names is None:
+            self._persona_names = {row["name"] for row in self.backend.query("SELECT name FROM ai_personas")}
+        values = []
+        for row in rows:
+            name = row.get("name")
+            if not name or name in self._persona_names:
+                continue
+            self._persona_names.add(name)
+            values.append({
+                "name": name,
+                "description": row.get("description") or "",
+                "system_prompt": row.get("system_prompt") or "",
+                "avatar_url": row.get("avatar_url"),
+                "is_default": bool(row.get("is_default")),
+            })
+        return self._insert("ai_personas", ["name", "description", "system_prompt", "avatar_url", "is_default"],
+                            values)
+
+    def _copy_sessions(self, rows: List[Dict[str, Any]]) -> int:
+        session_map = self._refresh_session_map()
+        optional = self._optional_columns("chat_sessions_old", ("is_active", "created_at", "updated_at"))
+        values = []
+        seen = set()
+        for row in rows:
+            session_id = str(row.get("session_id") or "")
+            if not session_id or session_id in session_map or session_id in seen:
+                continue
+            seen.add(session_id)
+            value = {
+                "session_id": session_id,
+                "title": row.get("title") or "新对话",
+                "persona_id": self._map_persona(row.get("persona_id")),
+            }
+            value.update({column: row[column] for column in optional})
+            values.append(value)
+        copied = self._insert("chat_sessions", ["session_id", "title", "persona_id"] + optional, values)
+        if copied:
+            self._refresh_session_map()
+        return copied
+
+    def _copy_messages(self, rows: List[Dict[str, Any]]) -> int:
+        rows = [row for row in rows if row.get("session_id") is not None and row.get("content") is not None
+                and str(row.get("role") or "").lower() in VALID_ROLES]
+        session_map = self._ensure_sessions(str(row["session_id"]) for row in rows)
+        optional = self._optional_columns("chat_messages_old", ("tokens_used", "created_at"))
+        values = []
+        for row in rows:
+            value = {
+                "session_id": session_map[str(row["session_id"])],
+                "role": str(row["role"]).lower(),
+                "content": str(row["content"]),
+            }
+            value.update({column: row[column] for column in optional})
+            values.append(value)
+        return self._insert("chat_messages", ["session_id", "role", "content"] + optional, values)
+
+    def _copy_summaries(self, rows: List[Dict[str, Any]]) -> int:
+        text_column = next((column for column in ("summary_text", "summary")
+                            if column in self._table_columns("chat_summaries_old")), None)
+        if text_column is None:
+            return 0
+        rows = [row for row in rows if row.get("session_id") is not None and row.get(text_column)]
+        session_map = self._ensure_sessions(str(row["session_id"]) for row in rows)
+        optional = self._optional_columns("chat_summaries_old", ("created_at",))
+        values = []
+        for row in rows:
+            value = {
+                "session_id": session_map[str(row["session_id"])],
+                "summary_text": str(row[text_column]),
+                "message_count": int(row.get("message_count") or 0),
+            }
+            value.update({column: row[column] for column in optional})
+            values.append(value)
+        return self._insert("chat_summaries", ["session_id", "summary_text", "message_count"] + optional, values)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+长期记忆检索模块
+消息保存时写入向量，构建提示词时从最近窗口之外的历史消息中召回与当前输入最相关的若干条
+"""
+
+import time
+import threading
+from typing import List, Dict, Any, Optional, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # numpy为可选依赖，缺失时长期记忆自动关闭
+    np = None
+
+try:
+    from .vector_store import VectorStore
+    from .log_manager import log_manager
+except ImportError:
+    from vector_store import VectorStore
+    from log_manager import log_manager
+
+
+class LongTermMemory:
+    """
+    基于向量检索的长期记忆
+
+    1. 消息保存后调用 remember 写入向量存储，命名空间默认为会话ID
+    2. 构建提示词前调用 recall，按消息ID排除最近窗口内已经在上下文中的消息，返回相似度最高的 top_k 条
+    3. 会话删除或清空时调用 forget 标记删除，空间由向量存储的后台压缩回收
+    """
+
+    def __init__(self, embedder, vector_store: Optional[VectorStore] = None, storage_dir: Optional[str] = None,
+                 top_k: int = 3, min_similarity: float = 0.3, max_chars: int = 500):
+        """初始化长期记忆"""
+        if np is None:
+            raise ImportError("LongTermMemory 需要安装 numpy")
+        self.embedder = embedder
+        self.store = vector_store or VectorStore(storage_dir, dim=embedder.dim)
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.max_chars = max_chars
+
+        self._lock = threading.Lock()
+        self._stats = {"remembered": 0, "recalls": 0, "recalled_items": 0, "recall_ms": 0.0}
+
+    def remember(self, namespace: str, role: str, content: str, message_id: Optional[int] = None):
+        """
+        将一条消息写入长期记忆
+
+        Args:
+            namespace (str): 命名空间，通常为会话ID
+            role (str): 消息角色
+            content (str): 消息内容
+            message_id (int): 消息ID，召回时据此排除已在上下文窗口中的消息
+        """
+        if not content:
+            return
+        vector = self.embedder.embed([content])
+        item = {"role": role, "content": content[:self.max_chars], "ts": time.time(), "message_id": message_id}
+        self.store.add(namespace, vector, [item])
+        with self._lock:
+            self._stats["remembered"] += 1
+
+    def recall(self, namespace: str, query: str, exclude_recent: int = 0,
+               top_k: Optional[int] = None, exclude_ids: Optional[Sequence[int]] = None) -> List[Dict[str, Any]]:
+        """
+        召回与查询最相关的历史消息
+
+        Args:
+            namespace (str): 命名空间
+            query (str): 当前用户输入
+            exclude_recent (int): 排除最近写入的条数
+            top_k (int): 返回数量，默认使用初始化参数
+            exclude_ids (List[int]): 排除这些消息ID（已在上下文窗口中的消息）。按ID排除不受写入失败或
+                尚未写入的当前消息影响，优先于 exclude_recent 使用
+
+        Returns:
+            List[Dict]: 按原始顺序排列的消息，包含 role、content、similarity
+        """
+        started = time.perf_counter()
+        if not query:
+            return []
+        top_k = top_k or self.top_k
+        excluded = set(exclude_ids or ())
+        query_vector = self.embedder.embed([query])
+        # 多取被排除的条数，过滤后仍能返回 top_k 条
+        matches = self.store.search(query_vector, top_k + len(excluded), namespace=namespace,
+                                    exclude_last=max(exclude_recent, 0))[0]
+        matches = [m for m in matches if m.get("message_id") is None or m["message_id"] not in excluded][:top_k]
+
+        # 过滤低相似度结果后按写入时间恢复对话顺序
+        matches = sorted((m for m in matches if m["similarity"] >= self.min_similarity), key=lambda m: m["ts"])
+        results = [{"role": m["role"], "content": m["content"], "similarity": m["similarity"]} for m in matches]
+        with self._lock:
+            self._stats["recalls"] += 1
+            self._stats["recalled_items"] += len(results)
+            self._stats["recall_ms"] += (time.perf_counter() - started) * 1000
+        return results
+
+    def forget(self, namespace: str):
+        """删除命名空间的全部记忆"""
+        deleted = self.store.delete_namespace(namespace)
+        log_manager.log_database_operation(namespace, "delete", "long_term_memory", {"deleted": deleted}, "database")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取长期记忆统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["recall_ms"] = round(stats["recall_ms"], 2)
+        stats["vector_store"] = self.store.get_stats()
+        return stats
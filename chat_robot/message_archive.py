@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+消息归档模块
+把长期没有新消息的会话的全部消息压缩为一条归档记录（zstd压缩的JSONL，存放在 chat_message_archives 表），
+并从 chat_messages 中删除，使热表保持较小。读取历史消息时按需解压归档，会话有新消息写入时先恢复到热表。
+内存搜索索引构建时会解压归档一并索引；MySQL全文索引只覆盖热表，归档会话的消息在恢复前搜索不到。
+"""
+
+import json
+import threading
+import time
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstandard为可选依赖，缺失时使用zlib压缩
+    zstandard = None
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+# 归档中保存的消息字段，恢复到热表时原样写回（包括原消息ID）
+ARCHIVED_FIELDS = ("id", "parent_message_id", "role", "content", "model_name", "tokens_used", "cost", "metadata",
+                   "created_at")
+
+ARCHIVE_LOCK_NAME = "chat_robot:message_archive"
+
+
+def encode_messages(messages: List[Dict[str, Any]], level: int = 9) -> Dict[str, Any]:
+    """
+    把消息列表编码为压缩的JSONL
+
+    Returns:
+        Dict: codec、payload、raw_bytes、compressed_bytes
+    """
+    raw = "\n".join(json.dumps(message, ensure_ascii=False, default=str) for message in messages).encode("utf-8")
+    if zstandard is not None:
+        codec, payload = "zstd", zstandard.ZstdCompressor(level=level).compress(raw)
+    else:
+        codec, payload = "zlib", zlib.compress(raw, min(level, 9))
+    return {"codec": codec, "payload": payload, "raw_bytes": len(raw), "compressed_bytes": len(payload)}
+
+
+def decode_messages(codec: str, payload: bytes) -> List[Dict[str, Any]]:
+    """解压归档记录，返回按时间顺序排列的消息"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("读取zstd归档需要安装 zstandard")
+        raw = zstandard.ZstdDecompressor().decompress(bytes(payload))
+    elif codec == "zlib":
+        raw = zlib.decompress(bytes(payload))
+    else:
+        raise ValueError(f"未知的归档编码: {codec}")
+    return [json.loads(line) for line in raw.decode("utf-8").split("\n") if line]
+
+
+class MessageArchive:
+    """
+    冷会话消息归档
+
+    run_once() 按主键分批查找最近 inactive_days 天内没有新消息的会话，每个会话在一个事务内
+    写入归档记录并删除热表中的消息。多进程部署时通过命名锁保证同一时间只有一个进程在归档。
+    """
+
+    def __init__(self, data_manager, inactive_days: int = 90, batch_sessions: int = 100, level: int = 9):
+        """初始化归档器"""
+        self.data_manager = data_manager
+        self.backend = data_manager.backend
+        self.inactive_days = inactive_days
+        self.batch_sessions = batch_sessions
+        self.level = level
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"runs": 0, "archived_sessions": 0, "archived_messages": 0, "raw_bytes": 0,
+                       "compressed_bytes": 0, "rehydrated_sessions": 0, "archive_reads": 0}
+
+    # ===== 归档 =====
+
+    def find_cold_sessions(self, after_id: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """查找主键大于 after_id、最近 inactive_days 天没有新消息且尚未归档的会话"""
+        cutoff = self.backend.days_ago("inactive_days")
+        return self.data_manager._query(f"""
+        SELECT s.id, s.session_id
+        FROM chat_sessions s
+        WHERE s.id > :after_id
+          AND s.status = 'active'
+          AND s.updated_at < {cutoff}
+          AND NOT EXISTS (SELECT 1 FROM chat_message_archives a WHERE a.session_id = s.id)
+          AND EXISTS (SELECT 1 FROM chat_messages m WHERE m.session_id = s.id AND m.is_deleted = FALSE)
+          AND NOT EXISTS (SELECT 1 FROM chat_messages m WHERE m.session_id = s.id AND m.created_at >= {cutoff})
+        ORDER BY s.id
+        LIMIT :limit
+        """, {"after_id": after_id, "inactive_days": int(self.inactive_days), "limit": int(limit)})
+
+    def archive_session(self, session_int_id: int) -> int:
+        """
+        归档一个会话的全部消息
+
+        Returns:
+            int: 归档的消息数
+        """
+        with self.backend.transaction():
+            # 归档整体压缩，单条压缩的消息先还原为原文
+            rows = self.data_manager.content_compressor.decode_rows(self.data_manager._query(f"""
+            SELECT {", ".join(ARCHIVED_FIELDS)}, content_compressed, content_blob
+            FROM chat_messages
+            WHERE session_id = :session_id AND is_deleted = FALSE
+            ORDER BY created_at ASC, id ASC
+            """, {"session_id": session_int_id}))
+            if not rows:
+                return 0
+            messages = [{field: float(value) if isinstance(value, Decimal) else value
+                         for field, value in row.items()} for row in rows]
+            encoded = encode_messages(messages, self.level)
+            self.data_manager._query("""
+            INSERT INTO chat_message_archives
+                (session_id, message_count, last_message_id, codec, raw_bytes, compressed_bytes, payload)
+            VALUES (:session_id, :message_count, :last_message_id, :codec, :raw_bytes, :compressed_bytes, :payload)
+            """, {"session_id": session_int_id, "message_count": len(messages),
+                  "last_message_id": max(message["id"] for message in messages), **encoded})
+            self.data_manager._query("DELETE FROM chat_messages WHERE session_id = :session_id AND id <= :last_id",
+                                     {"session_id": session_int_id,
+                                      "last_id": max(message["id"] for message in messages)})
+
+        with self._lock:
+            self._stats["archived_sessions"] += 1
+            self._stats["archived_messages"] += len(messages)
+            self._stats["raw_bytes"] += encoded["raw_bytes"]
+            self._stats["compressed_bytes"] += encoded["compressed_bytes"]
+        return len(messages)
+
+    def run_once(self, max_sessions: Optional[int] = None) -> Dict[str, Any]:
+        """
+        执行一轮归档
+
+        Args:
+            max_sessions (int): 本轮最多归档的会话数，None表示不限制
+
+        Returns:
+            Dict: 本轮归档的会话数和消息数，其他进程正在归档时 skipped 为True
+        """
+        result = {"sessions": 0, "messages": 0, "skipped": False}
+        with self.data_manager.advisory_lock(ARCHIVE_LOCK_NAME, 0) as acquired:
+            if not acquired:
+                result["skipped"] = True
+                return result
+            after_id = 0
+            while not self._stop.is_set():
+                sessions = self.find_cold_sessions(after_id, self.batch_sessions)
+                for session in sessions:
+                    if max_sessions is not None and result["sessions"] >= max_sessions:
+                        break
+                    try:
+                        result["messages"] += self.archive_session(session["id"])
+                        result["sessions"] += 1
+                    except Exception as e:
+                        print(f"归档会话 {session['session_id']} 时出错: {e}")
+                if len(sessions) < self.batch_sessions or \
+                        (max_sessions is not None and result["sessions"] >= max_sessions):
+                    break
+                after_id = sessions[-1]["id"]
+
+        with self._lock:
+            self._stats["runs"] += 1
+        if result["sessions"]:
+            log_manager.log_database_operation("system", "archive", "chat_messages", result, "database")
+        return result
+
+    def start(self, interval_seconds: float = 3600):
+        """启动后台归档线程"""
+        if self._thread is not None:
+            return
+
+        def _run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"归档消息时出错: {e}")
+                    log_manager.log_error("system", "message_archive_error", str(e), "database")
+
+        self._thread = threading.Thread(target=_run, name="message-archive", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止后台归档线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ===== 读取和恢复 =====
+
+    def load(self, session_id: str) -> List[Dict[str, Any]]:
+        """读取会话的归档消息（按时间顺序），没有归档时返回空列表"""
+        rows = self.data_manager._read("""
+        SELECT a.codec, a.payload
+        FROM chat_message_archives a
+        JOIN chat_sessions s ON a.session_id = s.id
+        WHERE s.session_id = :session_id
+        """, {"session_id": session_id}, session_id)
+        if not rows:
+            return []
+        with self._lock:
+            self._stats["archive_reads"] += 1
+        return decode_messages(rows[0]["codec"], rows[0]["payload"])
+
+    def iter_messages(self, batch_sessions: int = 100):
+        """
+        按会话分批遍历所有归档消息，用于构建内存倒排索引
+
+        Yields:
+            Dict: 与 DataManager.iter_messages_for_search 字段相同的消息
+        """
+        last_id = 0
+        while True:
+            rows = self.data_manager._read("""
+            SELECT a.session_id AS session_int_id, s.session_id, s.user_id, s.title, a.codec, a.payload
+            FROM chat_message_archives a
+            JOIN chat_sessions s ON a.session_id = s.id
+            WHERE a.session_id > :last_id AND s.status <> 'deleted'
+            ORDER BY a.session_id ASC
+            LIMIT :batch_sessions
+            """, {"last_id": last_id, "batch_sessions": batch_sessions})
+            if not rows:
+                return
+            for row in rows:
+                for message in decode_messages(row["codec"], row["payload"]):
+                    yield {"id": message["id"], "session_id": row["session_id"], "user_id": row["user_id"],
+                           "title": row["title"], "role": message["role"], "content": message["content"],
+                           "created_at": message.get("created_at")}
+            last_id = rows[-1]["session_int_id"]
+
+    def rehydrate(self, session_int_id: int) -> int:
+        """
+        把会话的归档消息写回热表并删除归档记录（会话恢复活跃时调用）
+
+        Returns:
+            int: 恢复的消息数
+        """
+        with self.backend.transaction():
+            rows = self.data_manager._query("SELECT codec, payload FROM chat_message_archives "
+                                            "WHERE session_id = :session_id", {"session_id": session_int_id})
+            if not rows:
+                return 0
+            messages = decode_messages(rows[0]["codec"], rows[0]["payload"])
+            compressor = self.data_manager.content_compressor
+            values = [{**{field: message.get(field) for field in ARCHIVED_FIELDS}, "session_id": session_int_id,
+                       **compressor.encode(message["content"])} for message in messages]
+            columns = ("session_id", "content_compressed", "content_blob") + ARCHIVED_FIELDS
+            self.backend.execute_many(
+                f"INSERT INTO chat_messages ({', '.join(columns)}) "
+                f"VALUES ({', '.join(':' + column for column in columns)})", values)
+            self.data_manager._query("DELETE FROM chat_message_archives WHERE session_id = :session_id",
+                                     {"session_id": session_int_id})
+        with self._lock:
+            self._stats["rehydrated_sessions"] += 1
+        log_manager.log_database_operation("system", "rehydrate", "chat_messages",
+                                          {"session_id": session_int_id, "messages": len(messages)}, "database")
+        return len(messages)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取归档统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["compression_ratio"] = round(stats["raw_bytes"] / stats["compressed_bytes"], 2) \
+            if stats["compressed_bytes"] else None
+        stats["background"] = self._thread is not None
+        return stats
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+本地模型多进程服务与请求路由
+启动多个 start_qwen_server.py 工作进程（每个GPU一个，或按CPU核心分组绑定），
+路由进程按未完成token数最少分发请求，同一对话尽量落在同一进程以命中前缀KV缓存
+"""
+
+import os
+import sys
+import asyncio
+import hashlib
+import argparse
+import threading
+import subprocess
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+try:
+    from .token_counter import estimate_messages_tokens
+    from .server_metrics import merge_throughput_stats
+except ImportError:
+    from token_counter import estimate_messages_tokens
+    from server_metrics import merge_throughput_stats
+
+
+class NoHealthyWorkerError(Exception):
+    """没有可用的工作进程"""
+
+
+class WorkerState:
+    """单个工作进程的负载与健康状态"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding_requests = 0
+        self.outstanding_tokens = 0
+        self.completed = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.health: Dict[str, Any] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding_requests": self.outstanding_requests,
+            "outstanding_tokens": self.outstanding_tokens,
+            "completed": self.completed,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "health": self.health,
+        }
+
+
+class ModelRouter:
+    """
+    按最少未完成token数分发请求的路由器
+
+    同一对话（系统提示词+首条用户消息相同）优先发往上次处理它的进程，
+    但该进程的未完成token数比最空闲的进程多出 affinity_slack_tokens 以上时放弃亲和性。
+    """
+
+    def __init__(self, worker_urls: List[str], affinity_slack_tokens: int = 2048, max_affinity_entries: int = 10000):
+        """初始化路由器"""
+        self.workers = [WorkerState(url) for url in worker_urls]
+        self.affinity_slack_tokens = affinity_slack_tokens
+        self.max_affinity_entries = max_affinity_entries
+        self._affinity: "OrderedDict[str, WorkerState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "affinity_hits": 0, "affinity_overrides": 0, "retries": 0, "errors": 0}
+
+    @staticmethod
+    def affinity_key(messages: List[Dict[str, Any]]) -> str:
+        """对话标识：系统提示词与首条用户消息的哈希"""
+        system = next((m.get("content") or "" for m in messages if m.get("role") == "system"), "")
+        first_user = next((m.get("content") or "" for m in messages if m.get("role") == "user"), "")
+        return hashlib.sha1(f"{system}\x00{first_user}".encode("utf-8")).hexdigest()
+
+    def acquire(self, affinity_key: Optional[str], estimated_tokens: int,
+                exclude: Optional[WorkerState] = None) -> WorkerState:
+        """选择工作进程并登记未完成负载"""
+        with self._lock:
+            candidates = [w for w in self.workers if w.healthy and w is not exclude]
+            if not candidates:
+                raise NoHealthyWorkerError("没有可用的模型工作进程")
+            least = min(candidates, key=lambda w: (w.outstanding_tokens, w.outstanding_requests))
+            chosen = least
+
+            preferred = self._affinity.get(affinity_key) if affinity_key else None
+            if preferred is not None and preferred in candidates:
+                if preferred.outstanding_tokens - least.outstanding_tokens <= self.affinity_slack_tokens:
+                    chosen = preferred
+                    self._stats["affinity_hits"] += 1
+                else:
+                    self._stats["affinity_overrides"] += 1
+
+            if affinity_key:
+                self._affinity[affinity_key] = chosen
+                self._affinity.move_to_end(affinity_key)
+                while len(self._affinity) > self.max_affinity_entries:
+                    self._affinity.popitem(last=False)
+
+            chosen.outstanding_requests += 1
+            chosen.outstanding_tokens += estimated_tokens
+            self._stats["requests"] += 1
+            return chosen
+
+    def release(self, worker: WorkerState, estimated_tokens: int, error: Optional[str] = None):
+        """请求结束后释放负载；连接失败的进程标记为不健康，等待健康检查恢复"""
+        with self._lock:
+            worker.outstanding_requests -= 1
+            worker.outstanding_tokens -= estimated_tokens
+            if error is None:
+                worker.completed += 1
+            else:
+                worker.failures += 1
+                worker.last_error = error
+                worker.healthy = False
+                self._stats["errors"] += 1
+
+    def record_retry(self):
+        with self._lock:
+            self._stats["retries"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取路由统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["affinity_entries"] = len(self._affinity)
+            stats["workers"] = [w.to_dict() for w in self.workers]
+            return stats
+
+
+def create_router_app(router: ModelRouter, transport: Optional[httpx.AsyncBaseTransport] = None,
+                      request_timeout: float = 600, health_interval: float = 5) -> FastAPI:
+    """
+    创建路由服务，对外提供与单个模型服务相同的接口
+
+    Args:
+        router (ModelRouter): 路由器
+        transport: httpx传输层（测试时可替换）
+        request_timeout (float): 转发请求的超时秒数
+        health_interval (float): 健康检查间隔秒数，<=0 时不启动后台检查
+    """
+    app = FastAPI(title="Qwen模型路由")
+    client = httpx.AsyncClient(timeout=request_timeout, transport=transport)
+
+    async def check_health():
+        """检查所有工作进程，恢复已重新可用的进程"""
+        async def check(worker: WorkerState):
+            try:
+                response = await client.get(f"{worker.url}/health", timeout=5)
+                worker.health = response.json()
+                worker.healthy = response.status_code == 200 and worker.health.get("status") == "ok"
+            except Exception as e:
+                worker.healthy = False
+                worker.last_error = str(e)
+        await asyncio.gather(*(check(worker) for worker in router.workers))
+
+    async def health_loop():
+        while True:
+            await asyncio.sleep(health_interval)
+            await check_health()
+
+    @app.on_event("startup")
+    async def startup():
+        if health_interval > 0:
+            app.state.health_task = asyncio.create_task(health_loop())
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        task = getattr(app.state, "health_task", None)
+        if task is not None:
+            task.cancel()
+        await client.aclose()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        estimated = estimate_messages_tokens(messages) + int(body.get("max_tokens") or 512)
+        key = ModelRouter.affinity_key(messages)
+
+        failed = None
+        for attempt in range(2):
+            try:
+                worker = router.acquire(key, estimated, exclude=failed)
+            except NoHealthyWorkerError as e:
+                return JSONResponse(status_code=503, content={"error": str(e)}, headers={"Retry-After": "5"})
+            try:
+                response = await client.post(f"{worker.url}/v1/chat/completions", json=body)
+            except httpx.TransportError as e:
+                # 连接失败的进程摘除后换一个进程重试一次
+                router.release(worker, estimated, error=str(e))
+                failed = worker
+                if attempt == 0:
+                    router.record_retry()
+                continue
+            router.release(worker, estimated)
+            try:
+                content = response.json()
+            except ValueError:
+                # 工作进程返回了非JSON内容（例如崩溃时的纯文本错误页）：错误状态码原样透传，成功状态码改为502
+                status_code = response.status_code if response.status_code >= 400 else 502
+                content = {"error": response.text or "模型工作进程返回了无效的响应"}
+                return JSONResponse(status_code=status_code, content=content,
+                                    headers={"X-Model-Worker": worker.url})
+            return JSONResponse(status_code=response.status_code, content=content,
+                                headers={"X-Model-Worker": worker.url})
+        return JSONResponse(status_code=502, content={"error": "模型工作进程不可用"})
+
+    @app.get("/v1/models")
+    async def list_models():
+        """合并所有工作进程的模型列表"""
+        async def fetch(worker: WorkerState):
+            try:
+                response = await client.get(f"{worker.url}/v1/models", timeout=5)
+                return response.json().get("data", [])
+            except Exception:
+                return []
+        models: Dict[str, Dict[str, Any]] = {}
+        for data in await asyncio.gather(*(fetch(worker) for worker in router.workers)):
+            for item in data:
+                models.setdefault(item["id"], item)
+        return {"object": "list", "data": list(models.values())}
+
+    @app.get("/health")
+    async def health():
+        """汇总健康状态：至少一个工作进程可用时为ok"""
+        await check_health()
+        healthy = sum(1 for worker in router.workers if worker.healthy)
+        content = {
+            "status": "ok" if healthy else "unavailable",
+            "healthy_workers": healthy,
+            "total_workers": len(router.workers),
+            "workers": [{"url": w.url, "healthy": w.healthy, **w.health} for w in router.workers],
+        }
+        return JSONResponse(status_code=200 if healthy else 503, content=content)
+
+    @app.get("/v1/stats")
+    async def stats():
+        return router.get_stats()
+
+    @app.get("/v1/throughput")
+    async def throughput():
+        """汇总所有可用工作进程的吞吐量统计"""
+        async def fetch(worker: WorkerState):
+            try:
+                response = await client.get(f"{worker.url}/v1/throughput", timeout=5)
+                return response.json() if response.status_code == 200 else None
+            except Exception:
+                return None
+        results = await asyncio.gather(*(fetch(worker) for worker in router.workers))
+        return merge_throughput_stats([result for result in results if result])
+
+    return app
+
+
+def launch_workers(num_workers: int, base_port: int, devices: Optional[List[str]] = None,
+                   cpu_threads: int = 0) -> List[subprocess.Popen]:
+    """
+    启动模型工作进程
+
+    Args:
+        num_workers (int): 进程数
+        base_port (int): 第一个进程的端口，其余依次递增
+        devices (List[str]): GPU编号列表，按进程轮流分配（通过 CUDA_VISIBLE_DEVICES）
+        cpu_threads (int): 每个进程绑定的CPU核心数，0表示不绑定
+    """
+    server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "start_qwen_server.py")
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env["MODEL_WORKER_PORT"] = str(base_port + index)
+        if devices:
+            env["CUDA_VISIBLE_DEVICES"] = devices[index % len(devices)]
+
+        preexec_fn = None
+        if cpu_threads > 0:
+            cores = list(range(index * cpu_threads, (index + 1) * cpu_threads))
+            env["OMP_NUM_THREADS"] = str(cpu_threads)
+            env["MKL_NUM_THREADS"] = str(cpu_threads)
+            if hasattr(os, "sched_setaffinity"):
+                preexec_fn = lambda cores=cores: os.sched_setaffinity(0, cores)
+
+        processes.append(subprocess.Popen([sys.executable, server_script], env=env,
+                                          cwd=os.path.dirname(server_script), preexec_fn=preexec_fn))
+        print(f"已启动模型工作进程 {index}（端口 {base_port + index}）")
+    return processes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动多进程本地模型服务")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("MODEL_WORKERS", "1")))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MODEL_SERVICE_PORT", "8001")))
+    parser.add_argument("--base-port", type=int, default=int(os.getenv("MODEL_WORKER_BASE_PORT", "8101")))
+    parser.add_argument("--devices", default=os.getenv("MODEL_WORKER_DEVICES", ""),
+                        help="逗号分隔的GPU编号，例如 0,1")
+    parser.add_argument("--cpu-threads", type=int, default=int(os.getenv("MODEL_WORKER_CPU_THREADS", "0")),
+                        help="每个进程绑定的CPU核心数")
+    parser.add_argument("--affinity-slack", type=int, default=int(os.getenv("ROUTER_AFFINITY_SLACK_TOKENS", "2048")))
+    args = parser.parse_args()
+
+    devices = [d.strip() for d in args.devices.split(",") if d.strip()]
+    processes = launch_workers(args.workers, args.base_port, devices, args.cpu_threads)
+    router = ModelRouter([f"http://127.0.0.1:{args.base_port + i}" for i in range(args.workers)],
+                         affinity_slack_tokens=args.affinity_slack)
+    # 工作进程加载模型期间标记为不可用，由健康检查在就绪后恢复
+    for worker in router.workers:
+        worker.healthy = False
+
+    try:
+        uvicorn.run(create_router_app(router), host="0.0.0.0", port=args.port)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+人设优化结果缓存模块
+将 /api/personas/optimize 的模型输出持久化到本地SQLite文件，重复请求无需再次调用模型
+"""
+
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+try:
+    from .embedding import normalize_text
+    from .log_manager import log_manager
+except ImportError:
+    from embedding import normalize_text
+    from log_manager import log_manager
+
+
+class OptimizationCache:
+    """
+    人设优化结果的持久化精确匹配缓存
+
+    缓存键为 (人设名称, 模型名称, 提示词模板版本)，模板升级后旧结果自动失效。
+    超过条目上限时按最近访问时间淘汰，超过有效期的条目在读取时删除。
+    """
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = 500, ttl_days: float = 30):
+        """初始化缓存文件"""
+        if db_path:
+            self.db_path = Path(db_path)
+        else:
+            # 与日志目录同级：chat_robot/cache/persona_optimize.sqlite3
+            self.db_path = Path(__file__).parent / "cache" / "persona_optimize.sqlite3"
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_days * 24 * 3600
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS persona_optimize_cache (
+                cache_key TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                template_version TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hit_count INTEGER DEFAULT 0
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_optimize_last_used ON persona_optimize_cache(last_used_at)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(name: str, model_name: str, template_version: str) -> str:
+        """计算缓存键"""
+        raw = f"{normalize_text(name)}\x1f{model_name}\x1f{template_version}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, name: str, model_name: str, template_version: str) -> Optional[str]:
+        """读取缓存的优化结果，未命中或已过期返回None"""
+        cache_key = self.make_key(name, model_name, template_version)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM persona_optimize_cache WHERE cache_key = ?",
+                (cache_key,)
+            ).fetchone()
+
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+
+            content, created_at = row
+            if now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM persona_optimize_cache WHERE cache_key = ?", (cache_key,))
+                self._conn.commit()
+                self._stats["misses"] += 1
+                self._stats["evictions"] += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE persona_optimize_cache SET last_used_at = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                (now, cache_key)
+            )
+            self._conn.commit()
+            self._stats["hits"] += 1
+            return content
+
+    def set(self, name: str, model_name: str, template_version: str, content: str):
+        """写入优化结果并按需淘汰旧条目"""
+        if not content:
+            return
+        cache_key = self.make_key(name, model_name, template_version)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO persona_optimize_cache
+                    (cache_key, name, model_name, template_version, content, created_at, last_used_at, hit_count)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+            """, (cache_key, name.strip(), model_name, template_version, content, now, now))
+            self._stats["stores"] += 1
+
+            # 超过上限时删除最久未使用的条目
+            total = self._conn.execute("SELECT COUNT(*) FROM persona_optimize_cache").fetchone()[0]
+            overflow = total - self.max_entries
+            if overflow > 0:
+                self._conn.execute("""
+                    DELETE FROM persona_optimize_cache WHERE cache_key IN (
+                        SELECT cache_key FROM persona_optimize_cache ORDER BY last_used_at ASC LIMIT ?
+                    )
+                """, (overflow,))
+                self._stats["evictions"] += overflow
+            self._conn.commit()
+
+        log_manager.log_database_operation("system", "insert", "persona_optimize_cache", {
+            "name": name,
+            "model_name": model_name,
+            "template_version": template_version
+        }, "database")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM persona_optimize_cache")
+            self._conn.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM persona_optimize_cache").fetchone()[0]
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["entries"] = entries
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+前缀KV缓存模块
+本地模型服务按token前缀哈希复用 past_key_values，多轮对话中人设提示词和历史消息只需预填充一次
+"""
+
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class _Entry:
+    """一份缓存的KV及其对应的token序列"""
+
+    def __init__(self, entry_id: int, token_ids: Tuple[int, ...], kv: Any, nbytes: int, block_hashes: List[bytes]):
+        self.entry_id = entry_id
+        self.token_ids = token_ids
+        self.kv = kv
+        self.nbytes = nbytes
+        self.block_hashes = block_hashes
+
+
+class PrefixKVCache:
+    """
+    按token前缀哈希索引的KV缓存
+
+    token序列按 block_size 切块，每个块边界处的前缀计算链式哈希并指向包含该前缀的缓存条目。
+    查找时取与新输入共享的最长块边界前缀，复制对应条目的KV并截断到该长度，
+    生成时只需对剩余的新token做预填充。条目总大小超过 max_bytes 时按LRU淘汰。
+
+    KV对象的复制、截断和大小计算由调用方提供，便于在没有torch的环境中测试。
+    """
+
+    def __init__(self, max_bytes: int, block_size: int = 32,
+                 size_fn: Optional[Callable[[Any], int]] = None,
+                 crop_fn: Optional[Callable[[Any, int], Any]] = None,
+                 copy_fn: Callable[[Any], Any] = copy.deepcopy):
+        """初始化前缀缓存"""
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.size_fn = size_fn or (lambda kv: len(kv))
+        self.crop_fn = crop_fn or (lambda kv, length: kv[:length])
+        self.copy_fn = copy_fn
+
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._index: Dict[bytes, int] = {}
+        self._next_id = 1
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0,
+                       "reused_tokens": 0, "prefilled_tokens": 0}
+
+    def _block_hashes(self, token_ids: Sequence[int], max_length: int) -> List[bytes]:
+        """计算每个完整块边界处前缀的链式哈希"""
+        hashes = []
+        previous = b""
+        for end in range(self.block_size, max_length + 1, self.block_size):
+            block = ",".join(str(int(t)) for t in token_ids[end - self.block_size:end]).encode("ascii")
+            previous = hashlib.blake2b(previous + block, digest_size=16).digest()
+            hashes.append(previous)
+        return hashes
+
+    def lookup(self, token_ids: Sequence[int]) -> Tuple[Optional[Any], int]:
+        """
+        查找可复用的最长前缀
+
+        Args:
+            token_ids: 本次请求的完整输入token序列
+
+        Returns:
+            Tuple: (截断后的KV副本, 复用的token数)，未命中时为 (None, 0)
+        """
+        # 至少保留最后一个token用于预填充，生成第一个新token需要它的logits
+        hashes = self._block_hashes(token_ids, len(token_ids) - 1)
+        with self._lock:
+            for depth in range(len(hashes) - 1, -1, -1):
+                entry_id = self._index.get(hashes[depth])
+                if entry_id is None:
+                    continue
+                entry = self._entries[entry_id]
+                self._entries.move_to_end(entry_id)
+                length = (depth + 1) * self.block_size
+                kv = entry.kv
+                self._stats["hits"] += 1
+                self._stats["reused_tokens"] += length
+                self._stats["prefilled_tokens"] += len(token_ids) - length
+                break
+            else:
+                self._stats["misses"] += 1
+                self._stats["prefilled_tokens"] += len(token_ids)
+                return None, 0
+
+        # 复制在锁外进行，避免阻塞其他请求的查找
+        return self.crop_fn(self.copy_fn(kv), length), length
+
+    def store(self, token_ids: Sequence[int], kv: Any):
+        """
+        缓存一次生成后的KV
+
+        Args:
+            token_ids: KV中已包含的token序列（长度应等于KV的序列长度）
+            kv: past_key_values，之后不能再被调用方修改
+        """
+        hashes = self._block_hashes(token_ids, len(token_ids))
+        if not hashes:
+            return
+        nbytes = self.size_fn(kv)
+        if nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            # 已有条目完整覆盖相同前缀时只刷新访问顺序
+            existing_id = self._index.get(hashes[-1])
+            if existing_id is not None and len(self._entries[existing_id].block_hashes) == len(hashes):
+                self._entries.move_to_end(existing_id)
+                return
+
+            entry = _Entry(self._next_id, tuple(token_ids), kv, nbytes, hashes)
+            self._next_id += 1
+            self._entries[entry.entry_id] = entry
+            self._bytes += nbytes
+            # 块哈希指向最新的条目，较长的新条目可以完整替代旧条目的前缀
+            for block_hash in hashes:
+                self._index[block_hash] = entry.entry_id
+            self._stats["stores"] += 1
+
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._remove_index(evicted)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
+
+    def _remove_index(self, entry: _Entry):
+        """移除指向被淘汰条目的索引（调用方需持有锁）"""
+        for block_hash in entry.block_hashes:
+            if self._index.get(block_hash) == entry.entry_id:
+                # 若仍有其他条目包含该前缀，改为指向它们中最近使用的一个
+                replacement = None
+                for other in reversed(self._entries.values()):
+                    if block_hash in other.block_hashes:
+                        replacement = other.entry_id
+                        break
+                if replacement is None:
+                    del self._index[block_hash]
+                else:
+                    self._index[block_hash] = replacement
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["hits"] + stats["misses"]
+            total_tokens = stats["reused_tokens"] + stats["prefilled_tokens"]
+            stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+            stats["token_reuse_ratio"] = round(stats["reused_tokens"] / total_tokens, 4) if total_tokens else 0.0
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+            stats["max_bytes"] = self.max_bytes
+            return stats
@@ -1,6 +1,30 @@
-from typing import List, Dict, Any, Optional
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Tuple
 from openai import OpenAI
 from .log_manager import log_manager
+from .token_counter import estimate_tokens
+
+# 角色扮演模板，修改模板内容时递增版本号使已编译的提示词失效
+ROLE_PLAY_TEMPLATE = "你必须严格扮演以下角色，不得透露自己是AI或语言模型：\n\n{}\n\n如果未提供具体人设，你可以自由回答用户的问题。"
+TEMPLATE_VERSION = 1
+
+DEFAULT_SYSTEM_PROMPT = "你是一个AI助手，请根据用户的需求提供准确、有用的回答。"
+
+# 编译缓存的最大条目数
+COMPILED_PROMPT_CACHE_SIZE = 1024
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """编译好的人设提示词，即系统提示词中每轮不变的前缀"""
+    text: str
+    tokens: int
+    prefix_hash: str
+    source: str
+
 
 class PromptManager:
     """提示词管理器，负责构建和管理聊天提示词"""
@@ -8,10 +32,67 @@ class PromptManager:
     def __init__(self, client: OpenAI):
         """初始化提示词管理器"""
         self.client = client
+        self._compiled: "OrderedDict[Tuple, CompiledPrompt]" = OrderedDict()
+        self._compiled_lock = threading.Lock()
+        self._stats = {"compile_hits": 0, "compile_misses": 0}
         # 记录提示词管理器初始化
         log_manager.log_system_prompt("system", "PromptManager initialized", "prompt")
     
-    def build_system_prompt(self, base_prompt: str, persona_prompt: str = "", history_summary: str = "") -> str:
+    def compile_persona_prompt(self, base_prompt: str, persona_prompt: str = "", persona_id: Optional[int] = None,
+                               persona_version: Any = None, session_id: str = "system") -> CompiledPrompt:
+        """
+        编译人设提示词（套用角色扮演模板并预先计算token数和前缀哈希）
+
+        结果按 (人设ID, 人设版本, 模板版本) 缓存；没有人设ID时（旧版内联提示词或基础提示词）按提示词内容缓存。
+        缓存的原始提示词与本次不一致时（人设被修改但版本未变）重新编译。
+
+        Args:
+            base_prompt (str): 基础系统提示词
+            persona_prompt (str): 人设提示词
+            persona_id (int): 人设ID，可选
+            persona_version: 人设版本（如 updated_at），可选
+            session_id (str): 会话ID，仅用于日志
+
+        Returns:
+            CompiledPrompt: 编译好的提示词
+        """
+        source = persona_prompt or base_prompt or ""
+        if persona_id:
+            key = ("persona", persona_id, persona_version, TEMPLATE_VERSION)
+        else:
+            key = ("text", hashlib.sha256(source.encode("utf-8")).hexdigest(), TEMPLATE_VERSION)
+
+        with self._compiled_lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None and compiled.source == source:
+                self._compiled.move_to_end(key)
+                self._stats["compile_hits"] += 1
+                return compiled
+            self._stats["compile_misses"] += 1
+
+        # 有人设或基础提示词时套用模板，都没有时使用默认提示词
+        text = ROLE_PLAY_TEMPLATE.format(source) if source else DEFAULT_SYSTEM_PROMPT
+        compiled = CompiledPrompt(
+            text=text,
+            tokens=estimate_tokens(text),
+            prefix_hash=hashlib.sha256(f"{TEMPLATE_VERSION}\x1f{text}".encode("utf-8")).hexdigest(),
+            source=source
+        )
+        with self._compiled_lock:
+            self._compiled[key] = compiled
+            self._compiled.move_to_end(key)
+            while len(self._compiled) > COMPILED_PROMPT_CACHE_SIZE:
+                self._compiled.popitem(last=False)
+
+        # 完整提示词只在编译时记录一次，之后每轮只记录前缀哈希
+        log_manager.log_system_prompt(session_id, f"Compiled system prompt {compiled.prefix_hash[:12]} "
+                                                  f"(persona: {persona_id}, tokens: {compiled.tokens}):\n{text}", "prompt")
+        return compiled
+
+    def build_system_prompt(self, base_prompt: str, persona_prompt: str = "", history_summary: str = "",
+                            relevant_memories: Optional[List[Dict[str, str]]] = None,
+                            persona_id: Optional[int] = None, persona_version: Any = None,
+                            session_id: str = "system") -> str:
         """
         构建系统提示词
         
@@ -19,31 +100,52 @@ class PromptManager:
             base_prompt (str): 基础系统提示词
             persona_prompt (str): 人设提示词
             history_summary (str): 历史对话摘要
+            relevant_memories (List[Dict[str, str]]): 从长期记忆中召回的相关历史消息
+            persona_id (int): 人设ID，用于缓存编译结果，可选
+            persona_version: 人设版本，可选
+            session_id (str): 会话ID，仅用于日志
             
         Returns:
             str: 完整的系统提示词
         """
-        # 使用模板提示用户需要扮演的人设是什么
-        template = "你必须严格扮演以下角色，不得透露自己是AI或语言模型：\n\n{}\n\n如果未提供具体人设，你可以自由回答用户的问题。"
-        
-        # 如果有人设提示词，使用人设提示词
-        if persona_prompt:
-            full_system_prompt = template.format(persona_prompt)
-        # 如果有基础提示词，使用基础提示词
-        elif base_prompt:
-            full_system_prompt = template.format(base_prompt)
-        # 如果都没有，使用默认模板
-        else:
-            full_system_prompt = "你是一个AI助手，请根据用户的需求提供准确、有用的回答。"
-            
+        compiled = self.compile_persona_prompt(base_prompt, persona_prompt, persona_id, persona_version, session_id)
+        return self.render_system_prompt(compiled, history_summary, relevant_memories, session_id)
+
+    def render_system_prompt(self, compiled: CompiledPrompt, history_summary: str = "",
+                             relevant_memories: Optional[List[Dict[str, str]]] = None,
+                             session_id: str = "system") -> str:
+        """在编译好的前缀后附加本轮的历史摘要和召回的历史消息"""
+        full_system_prompt = compiled.text
+
         # 如果有历史摘要，添加到系统提示词中
         if history_summary:
             full_system_prompt = f"{full_system_prompt}\n\n历史对话摘要：{history_summary}"
+
+        # 如果有召回的相关历史消息，按原始顺序附加
+        if relevant_memories:
+            role_names = {"user": "用户", "assistant": "助手"}
+            memory_lines = "\n".join(
+                f"{role_names.get(memory['role'], memory['role'])}: {memory['content']}" for memory in relevant_memories
+            )
+            full_system_prompt = f"{full_system_prompt}\n\n相关的历史对话片段：\n{memory_lines}"
             
         # 记录系统提示词构建
-        log_manager.log_system_prompt("system", f"Built system prompt with persona: {bool(persona_prompt)}, history: {bool(history_summary)}", "prompt")
+        log_manager.log_system_prompt(session_id, f"Built system prompt with prefix: {compiled.prefix_hash[:12]}, history: {bool(history_summary)}, memories: {len(relevant_memories or [])}, characters: {len(full_system_prompt)}", "prompt")
         
         return full_system_prompt
+
+    def estimate_system_prompt_tokens(self, compiled: CompiledPrompt, system_prompt: str) -> int:
+        """估算系统提示词的token数，前缀部分使用编译时的结果，只估算本轮附加的部分"""
+        if system_prompt.startswith(compiled.text):
+            return compiled.tokens + estimate_tokens(system_prompt[len(compiled.text):])
+        return estimate_tokens(system_prompt)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取编译缓存统计"""
+        with self._compiled_lock:
+            stats = dict(self._stats)
+            stats["compiled_prompts"] = len(self._compiled)
+        return stats
     
     def build_messages(self, system_prompt: str, recent_messages: List[Dict[str, str]], 
                       user_input: str) -> List[Dict[str, str]]:
@@ -84,10 +186,20 @@ class PromptManager:
         Returns:
             str: 历史记录摘要
         """
+        return self.summarize_history_with_usage(session_id, history_messages, model_name, max_tokens)[0]
+
+    def summarize_history_with_usage(self, session_id: str, history_messages: List[Dict[str, str]],
+                                     model_name: str, max_tokens: int = 512) -> Tuple[str, Any]:
+        """
+        对历史聊天记录进行摘要，同时返回模型响应的usage（用于记入用量账本）
+
+        Returns:
+            Tuple[str, Any]: 历史记录摘要和usage，没有调用模型或调用失败时usage为None
+        """
         if not history_messages:
             # 记录空历史消息
             log_manager.log_system_prompt(session_id, "No history messages to summarize", "prompt")
-            return ""
+            return "", None
         
         # 格式化历史消息
         history_text = "\n".join([f"{msg['role']}: {msg['content']}" for msg in history_messages])
@@ -113,9 +225,9 @@ class PromptManager:
             # 记录摘要生成结果
             if content:
                 log_manager.log_system_prompt(session_id, f"Generated summary with {len(content)} characters", "prompt")
-            return content.strip() if content else ""
+            return (content.strip() if content else ""), getattr(response, "usage", None)
         except Exception as e:
             print(f"生成摘要时出错: {e}")
             # 记录摘要生成错误
             log_manager.log_error(session_id, "summary_generation_error", str(e), "prompt")
-            return ""
\ No newline at end of file
+            return "", None
\ No newline at end of file
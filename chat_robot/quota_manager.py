@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+用户配额模块
+按用户的每日/每月token数和请求数配额检查请求，计数来自用量账本的内存计数，
+超过硬限制的请求在访问数据库和调用模型之前直接拒绝。
+系统内部调用（SYSTEM_USER_ID）不受配额限制；未提供 user_id 的请求共用一个匿名计数（按默认配额限制），
+allow_anonymous 为False时直接拒绝
+"""
+
+import time
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+
+try:
+    from .usage_ledger import SYSTEM_USER_ID
+except ImportError:
+    from usage_ledger import SYSTEM_USER_ID
+
+# 配额项：(配置键, 用量计数字段, 统计周期)
+QUOTA_FIELDS = (
+    ("daily_tokens", "total_tokens", "day"),
+    ("monthly_tokens", "total_tokens", "month"),
+    ("daily_requests", "requests", "day"),
+    ("monthly_requests", "requests", "month"),
+)
+
+
+class QuotaExceededError(Exception):
+    """用户超出配额，调用方应返回HTTP 429"""
+
+    def __init__(self, user_id: Optional[int], quota: str, limit: int, used: int, retry_after: float):
+        super().__init__(f"已超出{'今日' if quota.startswith('daily') else '本月'}"
+                         f"{'token' if quota.endswith('tokens') else '请求'}配额（{used}/{limit}）")
+        self.user_id = user_id
+        self.quota = quota
+        self.limit = limit
+        self.used = used
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+class AnonymousQuotaError(QuotaExceededError):
+    """配额开启且不允许匿名请求时，未提供 user_id 的请求被拒绝，调用方应返回HTTP 401"""
+
+    def __init__(self):
+        Exception.__init__(self, "请求需要提供 user_id")
+        self.user_id = None
+        self.quota = "anonymous"
+        self.limit = 0
+        self.used = 0
+        self.retry_after = 0
+
+
+class QuotaManager:
+    """
+    用户配额检查
+
+    每个用户的配额从 user_quotas 表加载（未配置的项使用默认配额，0表示不限制），缓存 limits_ttl 秒；
+    已用量取自 UsageLedger 的当日/当月计数（多进程部署时依赖其 refresh_seconds 汇总其他进程的用量）。达到配额的 soft_ratio 时放行并返回提醒，
+    已用量加上本次预估token数超过配额时拒绝。加载完成后每次检查只有几次字典查找。
+    """
+
+    def __init__(self, usage_ledger, data_manager=None, default_limits: Optional[Dict[str, int]] = None,
+                 soft_ratio: float = 0.8, limits_ttl: float = 300, clock: Callable[[], float] = time.time,
+                 allow_anonymous: bool = True):
+        """初始化配额管理器"""
+        self.usage_ledger = usage_ledger
+        self.allow_anonymous = allow_anonymous
+        self.data_manager = data_manager
+        self.default_limits = {name: int((default_limits or {}).get(name) or 0) for name, _, _ in QUOTA_FIELDS}
+        self.soft_ratio = soft_ratio
+        self.limits_ttl = limits_ttl
+        self._clock = clock
+        self._limits: Dict[int, Tuple[Dict[str, int], float]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"checks": 0, "soft_warnings": 0, "rejected": 0}
+
+    def get_limits(self, user_id: Optional[int]) -> Dict[str, int]:
+        """获取用户配额（带缓存），系统内部调用不限制"""
+        if user_id == SYSTEM_USER_ID:
+            return {name: 0 for name, _, _ in QUOTA_FIELDS}
+        key = user_id if user_id is not None else 0
+        now = self._clock()
+        with self._lock:
+            cached = self._limits.get(key)
+            if cached is not None and now - cached[1] < self.limits_ttl:
+                return cached[0]
+
+        limits = dict(self.default_limits)
+        if self.data_manager is not None and user_id is not None:
+            try:
+                overrides = self.data_manager.get_user_quota(user_id) or {}
+                limits.update({name: int(value) for name, value in overrides.items()
+                               if name in limits and value is not None})
+            except Exception as e:
+                print(f"加载用户配额时出错: {e}")
+        with self._lock:
+            self._limits[key] = (limits, now)
+        return limits
+
+    def invalidate(self, user_id: Optional[int] = None):
+        """配额修改后清除缓存，user_id为None时清除全部"""
+        with self._lock:
+            if user_id is None:
+                self._limits.clear()
+            else:
+                self._limits.pop(user_id, None)
+
+    def _seconds_until_reset(self, period: str) -> float:
+        """距离当日或当月配额重置的秒数"""
+        now = datetime.fromtimestamp(self._clock())
+        if period == "day":
+            reset = datetime(now.year, now.month, now.day) + timedelta(days=1)
+        else:
+            reset = datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+        return (reset - now).total_seconds()
+
+    def check(self, user_id: Optional[int], estimated_tokens: int = 0) -> Dict[str, Any]:
+        """
+        检查用户配额
+
+        Args:
+            user_id (int): 用户ID
+            estimated_tokens (int): 本次请求预估的token数
+
+        Returns:
+            Dict: allowed、warnings（达到软限制的配额项）、exceeded（超出的配额项）及 retry_after
+        """
+        limits = self.get_limits(user_id)
+        usage = {period: self.usage_ledger.get_user_usage(user_id, period) for period in ("day", "month")}
+
+        warnings = []
+        exceeded = None
+        for name, field, period in QUOTA_FIELDS:
+            limit = limits[name]
+            if limit <= 0:
+                continue
+            used = usage[period][field]
+            projected = used + (estimated_tokens if field == "total_tokens" else 1)
+            if projected > limit:
+                exceeded = {"quota": name, "limit": limit, "used": used,
+                            "retry_after": self._seconds_until_reset(period)}
+                break
+            if projected >= limit * self.soft_ratio:
+                warnings.append({"quota": name, "limit": limit, "used": used})
+
+        with self._lock:
+            self._stats["checks"] += 1
+            if exceeded is not None:
+                self._stats["rejected"] += 1
+            elif warnings:
+                self._stats["soft_warnings"] += 1
+        return {"allowed": exceeded is None, "warnings": warnings, "exceeded": exceeded}
+
+    def enforce(self, user_id: Optional[int], estimated_tokens: int = 0) -> Dict[str, Any]:
+        """检查配额，超出硬限制时抛出 QuotaExceededError，不允许匿名请求时抛出 AnonymousQuotaError"""
+        if user_id is None and not self.allow_anonymous:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise AnonymousQuotaError()
+        result = self.check(user_id, estimated_tokens)
+        exceeded = result["exceeded"]
+        if exceeded is not None:
+            raise QuotaExceededError(user_id, exceeded["quota"], exceeded["limit"], exceeded["used"],
+                                     exceeded["retry_after"])
+        return result
+
+    def get_user_status(self, user_id: Optional[int]) -> Dict[str, Any]:
+        """获取用户的配额和已用量"""
+        limits = self.get_limits(user_id)
+        usage = {period: self.usage_ledger.get_user_usage(user_id, period) for period in ("day", "month")}
+        quotas = {}
+        for name, field, period in QUOTA_FIELDS:
+            used = usage[period][field]
+            quotas[name] = {"limit": limits[name], "used": used,
+                            "remaining": max(limits[name] - used, 0) if limits[name] > 0 else None}
+        return {"user_id": user_id, "soft_ratio": self.soft_ratio, "quotas": quotas}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取配额检查统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["cached_users"] = len(self._limits)
+            return stats
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+只读副本路由模块
+DataManager 的只读查询按轮询分发到健康且延迟在阈值内的副本；刚写入过的会话在一个短窗口内固定读主库，
+保证写后读一致。副本健康状态（复制延迟）按间隔惰性检查，查询失败的副本在下次检查前不再使用。
+"""
+
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+try:
+    from .storage_backend import StorageBackend, create_backend
+except ImportError:
+    from storage_backend import StorageBackend, create_backend
+
+# 写后读固定记录超过该数量时清理已过期的记录
+MAX_PINNED_SESSIONS = 10000
+
+
+class Replica:
+    """一个只读副本及其健康状态"""
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        self.healthy = True
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.reads = 0
+        self.check_lock = threading.Lock()
+
+
+class ReplicaRouter:
+    """
+    读写分离路由
+
+    没有配置副本、会话处于写后读窗口内、当前线程在主库事务中或没有可用副本时，读请求都走主库。
+    写后读窗口记录在进程内，多进程部署时依赖负载均衡按会话粘滞或 pin_seconds 覆盖复制延迟。
+    """
+
+    def __init__(self, primary: StorageBackend, replica_urls: Optional[Sequence[str]] = None,
+                 max_lag_seconds: float = 5.0, pin_seconds: float = 5.0, health_interval: float = 5.0,
+                 clock: Callable[[], float] = time.monotonic):
+        """初始化路由"""
+        self.primary = primary
+        self.replicas: List[Replica] = [Replica(create_backend(url)) for url in (replica_urls or []) if url]
+        self.max_lag_seconds = max_lag_seconds
+        self.pin_seconds = pin_seconds
+        self.health_interval = health_interval
+        self.clock = clock
+        self._pinned: Dict[str, float] = {}
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        self._stats = {"primary_reads": 0, "pinned_reads": 0, "replica_reads": 0, "replica_errors": 0}
+
+    # ===== 写后读 =====
+
+    def note_write(self, session_id: Optional[str]):
+        """记录会话刚发生写入，pin_seconds 内该会话的读请求走主库"""
+        if not session_id or not self.replicas:
+            return
+        now = self.clock()
+        with self._lock:
+            if len(self._pinned) >= MAX_PINNED_SESSIONS:
+                self._pinned = {key: until for key, until in self._pinned.items() if until > now}
+            self._pinned[session_id] = now + self.pin_seconds
+
+    def is_pinned(self, session_id: Optional[str]) -> bool:
+        if not session_id:
+            return False
+        with self._lock:
+            until = self._pinned.get(session_id)
+            if until is None:
+                return False
+            if until <= self.clock():
+                del self._pinned[session_id]
+                return False
+            return True
+
+    # ===== 健康检查 =====
+
+    def check(self, replica: Replica):
+        """检查副本的复制延迟，延迟未知或超过阈值时标记为不健康"""
+        try:
+            lag = replica.backend.replication_lag()
+            replica.lag = lag
+            replica.healthy = lag is not None and lag <= self.max_lag_seconds
+            replica.error = None if lag is not None else "复制已中断"
+        except Exception as e:
+            replica.lag = None
+            replica.healthy = False
+            replica.error = str(e)
+        replica.checked_at = self.clock()
+
+    def _refresh(self, replica: Replica):
+        """检查间隔已到时检查副本，其他线程正在检查时沿用上次结果"""
+        if replica.checked_at is not None and self.clock() - replica.checked_at < self.health_interval:
+            return
+        if replica.check_lock.acquire(blocking=False):
+            try:
+                self.check(replica)
+            finally:
+                replica.check_lock.release()
+
+    def choose(self) -> Optional[Replica]:
+        """按轮询选择一个健康的副本，没有时返回None"""
+        if not self.replicas:
+            return None
+        start = next(self._round_robin)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            self._refresh(replica)
+            if replica.healthy:
+                return replica
+        return None
+
+    # ===== 查询 =====
+
+    def _count(self, key: str):
+        with self._lock:
+            self._stats[key] += 1
+
+    def query(self, sql: str, parameters: Optional[Dict[str, Any]] = None,
+              session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """执行只读查询，副本查询失败时回退到主库"""
+        if self.primary.in_transaction():
+            self._count("primary_reads")
+            return self.primary.query(sql, parameters)
+        if self.is_pinned(session_id):
+            self._count("pinned_reads")
+            return self.primary.query(sql, parameters)
+        replica = self.choose()
+        if replica is None:
+            self._count("primary_reads")
+            return self.primary.query(sql, parameters)
+        try:
+            rows = replica.backend.query(sql, parameters)
+        except Exception as e:
+            replica.healthy = False
+            replica.error = str(e)
+            replica.checked_at = self.clock()
+            self._count("replica_errors")
+            self._count("primary_reads")
+            return self.primary.query(sql, parameters)
+        with self._lock:
+            replica.reads += 1
+            self._stats["replica_reads"] += 1
+        return rows
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取路由统计和每个副本的状态"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pinned_sessions"] = len(self._pinned)
+        stats["replicas"] = [{
+            "url": replica.backend.engine.url.render_as_string(hide_password=True),
+            "healthy": replica.healthy,
+            "lag_seconds": replica.lag,
+            "error": replica.error,
+            "reads": replica.reads,
+        } for replica in self.replicas]
+        return stats
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+响应缓存模块
+对相同人设、相同模型、相同上下文下的重复提问复用模型回复，
+支持精确匹配和向量相似度匹配两级缓存
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, List, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .embedding import normalize_text
+    from .log_manager import log_manager
+except ImportError:
+    from embedding import normalize_text
+    from log_manager import log_manager
+
+
+@dataclass
+class _CacheEntry:
+    """缓存条目"""
+    partition_key: str
+    normalized_input: str
+    response: str
+    created_at: float
+    latency_ms: float
+    size_bytes: int
+    embedding: Any = None
+
+
+@dataclass
+class CacheHit:
+    """缓存命中结果"""
+    response: str
+    tier: str  # exact / semantic
+    similarity: float = 1.0
+    latency_saved_ms: float = 0.0
+
+
+@dataclass
+class _SemanticPartition:
+    """同一分区内的向量索引（暴力检索，按需重建矩阵）"""
+    keys: List[str] = field(default_factory=list)
+    matrix: Any = None
+    dirty: bool = True
+
+
+class ResponseCache:
+    """
+    模型回复缓存
+
+    缓存键由 (persona_id, model, 最近上下文哈希) 组成的分区键加上规范化后的用户输入构成：
+    1. 精确层：规范化输入完全相同时直接命中
+    2. 语义层：同一分区内输入向量的余弦相似度超过阈值时命中
+    条目受TTL、条目数上限（LRU淘汰）和内存上限共同约束。
+    """
+
+    def __init__(self, embedder=None, ttl_seconds: float = 3600, max_entries: int = 1000,
+                 max_memory_bytes: int = 64 * 1024 * 1024, similarity_threshold: float = 0.92,
+                 context_messages: int = 4):
+        """初始化响应缓存"""
+        self.embedder = embedder if np is not None else None
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_memory_bytes = max_memory_bytes
+        self.similarity_threshold = similarity_threshold
+        self.context_messages = context_messages
+
+        # OrderedDict 维护LRU顺序，最近使用的条目在末尾
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._partitions: Dict[str, _SemanticPartition] = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions_lru": 0,
+            "evictions_ttl": 0,
+            "evictions_memory": 0,
+            "latency_saved_ms": 0.0,
+        }
+
+    def make_partition_key(self, persona_id: Optional[int], model: str,
+                           context_messages: List[Dict[str, str]]) -> str:
+        """根据人设、模型和最近上下文计算分区键"""
+        recent = context_messages[-self.context_messages:] if self.context_messages > 0 else []
+        hasher = hashlib.sha256()
+        hasher.update(f"{persona_id or 0}\x1f{model}".encode("utf-8"))
+        for msg in recent:
+            hasher.update(f"\x1e{msg['role']}\x1f{normalize_text(msg['content'])}".encode("utf-8"))
+        return hasher.hexdigest()
+
+    def _make_entry_key(self, partition_key: str, normalized_input: str) -> str:
+        """计算精确匹配键"""
+        return hashlib.sha256(f"{partition_key}\x1d{normalized_input}".encode("utf-8")).hexdigest()
+
+    def lookup(self, partition_key: str, user_input: str) -> Optional[CacheHit]:
+        """
+        查询缓存
+
+        Args:
+            partition_key (str): make_partition_key 返回的分区键
+            user_input (str): 当前用户输入
+
+        Returns:
+            Optional[CacheHit]: 命中时返回缓存结果，否则返回None
+        """
+        normalized_input = normalize_text(user_input)
+        entry_key = self._make_entry_key(partition_key, normalized_input)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and now - entry.created_at > self.ttl_seconds:
+                self._remove(entry_key, "evictions_ttl")
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(entry_key)
+                return self._record_hit(entry, "exact", 1.0)
+
+            partition = self._partitions.get(partition_key)
+            has_candidates = partition is not None and partition.keys
+
+        # 语义层：向量计算放在锁外，避免阻塞其他请求
+        if self.embedder is None or not has_candidates:
+            with self._lock:
+                self._stats["misses"] += 1
+            return None
+
+        query_vector = self.embedder.embed([normalized_input])[0]
+
+        with self._lock:
+            partition = self._partitions.get(partition_key)
+            best_key, best_score = self._search_partition(partition, query_vector)
+            entry = self._entries.get(best_key) if best_key else None
+            if entry is not None and now - entry.created_at > self.ttl_seconds:
+                self._remove(best_key, "evictions_ttl")
+                entry = None
+            if entry is not None and best_score >= self.similarity_threshold:
+                self._entries.move_to_end(best_key)
+                return self._record_hit(entry, "semantic", best_score)
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, partition_key: str, user_input: str, response: str, latency_ms: float = 0.0):
+        """
+        写入缓存
+
+        Args:
+            partition_key (str): 分区键
+            user_input (str): 用户输入
+            response (str): 模型回复
+            latency_ms (float): 本次模型调用耗时，用于统计命中节省的时间
+        """
+        if not response:
+            return
+
+        normalized_input = normalize_text(user_input)
+        entry_key = self._make_entry_key(partition_key, normalized_input)
+        embedding = None
+        if self.embedder is not None:
+            embedding = self.embedder.embed([normalized_input])[0]
+
+        size_bytes = len(response.encode("utf-8")) + len(normalized_input.encode("utf-8")) + 256
+        if embedding is not None:
+            size_bytes += embedding.nbytes
+        if size_bytes > self.max_memory_bytes:
+            return
+
+        entry = _CacheEntry(
+            partition_key=partition_key,
+            normalized_input=normalized_input,
+            response=response,
+            created_at=time.time(),
+            latency_ms=latency_ms,
+            size_bytes=size_bytes,
+            embedding=embedding,
+        )
+
+        with self._lock:
+            if entry_key in self._entries:
+                self._remove(entry_key, None)
+            self._entries[entry_key] = entry
+            self._memory_bytes += size_bytes
+            if embedding is not None:
+                partition = self._partitions.setdefault(partition_key, _SemanticPartition())
+                partition.keys.append(entry_key)
+                partition.dirty = True
+            self._stats["stores"] += 1
+            self._evict()
+
+    def _search_partition(self, partition: Optional[_SemanticPartition], query_vector):
+        """在分区内暴力检索最相似的条目"""
+        if partition is None or not partition.keys:
+            return None, 0.0
+        if partition.dirty:
+            partition.matrix = np.stack([self._entries[key].embedding for key in partition.keys])
+            partition.dirty = False
+        scores = partition.matrix @ query_vector
+        best = int(np.argmax(scores))
+        return partition.keys[best], float(scores[best])
+
+    def _record_hit(self, entry: _CacheEntry, tier: str, similarity: float) -> CacheHit:
+        """记录命中统计（调用方需持有锁）"""
+        self._stats[f"{tier}_hits"] += 1
+        self._stats["latency_saved_ms"] += entry.latency_ms
+        return CacheHit(response=entry.response, tier=tier, similarity=similarity,
+                        latency_saved_ms=entry.latency_ms)
+
+    def _remove(self, entry_key: str, reason: Optional[str]):
+        """移除条目（调用方需持有锁）"""
+        entry = self._entries.pop(entry_key, None)
+        if entry is None:
+            return
+        self._memory_bytes -= entry.size_bytes
+        partition = self._partitions.get(entry.partition_key)
+        if partition is not None and entry_key in partition.keys:
+            partition.keys.remove(entry_key)
+            partition.dirty = True
+            if not partition.keys:
+                del self._partitions[entry.partition_key]
+        if reason:
+            self._stats[reason] += 1
+
+    def _evict(self):
+        """按条目数和内存上限淘汰最久未使用的条目（调用方需持有锁）"""
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)), "evictions_lru")
+        while self._memory_bytes > self.max_memory_bytes and self._entries:
+            self._remove(next(iter(self._entries)), "evictions_memory")
+
+    def purge_expired(self) -> int:
+        """清理所有过期条目，返回清理数量"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._entries.items()
+                       if now - entry.created_at > self.ttl_seconds]
+            for key in expired:
+                self._remove(key, "evictions_ttl")
+        return len(expired)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self._partitions.clear()
+            self._memory_bytes = 0
+        log_manager.log_config_change("response_cache", None, "cleared", "config")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["exact_hits"] + stats["semantic_hits"] + stats["misses"]
+            stats["lookups"] = lookups
+            stats["hit_ratio"] = round((stats["exact_hits"] + stats["semantic_hits"]) / lookups, 4) if lookups else 0.0
+            stats["latency_saved_ms"] = round(stats["latency_saved_ms"], 2)
+            stats["entries"] = len(self._entries)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["semantic_enabled"] = self.embedder is not None
+            return stats
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+数据库迁移模块
+按版本号顺序执行迁移步骤，已完成的版本记录在 schema_version 表中；
+表结构已是最新时启动只需一次查询。耗时的数据迁移按块执行，每块完成后记录检查点，中断后从检查点继续。
+"""
+
+import json
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from .log_manager import log_manager
+    from .sqlite_schema import SQLITE_COMPOSITE_INDEXES, sqlite_table_statements
+except ImportError:
+    from log_manager import log_manager
+    from sqlite_schema import SQLITE_COMPOSITE_INDEXES, sqlite_table_statements
+
+# 迁移过程使用的命名锁，多进程同时启动时只有一个进程执行迁移
+MIGRATION_LOCK_NAME = "chat_robot:schema_migrations"
+
+SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INT PRIMARY KEY,
+    description VARCHAR(255) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'running',
+    checkpoint TEXT,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    applied_at TIMESTAMP NULL,
+    duration_ms INT DEFAULT 0
+)
+"""
+
+
+class MigrationError(Exception):
+    """迁移无法执行（如等待其他进程完成迁移超时）"""
+
+
+class Migration:
+    """
+    一个迁移步骤
+
+    apply(data_manager) 一次完成；apply_chunk(data_manager, checkpoint, chunk_size) 每次处理一块，
+    返回 (新检查点, 是否完成)，检查点需可JSON序列化。步骤必须幂等：执行中断后会从头（或从检查点）重新执行。
+    """
+
+    def __init__(self, version: int, description: str, apply: Optional[Callable] = None,
+                 apply_chunk: Optional[Callable] = None):
+        if (apply is None) == (apply_chunk is None):
+            raise ValueError("apply 和 apply_chunk 必须且只能提供一个")
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.apply_chunk = apply_chunk
+
+    @property
+    def chunked(self) -> bool:
+        return self.apply_chunk is not None
+
+
+def _create_core_tables(data_manager):
+    """用户、人设、会话、消息和摘要表"""
+    if data_manager.backend.dialect == "sqlite":
+        data_manager.backend.executescript(sqlite_table_statements(
+            "users", "ai_personas", "chat_sessions", "chat_messages", "chat_summaries"))
+        return
+    db = data_manager.get_connection()
+    data_manager._create_users_table(db)
+    data_manager._create_ai_personas_v2_table(db)
+    data_manager._create_chat_sessions_v2_table(db)
+    data_manager._create_chat_messages_v2_table(db)
+    data_manager._create_chat_summaries_v2_table(db)
+
+
+def _create_composite_indexes(data_manager):
+    """复合索引和全文索引，先检查索引是否存在而不是依赖重复创建报错"""
+    backend = data_manager.backend
+    if backend.dialect == "sqlite":
+        backend.executescript(SQLITE_COMPOSITE_INDEXES)
+        return
+    indexes = [
+        ("chat_messages", "idx_messages_session_created",
+         "CREATE INDEX idx_messages_session_created ON chat_messages(session_id, created_at)"),
+        ("chat_sessions", "idx_sessions_user_updated",
+         "CREATE INDEX idx_sessions_user_updated ON chat_sessions(user_id, updated_at)"),
+        ("chat_summaries", "idx_summaries_session_type",
+         "CREATE INDEX idx_summaries_session_type ON chat_summaries(session_id, summary_type)"),
+    ]
+    for table, name, statement in indexes:
+        if not backend.index_exists(table, name):
+            backend.query(statement)
+    # 全文索引，使用ngram解析器支持中文分词（需MySQL 5.7.6+，不支持时搜索使用内存索引）
+    if not backend.index_exists("chat_messages", "ft_messages_content"):
+        try:
+            backend.query("ALTER TABLE chat_messages ADD FULLTEXT INDEX ft_messages_content (content) WITH PARSER ngram")
+        except Exception as e:
+            print(f"创建全文索引失败: {e}")
+
+
+def _create_usage_daily_table(data_manager):
+    if data_manager.backend.dialect == "sqlite":
+        data_manager.backend.executescript(sqlite_table_statements("usage_daily"))
+    else:
+        data_manager._create_usage_daily_table(data_manager.get_connection())
+
+
+def _create_user_quotas_table(data_manager):
+    if data_manager.backend.dialect == "sqlite":
+        data_manager.backend.executescript(sqlite_table_statements("user_quotas"))
+    else:
+        data_manager._create_user_quotas_table(data_manager.get_connection())
+
+
+def _create_chat_message_archives_table(data_manager):
+    if data_manager.backend.dialect == "sqlite":
+        data_manager.backend.executescript(sqlite_table_statements("chat_message_archives"))
+    else:
+        data_manager._create_chat_message_archives_table(data_manager.get_connection())
+
+
+def _add_content_compression(data_manager):
+    """消息内容压缩：chat_messages 增加压缩标记和压缩内容列，创建压缩字典表"""
+    backend = data_manager.backend
+    columns = backend.table_columns("chat_messages")
+    blob_type = "BLOB" if backend.dialect == "sqlite" else "LONGBLOB"
+    if "content_compressed" not in columns:
+        backend.query("ALTER TABLE chat_messages ADD COLUMN content_compressed BOOLEAN NOT NULL DEFAULT FALSE")
+    if "content_blob" not in columns:
+        backend.query(f"ALTER TABLE chat_messages ADD COLUMN content_blob {blob_type} NULL")
+    if backend.dialect == "sqlite":
+        backend.executescript(sqlite_table_statements("compression_dictionaries"))
+    else:
+        data_manager._create_compression_dictionaries_table(data_manager.get_connection())
+
+
+def _create_session_shards_table(data_manager):
+    if data_manager.backend.dialect == "sqlite":
+        data_manager.backend.executescript(sqlite_table_statements("session_shards"))
+    else:
+        data_manager._create_session_shards_table(data_manager.get_connection())
+
+
+def _migrate_legacy_chunk(data_manager, checkpoint, chunk_size):
+    return data_manager.legacy_migrator.apply_chunk(checkpoint, chunk_size)
+
+
+def _insert_default_data(data_manager):
+    data_manager._insert_default_data(data_manager.get_connection())
+
+
+# 按版本号排列的迁移步骤，新增步骤只能追加到末尾
+MIGRATIONS: List[Migration] = [
+    Migration(1, "创建用户、人设、会话、消息和摘要表", _create_core_tables),
+    Migration(2, "创建复合索引和全文索引", _create_composite_indexes),
+    Migration(3, "创建用量汇总表", _create_usage_daily_table),
+    Migration(4, "创建用户配额表", _create_user_quotas_table),
+    Migration(5, "迁移旧版数据表", apply_chunk=_migrate_legacy_chunk),
+    Migration(6, "插入默认用户和人设", _insert_default_data),
+    Migration(7, "创建消息归档表", _create_chat_message_archives_table),
+    Migration(8, "增加消息内容压缩列和压缩字典表", _add_content_compression),
+    Migration(9, "创建会话分片目录表", _create_session_shards_table),
+]
+
+
+class MigrationRunner:
+    """
+    迁移执行器
+
+    migrate() 先查询已完成的最大版本号，等于最新版本时直接返回；否则获取命名锁，
+    创建 schema_version 表并依次执行未完成的步骤。分块步骤每块的写入与检查点在同一事务中提交，
+    块之间按 chunk_pause 和 duty_cycle 暂停，避免长时间占用数据库影响线上请求。
+    """
+
+    def __init__(self, data_manager, migrations: Optional[List[Migration]] = None):
+        """初始化迁移执行器"""
+        self.data_manager = data_manager
+        self.migrations = sorted(migrations if migrations is not None else MIGRATIONS, key=lambda m: m.version)
+        versions = [migration.version for migration in self.migrations]
+        if len(set(versions)) != len(versions):
+            raise ValueError("迁移版本号重复")
+
+    @property
+    def latest_version(self) -> int:
+        return self.migrations[-1].version if self.migrations else 0
+
+    def current_version(self) -> Optional[int]:
+        """已完成的最大版本号，schema_version 表不存在时返回None"""
+        try:
+            rows = self.data_manager._query("SELECT MAX(version) AS version FROM schema_version "
+                                            "WHERE status = 'done'")
+        except Exception:
+            return None
+        return int(rows[0]["version"] or 0) if rows else 0
+
+    def get_status(self) -> List[Dict[str, Any]]:
+        """获取每个迁移步骤的状态（pending / running / done）"""
+        try:
+            rows = self.data_manager._query("SELECT version, status, checkpoint, applied_at, duration_ms "
+                                            "FROM schema_version")
+        except Exception:
+            rows = []
+        states = {int(row["version"]): row for row in rows}
+        status = []
+        for migration in self.migrations:
+            state = states.get(migration.version) or {}
+            status.append({
+                "version": migration.version,
+                "description": migration.description,
+                "status": state.get("status", "pending"),
+                "checkpoint": json.loads(state["checkpoint"]) if state.get("checkpoint") else None,
+                "applied_at": str(state["applied_at"]) if state.get("applied_at") else None,
+                "duration_ms": int(state.get("duration_ms") or 0),
+            })
+        return status
+
+    def migrate(self, target: Optional[int] = None, chunk_size: int = 1000, chunk_pause: float = 0.0,
+                lock_timeout: int = 60, duty_cycle: float = 1.0) -> Dict[str, Any]:
+        """
+        执行未完成的迁移
+
+        Args:
+            target (int): 迁移到的版本，None表示最新版本
+            chunk_size (int): 分块步骤每块处理的行数
+            chunk_pause (float): 分块步骤每块之间至少暂停的秒数
+            lock_timeout (int): 等待其他进程完成迁移的秒数
+            duty_cycle (float): 分块步骤占用数据库的时间比例，0.5表示每块之后暂停与该块耗时相同的时间
+
+        Returns:
+            Dict: {"version": 当前版本, "applied": 本次执行的版本列表}
+        """
+        target = self.latest_version if target is None else target
+        current = self.current_version()
+        if current is not None and current >= target:
+            return {"version": current, "applied": []}
+
+        with self.data_manager.advisory_lock(MIGRATION_LOCK_NAME, lock_timeout) as acquired:
+            if not acquired:
+                raise MigrationError(f"等待其他进程完成数据库迁移超时（{lock_timeout}秒）")
+
+            self.data_manager._query(SCHEMA_VERSION_TABLE)
+            # 获取锁后重新读取状态，其他进程可能已经完成了部分步骤
+            states = {int(row["version"]): row for row in
+                      self.data_manager._query("SELECT version, status, checkpoint FROM schema_version")}
+            applied = []
+            for migration in self.migrations:
+                if migration.version > target:
+                    break
+                state = states.get(migration.version)
+                if state is not None and state["status"] == "done":
+                    continue
+                self._run(migration, state, chunk_size, chunk_pause, duty_cycle)
+                applied.append(migration.version)
+
+        return {"version": self.current_version(), "applied": applied}
+
+    def _run(self, migration: Migration, state: Optional[Dict[str, Any]], chunk_size: int, chunk_pause: float,
+             duty_cycle: float):
+        """执行单个迁移步骤并记录结果"""
+        started = time.monotonic()
+        if state is None:
+            self.data_manager._query(
+                "INSERT INTO schema_version (version, description, status) VALUES (:version, :description, 'running')",
+                {"version": migration.version, "description": migration.description})
+        print(f"执行数据库迁移 {migration.version}: {migration.description}")
+
+        if migration.chunked:
+            checkpoint = json.loads(state["checkpoint"]) if state and state.get("checkpoint") else None
+            done = False
+            while not done:
+                chunk_started = time.monotonic()
+                # 每块的写入和检查点在同一事务中提交，中断后不会重复处理已提交的块
+                with self.data_manager.backend.transaction():
+                    checkpoint, done = migration.apply_chunk(self.data_manager, checkpoint, chunk_size)
+                    self._save_checkpoint(migration.version, checkpoint)
+                if not done:
+                    elapsed = time.monotonic() - chunk_started
+                    pause = max(chunk_pause, elapsed * (1 - duty_cycle) / duty_cycle if 0 < duty_cycle < 1 else 0)
+                    if pause > 0:
+                        time.sleep(pause)
+        else:
+            migration.apply(self.data_manager)
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        self.data_manager._query("""
+        UPDATE schema_version SET status = 'done', applied_at = CURRENT_TIMESTAMP, duration_ms = :duration_ms
+        WHERE version = :version
+        """, {"version": migration.version, "duration_ms": duration_ms})
+        log_manager.log_database_operation("system", "migrate", "schema_version", {
+            "version": migration.version,
+            "description": migration.description,
+            "duration_ms": duration_ms
+        }, "database")
+
+    def _save_checkpoint(self, version: int, checkpoint: Any):
+        self.data_manager._query("UPDATE schema_version SET checkpoint = :checkpoint WHERE version = :version",
+                                 {"version": version, "checkpoint": json.dumps(checkpoint, ensure_ascii=False)})
+
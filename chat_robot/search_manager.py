@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+聊天记录搜索模块
+MySQL部署使用ngram全文索引，SQLite/测试部署使用纯Python倒排索引，结果统一带相关度排序和摘录
+"""
+
+import re
+import math
+import time
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    from .embedding import normalize_text
+    from .log_manager import log_manager
+except ImportError:
+    from embedding import normalize_text
+    from log_manager import log_manager
+
+
+# 英文单词/数字为一个词，连续的中日韩字符切成双字（与MySQL ngram_token_size=2一致）
+_ASCII_WORD = re.compile(r"[a-z0-9_]+")
+_CJK_RUN = re.compile(r"[一-鿿぀-ヿ가-힯]+")
+
+
+def tokenize_for_search(text: str) -> List[str]:
+    """将文本切分为检索词"""
+    normalized = normalize_text(text)
+    terms = _ASCII_WORD.findall(normalized)
+    for run in _CJK_RUN.findall(normalized):
+        if len(run) == 1:
+            terms.append(run)
+        else:
+            terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+def _normalize_with_offsets(content: str) -> Tuple[str, List[int]]:
+    """逐字符规范化（同 normalize_text），同时返回规范化文本中每个字符在原文中的位置"""
+    characters, offsets = [], []
+    for index, character in enumerate(content):
+        if character.isspace():
+            # 合并连续空白并去掉首尾空白
+            if characters and characters[-1] != " ":
+                characters.append(" ")
+                offsets.append(index)
+            continue
+        for normalized in unicodedata.normalize("NFKC", character).lower():
+            characters.append(normalized)
+            offsets.append(index)
+    if characters and characters[-1] == " ":
+        characters.pop()
+        offsets.pop()
+    return "".join(characters), offsets
+
+
+def make_snippet(content: str, query: str, width: int = 80) -> str:
+    """截取内容中最先命中关键词的片段（在规范化文本中查找，再换算回原文位置）"""
+    if not content:
+        return ""
+    lowered, offsets = _normalize_with_offsets(content)
+    position = -1
+    for term in sorted(set(tokenize_for_search(query)), key=len, reverse=True):
+        position = lowered.find(term)
+        if position >= 0:
+            position = offsets[position]
+            break
+    if position < 0 or len(content) <= width:
+        return content[:width] + ("…" if len(content) > width else "")
+
+    start = max(0, position - width // 3)
+    end = min(len(content), start + width)
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    return prefix + content[start:end] + suffix
+
+
+class InvertedIndex:
+    """
+    纯Python倒排索引，使用BM25排序
+
+    用于没有全文索引能力的数据库（SQLite）和测试环境。
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """初始化倒排索引"""
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._docs: Dict[int, Dict[str, Any]] = {}
+        self._doc_lengths: Dict[int, int] = {}
+        self._session_docs: Dict[str, set] = defaultdict(set)
+        self._user_docs: Dict[Optional[int], set] = defaultdict(set)
+        self._total_length = 0
+        self._next_doc_id = 1
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, session_id: str, role: str, content: str, user_id: Optional[int] = None,
+            title: Optional[str] = None, created_at: Any = None, message_id: Optional[int] = None) -> int:
+        """添加一条消息，返回文档ID"""
+        terms = tokenize_for_search(content)
+        with self._lock:
+            doc_id = message_id if message_id is not None else -self._next_doc_id
+            self._next_doc_id += 1
+            if doc_id in self._docs:
+                return doc_id
+            counts: Dict[str, int] = defaultdict(int)
+            for term in terms:
+                counts[term] += 1
+            for term, tf in counts.items():
+                self._postings[term][doc_id] = tf
+            self._docs[doc_id] = {
+                "id": message_id,
+                "session_id": session_id,
+                "user_id": user_id,
+                "title": title,
+                "role": role,
+                "content": content,
+                "created_at": str(created_at) if created_at is not None else None,
+                "terms": list(counts),
+            }
+            self._doc_lengths[doc_id] = len(terms)
+            self._total_length += len(terms)
+            self._session_docs[session_id].add(doc_id)
+            self._user_docs[user_id].add(doc_id)
+            return doc_id
+
+    def remove_session(self, session_id: str) -> int:
+        """移除某个会话的所有消息，返回移除数量"""
+        with self._lock:
+            doc_ids = self._session_docs.pop(session_id, set())
+            for doc_id in doc_ids:
+                doc = self._docs.pop(doc_id)
+                user_docs = self._user_docs.get(doc["user_id"])
+                if user_docs is not None:
+                    user_docs.discard(doc_id)
+                    if not user_docs:
+                        del self._user_docs[doc["user_id"]]
+                for term in doc["terms"]:
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(doc_id, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_length -= self._doc_lengths.pop(doc_id)
+            return len(doc_ids)
+
+    def search(self, query: str, user_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """按BM25相关度检索，指定用户时只对该用户的文档计分（IDF仍按全部文档计算）"""
+        terms = set(tokenize_for_search(query))
+        with self._lock:
+            total_docs = len(self._docs)
+            if not terms or total_docs == 0:
+                return []
+            avg_length = self._total_length / total_docs or 1.0
+            candidates = self._user_docs.get(user_id, set()) if user_id is not None else None
+            if candidates is not None and not candidates:
+                return []
+
+            scores: Dict[int, float] = defaultdict(float)
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                if candidates is None:
+                    matched = postings.items()
+                elif len(candidates) < len(postings):
+                    matched = ((doc_id, postings[doc_id]) for doc_id in candidates if doc_id in postings)
+                else:
+                    matched = ((doc_id, tf) for doc_id, tf in postings.items() if doc_id in candidates)
+                for doc_id, tf in matched:
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+            results = []
+            for doc_id, score in ranked[:limit]:
+                doc = self._docs[doc_id]
+                result = {key: value for key, value in doc.items() if key != "terms"}
+                result["score"] = round(score, 4)
+                results.append(result)
+            return results
+
+
+class SearchManager:
+    """
+    聊天记录搜索管理器
+
+    backend:
+        mysql  使用 DataManager.search_messages（FULLTEXT ngram索引，不包含已归档会话的消息）
+        memory 使用进程内倒排索引，首次搜索时从数据库分批加载（包括归档），之后随本进程的消息写入增量更新
+        auto   根据数据库URL自动选择
+
+    内存索引只包含本进程写入的增量：多进程部署时其他进程写入或删除的消息，要等 refresh_seconds 到期后
+    下一次搜索重新全量构建索引才能看到；refresh_seconds 为0时只在首次搜索时构建，只适合单进程部署。
+    """
+
+    def __init__(self, data_manager, backend: str = "auto", max_results: int = 50, refresh_seconds: float = 0):
+        """初始化搜索管理器"""
+        self.data_manager = data_manager
+        if backend == "auto":
+            database_url = getattr(data_manager, "database_url", "") or ""
+            backend = "mysql" if database_url.startswith("mysql") else "memory"
+        self.backend = backend
+        self.max_results = max_results
+        self.refresh_seconds = refresh_seconds
+        self.index = InvertedIndex() if backend == "memory" else None
+        self._index_loaded = False
+        self._loaded_at = 0.0
+        self._load_lock = threading.Lock()
+
+    def _is_fresh(self) -> bool:
+        """索引已构建且未超过 refresh_seconds"""
+        if not self._index_loaded:
+            return False
+        return self.refresh_seconds <= 0 or time.monotonic() - self._loaded_at < self.refresh_seconds
+
+    def _ensure_index_loaded(self):
+        """首次使用或超过 refresh_seconds 时从数据库全量构建内存索引（构建完成后替换旧索引）"""
+        if self._is_fresh():
+            return
+        with self._load_lock:
+            if self._is_fresh():
+                return
+            started = time.perf_counter()
+            index = InvertedIndex()
+            try:
+                for row in self.data_manager.iter_messages_for_search():
+                    index.add(row["session_id"], row["role"], row["content"], row.get("user_id"),
+                              row.get("title"), row.get("created_at"), row["id"])
+            except Exception as e:
+                print(f"构建搜索索引时出错: {e}")
+            self.index = index
+            self._index_loaded = True
+            self._loaded_at = time.monotonic()
+            log_manager.log_database_operation("system", "build_index", "search", {
+                "documents": len(self.index),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+            }, "database")
+
+    def index_message(self, session_id: str, role: str, content: str, user_id: Optional[int] = None,
+                      title: Optional[str] = None, created_at: Any = None, message_id: Optional[int] = None):
+        """新消息写入后同步到内存索引（MySQL后端由数据库自动维护），参数与全量构建时的消息字段一致"""
+        if self.index is not None and self._index_loaded:
+            self.index.add(session_id, role, content, user_id, title, created_at, message_id)
+
+    def remove_session(self, session_id: str):
+        """会话删除或清空后从内存索引移除"""
+        if self.index is not None:
+            self.index.remove_session(session_id)
+
+    def search(self, query: str, user_id: Optional[int] = None, limit: int = 20) -> Dict[str, Any]:
+        """
+        跨会话搜索聊天记录
+
+        Args:
+            query (str): 搜索关键词
+            user_id (int): 只搜索该用户的会话
+            limit (int): 返回数量
+
+        Returns:
+            Dict: 包含 results（带 snippet）、total、took_ms、backend
+        """
+        started = time.perf_counter()
+        limit = max(1, min(int(limit), self.max_results))
+        query = (query or "").strip()
+
+        if not query:
+            rows = []
+        elif self.backend == "mysql":
+            rows = self.data_manager.search_messages(query, user_id, limit)
+        else:
+            self._ensure_index_loaded()
+            rows = self.index.search(query, user_id, limit)
+
+        results = []
+        for row in rows:
+            results.append({
+                "message_id": row.get("id"),
+                "session_id": row.get("session_id"),
+                "session_title": row.get("title"),
+                "role": row.get("role"),
+                "snippet": make_snippet(row.get("content") or "", query),
+                "score": float(row.get("score") or 0),
+                "created_at": str(row["created_at"]) if row.get("created_at") is not None else None,
+            })
+
+        return {
+            "query": query,
+            "results": results,
+            "total": len(results),
+            "took_ms": round((time.perf_counter() - started) * 1000, 2),
+            "backend": self.backend,
+        }
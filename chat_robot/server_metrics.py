@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+模型服务吞吐量统计模块
+记录每次生成的token用量和排队/预填充/解码耗时，汇总为累计值和滑动窗口内的吞吐量
+"""
+
+import time
+import uuid
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# 参与窗口平均的耗时字段
+TIMING_FIELDS = ("queue_ms", "tokenize_ms", "prefill_ms", "decode_ms", "total_ms")
+
+
+def new_completion_id() -> str:
+    """生成唯一的响应ID（与OpenAI格式一致）"""
+    return f"chatcmpl-{uuid.uuid4().hex}"
+
+
+def build_usage(prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> Dict[str, Any]:
+    """构造OpenAI格式的usage字段，cached_tokens为复用前缀KV缓存的提示词token数"""
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+class ThroughputTracker:
+    """
+    请求吞吐量统计
+
+    累计值覆盖服务启动以来的全部请求；窗口统计只包含最近 window_seconds 秒内完成的请求，
+    tokens_per_second 按窗口时长（服务运行不足一个窗口时按实际运行时长）计算。
+    """
+
+    def __init__(self, window_seconds: float = 60, clock: Callable[[], float] = time.monotonic):
+        """初始化统计器"""
+        self.window_seconds = window_seconds
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+        # (完成时间, 提示词token数, 生成token数, 耗时字典)
+        self._window: Deque[Tuple[float, int, int, Dict[str, float]]] = deque()
+        self._totals = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0,
+                        "cached_tokens": 0}
+
+    def _expire(self, now: float):
+        """移除窗口外的记录（调用方需持有锁）"""
+        while self._window and self._window[0][0] < now - self.window_seconds:
+            self._window.popleft()
+
+    def record(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0,
+               timing: Optional[Dict[str, float]] = None):
+        """记录一次成功的生成"""
+        now = self._clock()
+        with self._lock:
+            self._totals["requests"] += 1
+            self._totals["prompt_tokens"] += prompt_tokens
+            self._totals["completion_tokens"] += completion_tokens
+            self._totals["cached_tokens"] += cached_tokens
+            self._window.append((now, prompt_tokens, completion_tokens, dict(timing or {})))
+            self._expire(now)
+
+    def record_error(self):
+        """记录一次失败的生成"""
+        with self._lock:
+            self._totals["errors"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取累计和窗口吞吐量统计"""
+        now = self._clock()
+        with self._lock:
+            self._expire(now)
+            entries = list(self._window)
+            totals = dict(self._totals)
+
+        uptime = now - self._started
+        span = min(self.window_seconds, uptime) or self.window_seconds
+        prompt_tokens = sum(entry[1] for entry in entries)
+        completion_tokens = sum(entry[2] for entry in entries)
+        window: Dict[str, Any] = {
+            "seconds": self.window_seconds,
+            "requests": len(entries),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "requests_per_second": round(len(entries) / span, 4),
+            "completion_tokens_per_second": round(completion_tokens / span, 2),
+            "total_tokens_per_second": round((prompt_tokens + completion_tokens) / span, 2),
+        }
+        for field in TIMING_FIELDS:
+            values = [entry[3][field] for entry in entries if entry[3].get(field) is not None]
+            window[f"avg_{field}"] = round(sum(values) / len(values), 2) if values else None
+
+        return {"uptime_seconds": round(uptime, 1), "totals": totals, "window": window}
+
+
+def merge_throughput_stats(worker_stats: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    合并多个工作进程的吞吐量统计
+
+    计数和速率直接相加，平均耗时按各进程窗口内的请求数加权。
+    """
+    totals: Dict[str, int] = {}
+    window: Dict[str, Any] = {}
+    for stats in worker_stats:
+        for key, value in stats.get("totals", {}).items():
+            totals[key] = totals.get(key, 0) + value
+        for key, value in stats.get("window", {}).items():
+            if key == "seconds" or key.startswith("avg_"):
+                continue
+            window[key] = round(window.get(key, 0) + value, 4)
+
+    for field in TIMING_FIELDS:
+        weighted = [(stats["window"][f"avg_{field}"], stats["window"]["requests"]) for stats in worker_stats
+                    if stats.get("window", {}).get(f"avg_{field}") is not None]
+        weight = sum(count for _, count in weighted)
+        window[f"avg_{field}"] = (round(sum(avg * count for avg, count in weighted) / weight, 2)
+                                  if weight else None)
+    return {"workers": len(worker_stats), "totals": totals, "window": window}
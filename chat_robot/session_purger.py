@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+软删除数据清理模块
+delete_session / clear_session_messages 只标记删除（chat_sessions.status='deleted'、chat_messages.is_deleted），
+请求线程不再执行级联删除。后台清理器按小批次物理删除这些行，批次之间暂停，避免长时间持有锁影响线上请求。
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+PURGE_LOCK_NAME = "chat_robot:session_purger"
+
+
+class SessionPurger:
+    """
+    已删除会话和消息的后台清理器
+
+    run_once() 先删除标记为 is_deleted 的消息，再逐个清理 status='deleted' 的会话：
+    分批删除其消息和摘要，最后删除会话行本身（此时外键级联已无数据可删）。
+    每批一个短事务，批次之间至少暂停 batch_pause 秒。
+    """
+
+    def __init__(self, data_manager, batch_size: int = 500, batch_pause: float = 0.05):
+        """初始化清理器"""
+        self.data_manager = data_manager
+        self.backend = data_manager.backend
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"runs": 0, "batches": 0, "purged_messages": 0, "purged_summaries": 0, "purged_sessions": 0}
+
+    def _delete_batch(self, table: str, condition: str, parameters: Dict[str, Any]) -> int:
+        """按主键删除一批满足条件的行，返回删除的行数"""
+        with self.backend.transaction():
+            rows = self.data_manager._query(f"SELECT id FROM {table} WHERE {condition} ORDER BY id LIMIT :limit",
+                                            {**parameters, "limit": int(self.batch_size)})
+            if rows:
+                # id 为数据库返回的整数主键
+                ids = ", ".join(str(int(row["id"])) for row in rows)
+                self.data_manager._query(f"DELETE FROM {table} WHERE id IN ({ids})")
+        with self._lock:
+            self._stats["batches"] += 1
+        return len(rows)
+
+    def _drain(self, table: str, condition: str, parameters: Dict[str, Any]) -> int:
+        """分批删除直到没有满足条件的行或清理器停止"""
+        total = 0
+        while not self._stop.is_set():
+            deleted = self._delete_batch(table, condition, parameters)
+            total += deleted
+            if deleted < self.batch_size:
+                break
+            if self.batch_pause > 0:
+                time.sleep(self.batch_pause)
+        return total
+
+    def _deleted_sessions(self, limit: int) -> List[Dict[str, Any]]:
+        return self.data_manager._query("SELECT id FROM chat_sessions WHERE status = 'deleted' ORDER BY id "
+                                        "LIMIT :limit", {"limit": int(limit)})
+
+    def purge_session(self, session_int_id: int) -> Dict[str, int]:
+        """清理一个已删除的会话，返回删除的消息数和摘要数"""
+        parameters = {"session_id": session_int_id}
+        messages = self._drain("chat_messages", "session_id = :session_id", parameters)
+        summaries = self._drain("chat_summaries", "session_id = :session_id", parameters)
+        if not self._stop.is_set():
+            with self.backend.transaction():
+                self.data_manager._query("DELETE FROM chat_message_archives WHERE session_id = :session_id", parameters)
+                self.data_manager._query("DELETE FROM chat_sessions WHERE id = :session_id AND status = 'deleted'",
+                                         parameters)
+        return {"messages": messages, "summaries": summaries}
+
+    def run_once(self) -> Dict[str, Any]:
+        """
+        执行一轮清理
+
+        Returns:
+            Dict: 本轮删除的消息、摘要和会话数，其他进程正在清理时 skipped 为True
+        """
+        result = {"messages": 0, "summaries": 0, "sessions": 0, "skipped": False}
+        with self.data_manager.advisory_lock(PURGE_LOCK_NAME, 0) as acquired:
+            if not acquired:
+                result["skipped"] = True
+                return result
+            result["messages"] += self._drain("chat_messages", "is_deleted = TRUE", {})
+            while not self._stop.is_set():
+                sessions = self._deleted_sessions(self.batch_size)
+                for session in sessions:
+                    if self._stop.is_set():
+                        break
+                    purged = self.purge_session(session["id"])
+                    result["messages"] += purged["messages"]
+                    result["summaries"] += purged["summaries"]
+                    result["sessions"] += 1
+                if len(sessions) < self.batch_size:
+                    break
+
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["purged_messages"] += result["messages"]
+            self._stats["purged_summaries"] += result["summaries"]
+            self._stats["purged_sessions"] += result["sessions"]
+        if result["messages"] or result["sessions"]:
+            log_manager.log_database_operation("system", "purge", "chat_sessions", result, "database")
+        return result
+
+    def start(self, interval_seconds: float = 60):
+        """启动后台清理线程"""
+        if self._thread is not None:
+            return
+
+        def _run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    print(f"清理已删除数据时出错: {e}")
+                    log_manager.log_error("system", "session_purge_error", str(e), "database")
+
+        self._thread = threading.Thread(target=_run, name="session-purger", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止后台清理线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def get_pending(self) -> Dict[str, int]:
+        """待清理的会话数和消息数"""
+        rows = self.data_manager._query("""
+        SELECT (SELECT COUNT(*) FROM chat_sessions WHERE status = 'deleted') AS sessions,
+               (SELECT COUNT(*) FROM chat_messages WHERE is_deleted = TRUE) AS messages
+        """)
+        return {"sessions": int(rows[0]["sessions"] or 0), "messages": int(rows[0]["messages"] or 0)}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取清理统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["background"] = self._thread is not None
+        return stats
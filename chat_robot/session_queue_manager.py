@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+会话轮次排队模块
+同一会话的聊天请求按到达顺序串行执行，不同会话之间完全并行
+"""
+
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+
+class SessionQueueFullError(Exception):
+    """会话排队已满或等待超时，调用方应返回HTTP 429"""
+
+    def __init__(self, session_id: str, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.session_id = session_id
+        self.retry_after = retry_after
+
+
+class _SessionSlot:
+    """单个会话的锁状态"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.holder_since: Optional[float] = None
+
+
+class SessionQueueManager:
+    """
+    进程内的会话级异步锁管理器
+
+    1. 每个会话最多允许 max_queue_depth 个请求（含正在执行的请求），超过时立即拒绝
+    2. 排队等待超过 acquire_timeout 时拒绝，避免请求无限挂起
+    3. 持锁超过 stale_lock_seconds 的锁视为失效，由等待者替换为新锁继续执行
+    4. 会话没有排队请求时立即回收其锁对象，避免会话数量增长带来的内存占用
+    """
+
+    def __init__(self, max_queue_depth: int = 4, acquire_timeout: float = 120,
+                 stale_lock_seconds: float = 300):
+        """初始化会话排队管理器"""
+        self.max_queue_depth = max_queue_depth
+        self.acquire_timeout = acquire_timeout
+        self.stale_lock_seconds = stale_lock_seconds
+
+        self._slots: Dict[str, _SessionSlot] = {}
+        self._pending: Dict[str, int] = {}
+        self._stats = {
+            "turns": 0,
+            "queued": 0,
+            "rejected_full": 0,
+            "rejected_timeout": 0,
+            "stale_evictions": 0,
+        }
+
+    @asynccontextmanager
+    async def turn(self, session_id: str):
+        """
+        占用会话的一个执行轮次
+
+        Args:
+            session_id (str): 会话ID
+
+        Raises:
+            SessionQueueFullError: 排队已满或等待超时
+        """
+        pending = self._pending.get(session_id, 0)
+        if pending >= self.max_queue_depth:
+            self._stats["rejected_full"] += 1
+            log_manager.log_error(session_id, "session_queue_full", f"pending={pending}", "api")
+            raise SessionQueueFullError(session_id, f"会话 {session_id} 的请求排队已满，请稍后再试")
+
+        self._pending[session_id] = pending + 1
+        if pending > 0:
+            self._stats["queued"] += 1
+
+        slot = None
+        try:
+            slot = await self._acquire(session_id)
+            self._stats["turns"] += 1
+            yield
+        finally:
+            if slot is not None:
+                slot.holder_since = None
+                if slot.lock.locked():
+                    slot.lock.release()
+            self._pending[session_id] -= 1
+            if self._pending[session_id] <= 0:
+                del self._pending[session_id]
+                self._slots.pop(session_id, None)
+
+    async def _acquire(self, session_id: str) -> _SessionSlot:
+        """等待获取会话锁，必要时替换失效的锁"""
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            slot = self._slots.get(session_id)
+            if slot is None:
+                slot = _SessionSlot()
+                self._slots[session_id] = slot
+
+            # 无竞争时直接获取，不产生额外的调度
+            if not slot.lock.locked():
+                await slot.lock.acquire()
+                slot.holder_since = time.monotonic()
+                return slot
+
+            now = time.monotonic()
+            wait = deadline - now
+            if slot.holder_since is not None:
+                wait = min(wait, slot.holder_since + self.stale_lock_seconds - now)
+            else:
+                wait = min(wait, self.stale_lock_seconds)
+
+            try:
+                await asyncio.wait_for(slot.lock.acquire(), timeout=max(wait, 0.001))
+                if self._slots.get(session_id) is not slot:
+                    # 等待期间旧锁已被判定失效并替换，改为排队新锁
+                    slot.lock.release()
+                    continue
+                slot.holder_since = time.monotonic()
+                return slot
+            except asyncio.TimeoutError:
+                now = time.monotonic()
+                if slot.holder_since is not None and now - slot.holder_since >= self.stale_lock_seconds:
+                    # 持锁方疑似卡死，丢弃旧锁，后续请求改用新锁
+                    if self._slots.get(session_id) is slot:
+                        self._slots[session_id] = _SessionSlot()
+                        self._stats["stale_evictions"] += 1
+                        log_manager.log_error(session_id, "session_lock_stale",
+                                              f"held for {now - slot.holder_since:.1f}s", "api")
+                    continue
+                if now >= deadline:
+                    self._stats["rejected_timeout"] += 1
+                    raise SessionQueueFullError(session_id, f"会话 {session_id} 的请求排队超时，请稍后再试")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取排队统计信息"""
+        stats = dict(self._stats)
+        stats["active_sessions"] = len(self._slots)
+        stats["pending_requests"] = sum(self._pending.values())
+        return stats
@@ -0,0 +1,535 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+会话分片模块
+按 session_id 的哈希把会话及其消息、摘要放到多个数据库之一，每个分片是一个独立的 DataManager（各自的连接池、
+迁移、归档和清理）。会话所在分片记录在第一个分片（全局分片）的 session_shards 目录表中：新会话按哈希放置，
+迁移过的会话按目录路由，因此增加分片后旧会话仍能找到，再由 rebalance() 在线迁移到新的哈希位置。
+用户、人设、配额和用量汇总保存在全局分片，人设和用户（只含ID、用户名和显示名）同步到所有分片，
+以满足 chat_sessions 的 persona_id、user_id 外键。
+"""
+
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+try:
+    from .data_manager import DataManager
+    from .log_manager import log_manager
+    from .message_archive import ARCHIVED_FIELDS
+except ImportError:
+    from data_manager import DataManager
+    from log_manager import log_manager
+    from message_archive import ARCHIVED_FIELDS
+
+# 目录缓存的最大条目数
+DIRECTORY_CACHE_SIZE = 100000
+
+# 写入时按 session_id 哈希到固定数量的锁，迁移会话期间同一会话的写入在本进程内等待
+WRITE_LOCK_STRIPES = 64
+
+REBALANCE_LOCK_NAME = "chat_robot:shard_rebalance"
+
+
+def shard_hash(session_id: str) -> int:
+    """稳定的 session_id 哈希（不受 PYTHONHASHSEED 影响）"""
+    return int(hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:8], 16)
+
+
+class ShardedDataManager:
+    """
+    分片数据管理器，提供与 DataManager 相同的会话和消息接口
+
+    单会话操作路由到会话所在的分片；会话列表和搜索并发查询所有分片后合并（scatter-gather）。
+    目录查询结果在进程内缓存 directory_ttl 秒，其他进程迁移会话后最迟在该时间后生效，
+    move_sessions 整批切换目录后等待同样的时间，再补拷这段时间内写入源分片的消息并删除源分片数据。
+    """
+
+    def __init__(self, shard_urls: Sequence[str], directory_ttl: float = 30.0, **kwargs):
+        """
+        初始化分片
+
+        Args:
+            shard_urls (List[str]): 分片数据库URL，第一个为全局分片。分片顺序决定哈希位置，只能在末尾追加
+            directory_ttl (float): 会话目录缓存秒数
+            kwargs: 传给每个分片 DataManager 的其他参数（副本延迟、写后读窗口等）。
+                只读副本属于某一个主库，不能在所有分片间共用，因此不支持 replica_urls
+        """
+        if not shard_urls:
+            raise ValueError("至少需要一个分片")
+        if kwargs.get("replica_urls"):
+            raise ValueError("分片部署不支持只读副本（MYSQL_REPLICA_URLS 只能对应一个主库）")
+        kwargs.pop("replica_urls", None)
+        if kwargs.pop("database_url", None):
+            raise ValueError("分片部署使用 shard_urls，不能同时指定 database_url")
+        self.shards: List[DataManager] = [DataManager(url, **kwargs) for url in shard_urls]
+        self.global_shard = self.shards[0]
+        self.database_url = self.global_shard.database_url
+        self.directory_ttl = directory_ttl
+        self._directory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._directory_lock = threading.Lock()
+        self._write_locks = [threading.RLock() for _ in range(WRITE_LOCK_STRIPES)]
+        self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+        self._stats = {"directory_hits": 0, "directory_misses": 0, "moved_sessions": 0, "moved_messages": 0}
+
+    # ===== 路由 =====
+
+    def home_shard(self, session_id: str) -> int:
+        """会话按哈希应在的分片"""
+        return shard_hash(session_id) % len(self.shards)
+
+    def _lookup(self, session_id: str) -> Optional[int]:
+        """查询目录（带缓存），目录中没有时返回None"""
+        now = time.monotonic()
+        with self._directory_lock:
+            cached = self._directory.get(session_id)
+            if cached is not None and cached[1] > now:
+                self._directory.move_to_end(session_id)
+                self._stats["directory_hits"] += 1
+                return cached[0]
+            self._stats["directory_misses"] += 1
+        rows = self.global_shard._query("SELECT shard FROM session_shards WHERE session_id = :session_id",
+                                        {"session_id": session_id})
+        shard = int(rows[0]["shard"]) if rows else None
+        if shard is not None:
+            self._cache(session_id, shard)
+        return shard
+
+    def _cache(self, session_id: str, shard: int):
+        with self._directory_lock:
+            self._directory[session_id] = (shard, time.monotonic() + self.directory_ttl)
+            self._directory.move_to_end(session_id)
+            while len(self._directory) > DIRECTORY_CACHE_SIZE:
+                self._directory.popitem(last=False)
+
+    def locate(self, session_id: str) -> int:
+        """会话所在的分片序号，未登记的会话按哈希放置"""
+        shard = self._lookup(session_id)
+        return self.home_shard(session_id) if shard is None else shard
+
+    def shard_for(self, session_id: str) -> DataManager:
+        return self.shards[self.locate(session_id)]
+
+    def _register(self, session_id: str) -> int:
+        """写入前确保会话已登记到目录，返回所在分片"""
+        shard = self._lookup(session_id)
+        if shard is not None:
+            return shard
+        shard = self.home_shard(session_id)
+        backend = self.global_shard.backend
+        # 已存在时保持原值（可能被其他进程登记或迁移）
+        backend.query(f"INSERT INTO session_shards (session_id, shard) VALUES (:session_id, :shard) "
+                      f"{backend.upsert_clause(['session_id'], {'session_id': 'set'})}",
+                      {"session_id": session_id, "shard": shard})
+        return self._lookup(session_id)
+
+    def _write_lock(self, session_id: str):
+        return self._write_locks[shard_hash(session_id) % WRITE_LOCK_STRIPES]
+
+    def _write(self, session_id: str, method: str, *args, **kwargs):
+        """在会话所在分片上执行写操作"""
+        with self._write_lock(session_id):
+            return getattr(self.shards[self._register(session_id)], method)(session_id, *args, **kwargs)
+
+    def _scatter(self, method: str, *args, **kwargs) -> List[Any]:
+        """在所有分片上并发执行同一方法，按分片顺序返回结果"""
+        futures = [self._executor.submit(getattr(shard, method), *args, **kwargs) for shard in self.shards]
+        return [future.result() for future in futures]
+
+    # ===== 表结构 =====
+
+    def create_tables(self, **kwargs) -> Dict[str, Any]:
+        """在每个分片上执行迁移，同步人设和用户，首次启用分片时登记已有会话"""
+        results = [shard.create_tables(**kwargs) for shard in self.shards]
+        self.sync_personas()
+        self.sync_users()
+        if not self.global_shard._query("SELECT session_id FROM session_shards LIMIT 1"):
+            self.rebuild_directory()
+        return {"shards": results}
+
+    def _sync_table(self, table: str, columns: Sequence[str], after_id: int = 0, batch_size: int = 1000):
+        """把全局分片上表的指定列按ID分批同步到其他分片（columns 第一列为 id）"""
+        while True:
+            rows = self.global_shard._query(f"SELECT {', '.join(columns)} FROM {table} WHERE id > :after_id "
+                                            f"ORDER BY id LIMIT :limit", {"after_id": after_id, "limit": batch_size})
+            if not rows:
+                return
+            for shard in self.shards[1:]:
+                backend = shard.backend
+                backend.execute_many(
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"VALUES ({', '.join(':' + column for column in columns)}) "
+                    f"{backend.upsert_clause(['id'], {column: 'set' for column in columns[1:]})}", rows)
+            after_id = rows[-1]["id"]
+
+    def sync_personas(self):
+        """把全局分片的人设按ID同步到其他分片"""
+        self._sync_table("ai_personas", ("id", "name", "description", "system_prompt", "avatar_url",
+                                         "is_default", "is_active"))
+
+    def sync_users(self, after_id: int = 0):
+        """把全局分片的用户ID、用户名和显示名同步到其他分片（不同步邮箱和密码）"""
+        self._sync_table("users", ("id", "username", "display_name", "is_active"), after_id)
+
+    def rebuild_directory(self, batch_size: int = 1000) -> int:
+        """把各分片上已有的会话登记到目录（从单库切换到分片时执行一次），返回登记的会话数"""
+        backend = self.global_shard.backend
+        insert = (f"INSERT INTO session_shards (session_id, shard) VALUES (:session_id, :shard) "
+                  f"{backend.upsert_clause(['session_id'], {'session_id': 'set'})}")
+        total = 0
+        for index, shard in enumerate(self.shards):
+            after_id = 0
+            while True:
+                rows = shard._query("SELECT id, session_id FROM chat_sessions WHERE id > :after_id "
+                                    "AND status <> 'deleted' ORDER BY id LIMIT :limit",
+                                    {"after_id": after_id, "limit": batch_size})
+                if not rows:
+                    break
+                backend.execute_many(insert, [{"session_id": row["session_id"], "shard": index} for row in rows])
+                total += len(rows)
+                after_id = rows[-1]["id"]
+        log_manager.log_database_operation("system", "rebuild", "session_shards", {"sessions": total}, "database")
+        return total
+
+    # ===== 单会话操作 =====
+
+    def save_session(self, session_id: str, title: str | None = None, persona_id: int | None = None,
+                     user_id: int | None = None):
+        return self._write(session_id, "save_session", title, persona_id, user_id)
+
+    def update_session(self, session_id: str, title: str | None = None, persona_id: int | None = None):
+        return self._write(session_id, "update_session", title, persona_id)
+
+    def delete_session(self, session_id: str) -> bool:
+        deleted = self._write(session_id, "delete_session")
+        if deleted:
+            # 同名会话重新创建时按哈希放置
+            self.global_shard._query("DELETE FROM session_shards WHERE session_id = :session_id",
+                                     {"session_id": session_id})
+            with self._directory_lock:
+                self._directory.pop(session_id, None)
+        return deleted
+
+    def clear_session_messages(self, session_id: str) -> bool:
+        return self._write(session_id, "clear_session_messages")
+
+    def delete_message(self, session_id: str, message_id: int) -> bool:
+        """删除消息，message_id 为 save_message 返回的跨分片ID"""
+        index = message_id % len(self.shards)
+        return self.shards[index].delete_message(session_id, message_id // len(self.shards))
+
+    def save_summary(self, session_id: str, summary: str, message_count: int):
+        return self._write(session_id, "save_summary", summary, message_count)
+
+    def save_message(self, session_id: str, role: str, content: str, tokens_used: int = 0,
+                     cost: float = 0.0, model_name: Optional[str] = None):
+        """保存消息，返回的消息ID与 iter_messages_for_search 一样换算为跨分片唯一的值"""
+        with self._write_lock(session_id):
+            index = self._register(session_id)
+            saved = self.shards[index].save_message(session_id, role, content, tokens_used, cost, model_name)
+        if saved:
+            saved["id"] = saved["id"] * len(self.shards) + index
+        return saved
+
+    def get_recent_summary(self, session_id: str) -> str:
+        return self.shard_for(session_id).get_recent_summary(session_id)
+
+    def get_recent_messages(self, session_id: str, limit: int = 2) -> List[Dict[str, str]]:
+        return self.shard_for(session_id).get_recent_messages(session_id, limit)
+
+    def get_history_messages(self, session_id: str, limit: int = 100) -> List[Dict[str, str]]:
+        return self.shard_for(session_id).get_history_messages(session_id, limit)
+
+    def get_message_count(self, session_id: str) -> int:
+        return self.shard_for(session_id).get_message_count(session_id)
+
+    def get_recent_message_ids(self, session_id: str, limit: int = 2) -> List[int]:
+        # 与 save_message 返回的ID一样换算为跨分片唯一的值
+        index = self.locate(session_id)
+        return [message_id * len(self.shards) + index
+                for message_id in self.shards[index].get_recent_message_ids(session_id, limit)]
+
+    # ===== 跨会话查询 =====
+
+    def get_all_sessions(self) -> List[Dict[str, Any]]:
+        """合并所有分片的会话列表；迁移中同时存在于两个分片的会话只保留目录指向的一份"""
+        sessions, seen = [], {}
+        for index, shard_sessions in enumerate(self._scatter("get_all_sessions")):
+            for session in shard_sessions:
+                previous = seen.get(session["session_id"])
+                if previous is not None:
+                    if self.locate(session["session_id"]) != index:
+                        continue
+                    sessions.remove(previous)
+                seen[session["session_id"]] = session
+                sessions.append(session)
+        sessions.sort(key=lambda session: session["updated_at"] or "", reverse=True)
+        return sessions
+
+    def search_messages(self, query: str, user_id: Optional[int] = None, limit: int = 20) -> List[Dict[str, Any]]:
+        """在所有分片上全文搜索，按相关度合并"""
+        rows = [row for shard_rows in self._scatter("search_messages", query, user_id, limit) for row in shard_rows]
+        rows.sort(key=lambda row: float(row.get("score") or 0), reverse=True)
+        return rows[:limit]
+
+    def iter_messages_for_search(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """依次遍历所有分片的消息，消息ID换算为跨分片唯一的值"""
+        for index, shard in enumerate(self.shards):
+            for row in shard.iter_messages_for_search(batch_size):
+                row["id"] = row["id"] * len(self.shards) + index
+                yield row
+
+    # ===== 全局数据（全局分片） =====
+
+    def save_persona(self, *args, **kwargs) -> int:
+        result = self.global_shard.save_persona(*args, **kwargs)
+        self.sync_personas()
+        return result
+
+    def get_all_personas(self) -> List[Dict[str, Any]]:
+        return self.global_shard.get_all_personas()
+
+    def get_persona_by_id(self, persona_id: int) -> Dict[str, Any]:
+        return self.global_shard.get_persona_by_id(persona_id)
+
+    def save_user(self, *args, **kwargs):
+        latest = self.global_shard._query("SELECT MAX(id) AS id FROM users")
+        result = self.global_shard.save_user(*args, **kwargs)
+        self.sync_users(int(latest[0]["id"] or 0) if latest else 0)
+        return result
+
+    def get_user_by_id(self, user_id: int) -> Dict[str, Any]:
+        return self.global_shard.get_user_by_id(user_id)
+
+    def record_usage(self, *args, **kwargs):
+        return self.global_shard.record_usage(*args, **kwargs)
+
+    def get_user_usage_totals(self, *args, **kwargs):
+        return self.global_shard.get_user_usage_totals(*args, **kwargs)
+
+    def get_usage_rollup(self, *args, **kwargs):
+        return self.global_shard.get_usage_rollup(*args, **kwargs)
+
+    def get_user_quota(self, user_id: int):
+        return self.global_shard.get_user_quota(user_id)
+
+    def save_user_quota(self, *args, **kwargs):
+        return self.global_shard.save_user_quota(*args, **kwargs)
+
+    def advisory_lock(self, name: str, timeout: int = 10):
+        return self.global_shard.advisory_lock(name, timeout)
+
+    # ===== 在线迁移 =====
+
+    def _copy_session(self, source: DataManager, target: DataManager, session_id: str,
+                      checkpoint: Optional[Dict[str, int]] = None) -> Dict[str, int]:
+        """
+        把会话复制到目标分片（消息在目标分片获得新ID，不保留 parent_message_id）
+
+        Args:
+            checkpoint (Dict): 上次复制返回的检查点，提供时只补拷之后新增的消息和摘要
+
+        Returns:
+            Dict: 源分片已复制到的最大消息ID和摘要ID，以及本次复制的消息数
+        """
+        after_message_id = checkpoint["message_id"] if checkpoint else 0
+        after_summary_id = checkpoint["summary_id"] if checkpoint else 0
+        rows = source._query("SELECT id, user_id, title, persona_id, model_name, status, settings, message_count, "
+                             "total_tokens, created_at, updated_at FROM chat_sessions WHERE session_id = :session_id",
+                             {"session_id": session_id})
+        if not rows:
+            return {"message_id": after_message_id, "summary_id": after_summary_id, "messages": 0}
+        session = rows[0]
+        # 归档的消息搬迁后回到热表，之后由目标分片的归档任务重新归档
+        messages = [] if checkpoint else source.message_archive.load(session_id)
+        hot = source.content_compressor.decode_rows(source._query(f"""
+        SELECT {", ".join(ARCHIVED_FIELDS)}, content_compressed, content_blob
+        FROM chat_messages
+        WHERE session_id = :session_int_id AND id > :after_id AND is_deleted = FALSE
+        ORDER BY id
+        """, {"session_int_id": session["id"], "after_id": after_message_id}))
+        summaries = source._query("SELECT id, summary_type, summary_text, message_count, created_at "
+                                  "FROM chat_summaries WHERE session_id = :session_int_id AND id > :after_id "
+                                  "ORDER BY id", {"session_int_id": session["id"], "after_id": after_summary_id})
+
+        with target.backend.transaction():
+            existing = target._query("SELECT id FROM chat_sessions WHERE session_id = :session_id",
+                                     {"session_id": session_id})
+            if existing:
+                target_id = existing[0]["id"]
+                # 补拷时同步源分片上这段时间的变化，计数和更新时间取较大值；
+                # 没有变化时不更新，避免 updated_at 被自动刷新
+                target._query("""
+                UPDATE chat_sessions
+                SET user_id = COALESCE(user_id, (SELECT id FROM users WHERE id = :user_id)),
+                    message_count = CASE WHEN message_count < :message_count THEN :message_count
+                                         ELSE message_count END,
+                    total_tokens = CASE WHEN total_tokens < :total_tokens THEN :total_tokens ELSE total_tokens END,
+                    updated_at = CASE WHEN updated_at < :updated_at THEN :updated_at ELSE updated_at END
+                WHERE id = :id
+                  AND ((user_id IS NULL AND :user_id IS NOT NULL) OR message_count < :message_count
+                       OR total_tokens < :total_tokens OR updated_at < :updated_at)
+                """, {**session, "id": target_id})
+            else:
+                # 用户已同步到所有分片，user_id 外键在目标分片上同样成立
+                target._query("""
+                INSERT INTO chat_sessions (session_id, user_id, title, persona_id, model_name, status, settings,
+                                           message_count, total_tokens, created_at, updated_at)
+                SELECT :session_id, (SELECT id FROM users WHERE id = :user_id), :title, :persona_id, :model_name,
+                       :status, :settings, :message_count, :total_tokens, :created_at, :updated_at
+                """, {**session, "session_id": session_id})
+                target_id = target._query("SELECT id FROM chat_sessions WHERE session_id = :session_id",
+                                          {"session_id": session_id})[0]["id"]
+            columns = ("session_id", "role", "content", "content_compressed", "content_blob", "model_name",
+                       "tokens_used", "cost", "metadata", "created_at")
+            target.backend.execute_many(
+                f"INSERT INTO chat_messages ({', '.join(columns)}) "
+                f"VALUES ({', '.join(':' + column for column in columns)})",
+                [{**{column: message.get(column) for column in columns}, "session_id": target_id,
+                  **target.content_compressor.encode(message["content"])} for message in messages + hot])
+            target.backend.execute_many("""
+            INSERT INTO chat_summaries (session_id, summary_type, summary_text, message_count, created_at)
+            VALUES (:session_id, :summary_type, :summary_text, :message_count, :created_at)
+            """, [{**summary, "session_id": target_id} for summary in summaries])
+
+        return {"message_id": max([after_message_id] + [message["id"] for message in hot]),
+                "summary_id": max([after_summary_id] + [summary["id"] for summary in summaries]),
+                "messages": len(messages) + len(hot)}
+
+    def move_session(self, session_id: str, target_index: int) -> int:
+        """在线把单个会话迁移到目标分片，返回复制的消息数"""
+        return self.move_sessions([(session_id, target_index)])["messages"]
+
+    def move_sessions(self, moves: Sequence[tuple], pause: float = 0.0) -> Dict[str, int]:
+        """
+        在线把一批会话迁移到各自的目标分片
+
+        先逐个复制会话并切换目录（复制期间本进程对该会话的写入等待），整批切换完成后只等待一次 directory_ttl
+        让其他进程的缓存过期，再逐个补拷这段时间写入源分片的消息，并软删除源分片上的会话（由源分片的清理器分批删除）。
+
+        Args:
+            moves (List[tuple]): (session_id, 目标分片序号) 列表
+            pause (float): 每复制一个会话后暂停的秒数
+
+        Returns:
+            Dict: 迁移的会话数和复制的消息数
+        """
+        pending = []
+        for session_id, target_index in moves:
+            source_index = self.locate(session_id)
+            if source_index == target_index:
+                continue
+            source, target = self.shards[source_index], self.shards[target_index]
+            with self._write_lock(session_id):
+                copied = self._copy_session(source, target, session_id)
+                backend = self.global_shard.backend
+                backend.query(f"INSERT INTO session_shards (session_id, shard) VALUES (:session_id, :shard) "
+                              f"{backend.upsert_clause(['session_id'], {'shard': 'set'})}",
+                              {"session_id": session_id, "shard": target_index})
+                self._cache(session_id, target_index)
+            pending.append((session_id, source_index, target_index, copied))
+            if pause > 0:
+                time.sleep(pause)
+
+        if pending and self.directory_ttl > 0:
+            time.sleep(self.directory_ttl)
+
+        result = {"sessions": 0, "messages": 0}
+        for session_id, source_index, target_index, copied in pending:
+            source, target = self.shards[source_index], self.shards[target_index]
+            with self._write_lock(session_id):
+                tail = self._copy_session(source, target, session_id, copied)
+                source.delete_session(session_id)
+            moved = copied["messages"] + tail["messages"]
+            result["sessions"] += 1
+            result["messages"] += moved
+            log_manager.log_database_operation(session_id, "move", "session_shards", {
+                "from": source_index, "to": target_index, "messages": moved}, "database")
+
+        with self._directory_lock:
+            self._stats["moved_sessions"] += result["sessions"]
+            self._stats["moved_messages"] += result["messages"]
+        return result
+
+    def rebalance(self, max_sessions: Optional[int] = None, batch_size: int = 500,
+                  pause: float = 0.0) -> Dict[str, Any]:
+        """
+        把不在哈希位置上的会话迁移回哈希位置（增加分片后执行）
+
+        每读取一批目录就把其中需要迁移的会话作为一批调用 move_sessions，每批只等待一次目录缓存过期。
+
+        Args:
+            max_sessions (int): 本次最多迁移的会话数
+            batch_size (int): 每次读取目录的行数
+            pause (float): 每复制一个会话后暂停的秒数
+
+        Returns:
+            Dict: 检查和迁移的会话数、迁移的消息数；其他进程正在执行时 skipped 为True
+        """
+        result = {"checked": 0, "moved": 0, "messages": 0, "skipped": False}
+        with self.advisory_lock(REBALANCE_LOCK_NAME, 0) as acquired:
+            if not acquired:
+                result["skipped"] = True
+                return result
+            after = ""
+            while max_sessions is None or result["moved"] < max_sessions:
+                rows = self.global_shard._query("SELECT session_id, shard FROM session_shards "
+                                                "WHERE session_id > :after ORDER BY session_id LIMIT :limit",
+                                                {"after": after, "limit": batch_size})
+                moves = []
+                for row in rows:
+                    result["checked"] += 1
+                    home = self.home_shard(row["session_id"])
+                    if int(row["shard"]) == home:
+                        continue
+                    moves.append((row["session_id"], home))
+                    if max_sessions is not None and result["moved"] + len(moves) >= max_sessions:
+                        break
+                moved = self.move_sessions(moves, pause)
+                result["moved"] += moved["sessions"]
+                result["messages"] += moved["messages"]
+                if len(rows) < batch_size:
+                    break
+                after = rows[-1]["session_id"]
+        return result
+
+    # ===== 统计 =====
+
+    def get_storage_stats(self) -> Dict[str, Any]:
+        """获取目录缓存统计和每个分片的存储统计"""
+        with self._directory_lock:
+            stats = dict(self._stats)
+            stats["directory_cached"] = len(self._directory)
+        stats["shards"] = [shard.get_storage_stats() for shard in self.shards]
+        return stats
+
+
+def create_data_manager(shard_urls: Optional[Sequence[str]] = None, directory_ttl: float = 30.0,
+                        **kwargs):
+    """
+    配置了分片时返回 ShardedDataManager，否则返回 DataManager
+
+    kwargs 为 DataManager 的参数，分片时传给每个分片；分片与只读副本同时配置时抛出 ValueError
+    """
+    if shard_urls:
+        return ShardedDataManager(shard_urls, directory_ttl, **kwargs)
+    return DataManager(**kwargs)
+
+
+if __name__ == "__main__":
+    # 增加分片后执行：python -m chat_robot.shard_manager [最多迁移的会话数]
+    try:
+        from .config_manager import config_manager
+    except ImportError:
+        from config_manager import config_manager
+    shard_config = config_manager.get_shard_config()
+    if not shard_config["shard_urls"]:
+        sys.exit("未配置 SHARD_URLS")
+    manager = ShardedDataManager(shard_config["shard_urls"], shard_config["directory_ttl"])
+    manager.create_tables(**config_manager.get_migration_config())
+    print(manager.rebalance(int(sys.argv[1]) if len(sys.argv) > 1 else None))
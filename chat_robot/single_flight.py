@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+请求合并模块
+同一个键的并发调用只执行一次，其余调用方等待并共享同一结果
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+class _Call:
+    """一次正在执行的调用"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    进程内的 single-flight 调用合并器
+
+    第一个到达的调用方（leader）执行函数，执行期间到达的相同键调用方直接等待 leader 的结果，
+    函数执行结束后该键立即释放，之后的调用会重新执行。
+    """
+
+    def __init__(self, wait_timeout: Optional[float] = None):
+        """初始化调用合并器"""
+        self.wait_timeout = wait_timeout
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0, "errors": 0}
+
+    def do(self, key: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        执行或等待同一键的调用
+
+        Args:
+            key (str): 合并键，例如 session_id
+            fn (Callable): 实际执行的函数
+
+        Returns:
+            Any: 函数返回值（等待者与 leader 拿到同一个对象）
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                is_leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executions"] += 1
+                is_leader = True
+
+        if not is_leader:
+            if not call.done.wait(self.wait_timeout):
+                raise TimeoutError(f"等待合并调用超时: {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self, key: str) -> bool:
+        """判断某个键当前是否正在执行"""
+        with self._lock:
+            return key in self._calls
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取合并统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
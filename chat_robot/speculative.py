@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+投机解码模块
+为本地模型服务提供辅助模型（assistant_model）和n-gram提示查找（prompt lookup）两种投机解码方式，
+并统计接受率和解码速度
+"""
+
+import time
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+# 支持的投机解码方式
+SPECULATIVE_MODES = ("none", "assistant", "prompt_lookup")
+
+
+class ForwardCounter:
+    """统计模块 forward 调用次数和首次调用完成时间的上下文管理器（基于 register_forward_hook）"""
+
+    def __init__(self, module):
+        self.module = module
+        self.count = 0
+        self.first_call_at: Optional[float] = None
+        self._handle = None
+
+    def _hook(self, module, inputs, output):
+        if self.count == 0:
+            self.first_call_at = time.perf_counter()
+        self.count += 1
+
+    def __enter__(self):
+        if self.module is not None:
+            self._handle = self.module.register_forward_hook(self._hook)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._handle is not None:
+            self._handle.remove()
+            self._handle = None
+
+
+def resolve_mode(requested: Optional[str], default_mode: str, assistant_available: bool) -> str:
+    """
+    确定本次请求实际使用的投机解码方式
+
+    请求未指定时使用服务默认值；请求辅助模型但服务未加载时退回 prompt_lookup。
+    """
+    mode = (requested or default_mode or "none").lower()
+    if mode not in SPECULATIVE_MODES:
+        raise ValueError(f"不支持的投机解码方式: {mode}，可选值: {', '.join(SPECULATIVE_MODES)}")
+    if mode == "assistant" and not assistant_available:
+        return "prompt_lookup"
+    return mode
+
+
+def build_generate_kwargs(mode: str, num_draft_tokens: int, assistant_model=None) -> Dict[str, Any]:
+    """生成 model.generate 所需的投机解码参数"""
+    if mode == "assistant":
+        return {"assistant_model": assistant_model, "num_assistant_tokens": num_draft_tokens,
+                "num_assistant_tokens_schedule": "constant"}
+    if mode == "prompt_lookup":
+        return {"prompt_lookup_num_tokens": num_draft_tokens}
+    return {}
+
+
+def compute_metrics(mode: str, new_tokens: int, target_steps: int, draft_tokens: Optional[int],
+                    num_draft_tokens: int, elapsed_seconds: float) -> Dict[str, Any]:
+    """
+    计算单次生成的投机解码指标
+
+    Args:
+        new_tokens: 新生成的token数
+        target_steps: 目标模型的forward次数（含预填充）
+        draft_tokens: 草稿token总数；prompt lookup 无法直接统计时为None，按每步最大草稿数估算
+
+    Returns:
+        Dict: tokens_per_step（每次目标模型前向产出的token数）、acceptance_rate、tokens_per_second
+    """
+    metrics = {
+        "mode": mode,
+        "new_tokens": new_tokens,
+        "target_steps": target_steps,
+        "tokens_per_step": round(new_tokens / target_steps, 3) if target_steps else 0.0,
+        "tokens_per_second": round(new_tokens / elapsed_seconds, 2) if elapsed_seconds > 0 else 0.0,
+        "elapsed_ms": round(elapsed_seconds * 1000, 2),
+        "acceptance_rate": None,
+    }
+    if mode != "none" and target_steps:
+        # 每次验证除接受的草稿外还会产出1个目标模型自己的token
+        accepted = max(new_tokens - target_steps, 0)
+        drafted = draft_tokens if draft_tokens is not None else target_steps * num_draft_tokens
+        metrics["draft_tokens"] = drafted
+        metrics["accepted_tokens"] = accepted
+        metrics["acceptance_rate"] = round(min(accepted / drafted, 1.0), 4) if drafted else 0.0
+        metrics["acceptance_estimated"] = draft_tokens is None
+    return metrics
+
+
+class SpeculativeMetrics:
+    """按投机解码方式聚合的统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._modes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, metrics: Dict[str, Any]):
+        """累计一次生成的指标"""
+        with self._lock:
+            totals = self._modes.setdefault(metrics["mode"], {
+                "requests": 0, "new_tokens": 0, "target_steps": 0, "draft_tokens": 0,
+                "accepted_tokens": 0, "elapsed_ms": 0.0})
+            totals["requests"] += 1
+            totals["new_tokens"] += metrics["new_tokens"]
+            totals["target_steps"] += metrics["target_steps"]
+            totals["draft_tokens"] += metrics.get("draft_tokens") or 0
+            totals["accepted_tokens"] += metrics.get("accepted_tokens") or 0
+            totals["elapsed_ms"] += metrics["elapsed_ms"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取各方式的平均接受率和解码速度"""
+        with self._lock:
+            stats = {}
+            for mode, totals in self._modes.items():
+                entry = dict(totals)
+                entry["elapsed_ms"] = round(entry["elapsed_ms"], 2)
+                entry["tokens_per_second"] = (round(totals["new_tokens"] / (totals["elapsed_ms"] / 1000), 2)
+                                              if totals["elapsed_ms"] else 0.0)
+                entry["tokens_per_step"] = (round(totals["new_tokens"] / totals["target_steps"], 3)
+                                            if totals["target_steps"] else 0.0)
+                entry["acceptance_rate"] = (round(totals["accepted_tokens"] / totals["draft_tokens"], 4)
+                                            if totals["draft_tokens"] else None)
+                stats[mode] = entry
+            return stats
+
+
+def generate_with_metrics(model, model_inputs: Dict[str, Any], generate_kwargs: Dict[str, Any],
+                          mode: str = "none", num_draft_tokens: int = 5,
+                          assistant_model=None) -> Tuple[Any, Dict[str, Any]]:
+    """
+    调用 model.generate 并统计投机解码指标
+
+    Args:
+        model: 目标模型
+        model_inputs: 包含 input_ids / attention_mask 的输入
+        generate_kwargs: 其余生成参数（需包含 return_dict_in_generate=True）
+        mode: none / assistant / prompt_lookup
+        num_draft_tokens: 每步草稿token数
+        assistant_model: 辅助模型（mode为assistant时必需）
+
+    Returns:
+        Tuple: (generate的输出, 指标字典，含 prefill_ms / decode_ms)
+    """
+    kwargs = dict(generate_kwargs)
+    kwargs.update(build_generate_kwargs(mode, num_draft_tokens, assistant_model))
+
+    started = time.perf_counter()
+    with ForwardCounter(model) as target_counter, \
+            ForwardCounter(assistant_model if mode == "assistant" else None) as draft_counter:
+        output = model.generate(**model_inputs, **kwargs)
+    finished = time.perf_counter()
+    elapsed = finished - started
+
+    prompt_length = model_inputs["input_ids"].shape[1]
+    new_tokens = int(output.sequences.shape[1] - prompt_length)
+    draft_tokens = draft_counter.count if mode == "assistant" else None
+    metrics = compute_metrics(mode, new_tokens, target_counter.count, draft_tokens, num_draft_tokens, elapsed)
+
+    # 目标模型第一次前向即预填充，之后为解码阶段
+    first_forward = target_counter.first_call_at or finished
+    metrics["prefill_ms"] = round((first_forward - started) * 1000, 2)
+    metrics["decode_ms"] = round((finished - first_forward) * 1000, 2)
+    return output, metrics
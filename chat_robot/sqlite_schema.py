@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+SQLite表结构
+与 DataManager 中的MySQL表结构（v2.0.0）等价：ENUM改为CHECK约束，
+ON UPDATE CURRENT_TIMESTAMP 改为触发器，表内索引改为独立的 CREATE INDEX
+"""
+
+from typing import List
+
+SQLITE_TABLES = {
+    "users": """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username VARCHAR(50) UNIQUE NOT NULL,
+        email VARCHAR(255) UNIQUE,
+        password_hash VARCHAR(255),
+        display_name VARCHAR(100),
+        avatar_url VARCHAR(500),
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "ai_personas": """
+    CREATE TABLE IF NOT EXISTS ai_personas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name VARCHAR(255) UNIQUE NOT NULL,
+        description TEXT,
+        system_prompt TEXT NOT NULL,
+        avatar_url VARCHAR(500),
+        is_default BOOLEAN DEFAULT FALSE,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "chat_sessions": """
+    CREATE TABLE IF NOT EXISTS chat_sessions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id VARCHAR(255) UNIQUE NOT NULL,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        title VARCHAR(255),
+        persona_id INTEGER REFERENCES ai_personas(id) ON DELETE SET NULL,
+        model_name VARCHAR(100),
+        status VARCHAR(16) DEFAULT 'active' CHECK (status IN ('active', 'archived', 'deleted')),
+        settings JSON,
+        message_count INTEGER DEFAULT 0,
+        total_tokens INTEGER DEFAULT 0,
+        is_active BOOLEAN DEFAULT TRUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "chat_messages": """
+    CREATE TABLE IF NOT EXISTS chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        parent_message_id INTEGER REFERENCES chat_messages(id) ON DELETE SET NULL,
+        role VARCHAR(16) NOT NULL CHECK (role IN ('system', 'user', 'assistant', 'tool')),
+        content TEXT NOT NULL,
+        model_name VARCHAR(100),
+        tokens_used INTEGER DEFAULT 0,
+        cost DECIMAL(10,6) DEFAULT 0.000000,
+        metadata JSON,
+        is_deleted BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "chat_summaries": """
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        summary_type VARCHAR(16) DEFAULT 'auto' CHECK (summary_type IN ('auto', 'manual')),
+        summary_text TEXT NOT NULL,
+        message_range_start INTEGER,
+        message_range_end INTEGER,
+        message_count INTEGER NOT NULL,
+        model_name VARCHAR(100),
+        tokens_saved INTEGER DEFAULT 0,
+        created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "usage_daily": """
+    CREATE TABLE IF NOT EXISTS usage_daily (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usage_date DATE NOT NULL,
+        user_id INTEGER NOT NULL DEFAULT 0,
+        session_id VARCHAR(255) NOT NULL,
+        provider VARCHAR(50) NOT NULL,
+        model_name VARCHAR(100) NOT NULL,
+        requests INTEGER DEFAULT 0,
+        prompt_tokens INTEGER DEFAULT 0,
+        completion_tokens INTEGER DEFAULT 0,
+        cost DECIMAL(14,6) DEFAULT 0.000000,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (usage_date, user_id, session_id, provider, model_name)
+    )
+    """,
+    "chat_message_archives": """
+    CREATE TABLE IF NOT EXISTS chat_message_archives (
+        session_id INTEGER PRIMARY KEY REFERENCES chat_sessions(id) ON DELETE CASCADE,
+        message_count INTEGER NOT NULL,
+        last_message_id INTEGER NOT NULL,
+        codec VARCHAR(16) NOT NULL,
+        raw_bytes INTEGER NOT NULL,
+        compressed_bytes INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "compression_dictionaries": """
+    CREATE TABLE IF NOT EXISTS compression_dictionaries (
+        dict_id BIGINT PRIMARY KEY,
+        dict_data BLOB NOT NULL,
+        sample_count INTEGER NOT NULL,
+        sample_bytes BIGINT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "session_shards": """
+    CREATE TABLE IF NOT EXISTS session_shards (
+        session_id VARCHAR(255) PRIMARY KEY,
+        shard INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    "user_quotas": """
+    CREATE TABLE IF NOT EXISTS user_quotas (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        daily_tokens INTEGER,
+        monthly_tokens INTEGER,
+        daily_requests INTEGER,
+        monthly_requests INTEGER,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+}
+
+# 与MySQL建表语句中内联的单列索引等价
+SQLITE_INDEXES = {
+    "session_shards": ["CREATE INDEX IF NOT EXISTS idx_session_shards_shard ON session_shards(shard)"],
+    "users": ["CREATE INDEX IF NOT EXISTS idx_user_active ON users(is_active)"],
+    "ai_personas": [
+        "CREATE INDEX IF NOT EXISTS idx_persona_active ON ai_personas(is_active)",
+        "CREATE INDEX IF NOT EXISTS idx_persona_default ON ai_personas(is_default)",
+    ],
+    "chat_sessions": [
+        "CREATE INDEX IF NOT EXISTS idx_session_user ON chat_sessions(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_persona ON chat_sessions(persona_id)",
+        "CREATE INDEX IF NOT EXISTS idx_session_status ON chat_sessions(status)",
+        "CREATE INDEX IF NOT EXISTS idx_session_updated ON chat_sessions(updated_at)",
+    ],
+    "chat_messages": [
+        "CREATE INDEX IF NOT EXISTS idx_message_created ON chat_messages(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_message_role ON chat_messages(role)",
+        "CREATE INDEX IF NOT EXISTS idx_message_deleted ON chat_messages(is_deleted)",
+        "CREATE INDEX IF NOT EXISTS idx_message_parent ON chat_messages(parent_message_id)",
+    ],
+    "chat_summaries": [
+        "CREATE INDEX IF NOT EXISTS idx_summary_type ON chat_summaries(summary_type)",
+        "CREATE INDEX IF NOT EXISTS idx_summary_created ON chat_summaries(created_at)",
+    ],
+    "usage_daily": [
+        "CREATE INDEX IF NOT EXISTS idx_usage_user_date ON usage_daily(user_id, usage_date)",
+        "CREATE INDEX IF NOT EXISTS idx_usage_session ON usage_daily(session_id)",
+    ],
+}
+
+# 复合索引（前缀列同时覆盖 idx_message_session / idx_summary_session 的查询），对应MySQL单独创建的索引
+SQLITE_COMPOSITE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_messages_session_created ON chat_messages(session_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_sessions_user_updated ON chat_sessions(user_id, updated_at)",
+    "CREATE INDEX IF NOT EXISTS idx_summaries_session_type ON chat_summaries(session_id, summary_type)",
+]
+
+
+def _updated_at_trigger(table: str, key: str = "id") -> str:
+    """模拟MySQL的 ON UPDATE CURRENT_TIMESTAMP（未显式修改 updated_at 时自动刷新）"""
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS trg_{table}_updated_at AFTER UPDATE ON {table}
+    FOR EACH ROW WHEN NEW.updated_at IS OLD.updated_at
+    BEGIN
+        UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE {key} = NEW.{key};
+    END
+    """
+
+
+SQLITE_TRIGGERS = {
+    "users": _updated_at_trigger("users"),
+    "ai_personas": _updated_at_trigger("ai_personas"),
+    "chat_sessions": _updated_at_trigger("chat_sessions"),
+    "usage_daily": _updated_at_trigger("usage_daily"),
+    "user_quotas": _updated_at_trigger("user_quotas", "user_id"),
+    "session_shards": _updated_at_trigger("session_shards", "session_id"),
+}
+
+
+def sqlite_table_statements(*tables: str) -> List[str]:
+    """按顺序返回创建指定表及其索引、触发器的语句"""
+    statements = []
+    for table in tables:
+        statements.append(SQLITE_TABLES[table])
+        statements.extend(SQLITE_INDEXES.get(table, []))
+        if table in SQLITE_TRIGGERS:
+            statements.append(SQLITE_TRIGGERS[table])
+    return statements
@@ -1,29 +1,93 @@
 import os
 import json
+import time
+import asyncio
 import datetime
+import threading
 from pathlib import Path
 
-os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
+# 进程启动时间，用于统计冷启动耗时
+PROCESS_STARTED = time.perf_counter()
 
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 import uvicorn
 from typing import Optional, Any
 
+try:
+    from .prefix_cache import PrefixKVCache
+    from .token_cache import ChatTemplateTokenCache
+    from .speculative import SpeculativeMetrics, resolve_mode, generate_with_metrics
+    from .server_metrics import ThroughputTracker, build_usage, new_completion_id
+except ImportError:
+    from prefix_cache import PrefixKVCache
+    from token_cache import ChatTemplateTokenCache
+    from speculative import SpeculativeMetrics, resolve_mode, generate_with_metrics
+    from server_metrics import ThroughputTracker, build_usage, new_completion_id
+
 app = FastAPI()
 
 # 全局变量存储模型和分词器
 model: Any = None
 tokenizer: Any = None
+token_cache: Optional[ChatTemplateTokenCache] = None
+assistant_model: Any = None
 device: str = "cpu"
 
+# 投机解码配置：请求未指定时使用默认方式；配置了草稿模型才支持 assistant 方式
+DRAFT_MODEL_NAME = os.getenv("DRAFT_MODEL_NAME", "")
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "none")
+SPECULATIVE_NUM_TOKENS = int(os.getenv("SPECULATIVE_NUM_TOKENS", "5"))
+speculative_metrics = SpeculativeMetrics()
+
+# 生成串行执行（单个模型实例不支持并发generate），吞吐量按滑动窗口统计
+generation_lock = asyncio.Lock()
+throughput = ThroughputTracker(window_seconds=float(os.getenv("THROUGHPUT_WINDOW_SECONDS", "60")))
+
+# 模型来源：LOCAL_MODEL_PATH 指向本地目录时直接内存映射其中的safetensors权重，不访问网络；
+# 需要使用镜像下载时自行设置 HF_ENDPOINT
+MODEL_NAME = os.getenv("LOCAL_MODEL_PATH") or os.getenv("QWEN_MODEL_NAME", "Qwen/Qwen2.5-3B-Instruct")
+WARMUP_ENABLED = os.getenv("MODEL_WARMUP_ENABLED", "true").lower() in ("true", "1", "yes", "on")
+WARMUP_MAX_TOKENS = int(os.getenv("MODEL_WARMUP_MAX_TOKENS", "8"))
+
+# 启动状态：starting -> loading -> warming -> ready / failed，只有ready时才接受请求
+startup_state: dict = {"status": "starting", "error": None, "timings": {}}
+
 # 日志目录
 log_dir = Path("log")
 log_dir.mkdir(exist_ok=True)
 
 
+def _kv_nbytes(cache) -> int:
+    """计算 past_key_values 占用的显存/内存字节数"""
+    if hasattr(cache, "layers"):
+        tensors = [t for layer in cache.layers for t in (layer.keys, layer.values) if t is not None]
+    else:
+        tensors = list(cache.key_cache) + list(cache.value_cache)
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def _kv_crop(cache, length: int):
+    """将 past_key_values 截断到指定长度"""
+    cache.crop(length)
+    return cache
+
+
+# 前缀KV缓存：多轮对话共享的人设提示词和历史消息只预填充一次
+prefix_cache: Optional[PrefixKVCache] = None
+if os.getenv("PREFIX_CACHE_ENABLED", "true").lower() in ("true", "1", "yes", "on"):
+    prefix_cache = PrefixKVCache(
+        max_bytes=int(float(os.getenv("PREFIX_CACHE_MAX_MB", "2048")) * 1024 * 1024),
+        block_size=int(os.getenv("PREFIX_CACHE_BLOCK_SIZE", "32")),
+        size_fn=_kv_nbytes,
+        crop_fn=_kv_crop,
+    )
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -34,6 +98,8 @@ class ChatCompletionRequest(BaseModel):
     messages: list[ChatMessage]
     max_tokens: int = 512
     temperature: float = 0.7
+    speculative: Optional[str] = None        # none / assistant / prompt_lookup，为空时使用服务默认值
+    num_draft_tokens: Optional[int] = None   # 每步草稿token数
 
 
 class ChatCompletionChoice(BaseModel):
@@ -43,12 +109,13 @@ class ChatCompletionChoice(BaseModel):
 
 
 class ChatCompletionResponse(BaseModel):
-    id: str = "chatcmpl-123"
+    id: str
     object: str = "chat.completion"
-    created: int = 1234567890
+    created: int
     model: str
     choices: list[ChatCompletionChoice]
     usage: dict = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    metrics: Optional[dict] = None
 
 
 def _write_log_entry(session_id: str, entry: dict, module: str = "server"):
@@ -64,9 +131,26 @@ def _write_log_entry(session_id: str, entry: dict, module: str = "server"):
     with open(log_file, "a", encoding="utf-8") as f:
         f.write(json.dumps(entry, ensure_ascii=False) + "\n")
 
+def _resolve_model_source(name: str) -> dict:
+    """
+    解析模型来源
+
+    本地目录：只读取本地文件，存在safetensors权重时强制使用（from_pretrained 通过 safe_open 内存映射加载）；
+    模型ID：按Hugging Face缓存/下载的默认方式加载
+    """
+    path = Path(name)
+    if path.is_dir():
+        has_safetensors = any(path.glob("*.safetensors"))
+        if not has_safetensors:
+            print(f"警告：{path} 中没有safetensors权重，将按普通方式加载")
+        return {"pretrained_model_name_or_path": str(path), "local_files_only": True,
+                "use_safetensors": True if has_safetensors else None}
+    return {"pretrained_model_name_or_path": name}
+
+
 def load_model():
     """加载Qwen模型"""
-    global model, tokenizer, device
+    global model, tokenizer, token_cache, assistant_model, device
     # 如果模型已经加载，直接返回
     if model is not None and tokenizer is not None:
         return
@@ -84,16 +168,16 @@ def load_model():
             # 修复basedpyright类型检查问题，使用类型注释忽略检查
             print("CUDA版本: " + str(torch.version.cuda))  # type: ignore
             print(f"当前设备: {torch.cuda.current_device()}")
-        exit(1)
+        raise RuntimeError("未检测到CUDA设备，程序必须使用GPU运行")
 
-    model_name = "Qwen/Qwen2.5-3B-Instruct"
-    print(f"正在加载模型 {model_name}...")
+    source = _resolve_model_source(MODEL_NAME)
+    print(f"正在加载模型 {MODEL_NAME}...")
 
     # 加载模型和分词器
     try:
         if device == "cuda":
             model = AutoModelForCausalLM.from_pretrained(
-                model_name,
+                **source,
                 dtype=torch.float16,
                 device_map="auto"
             )
@@ -101,7 +185,21 @@ def load_model():
             # 此分支不会执行，因为我们已强制要求使用GPU
             raise RuntimeError("必须使用GPU运行，不支持CPU模式")
 
-        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        tokenizer = AutoTokenizer.from_pretrained(
+            source["pretrained_model_name_or_path"],
+            local_files_only=source.get("local_files_only", False)
+        )
+        if os.getenv("TOKEN_CACHE_ENABLED", "true").lower() in ("true", "1", "yes", "on"):
+            token_cache = ChatTemplateTokenCache(tokenizer, max_entries=int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "4096")))
+
+        # 草稿模型需与主模型使用同一分词器（如 Qwen2.5-0.5B-Instruct）
+        if DRAFT_MODEL_NAME:
+            print(f"正在加载草稿模型 {DRAFT_MODEL_NAME}...")
+            assistant_model = AutoModelForCausalLM.from_pretrained(
+                **_resolve_model_source(DRAFT_MODEL_NAME),
+                dtype=torch.float16,
+                device_map="auto"
+            )
         print("模型加载完成!")
     except Exception as e:
         print(f"模型加载失败: {e}")
@@ -110,83 +208,192 @@ def load_model():
         tokenizer = None
         # 强制使用GPU，不降级到CPU
         print("错误：模型加载失败，程序必须使用GPU运行！")
-        exit(1)
+        raise
 
 
-@app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest):
-    # 确保模型已加载
-    load_model()
-
-    # 检查模型是否成功加载
-    if model is None or tokenizer is None:
-        return ChatCompletionResponse(
-            model=request.model,
-            choices=[ChatCompletionChoice(
-                index=0,
-                message=ChatMessage(role="assistant", content="模型加载失败，请检查配置"),
-                finish_reason="error"
-            )]
-        )
+def warm_up():
+    """用一次短生成预热CUDA kernel、分词器和模板缓存"""
+    messages = [{"role": "user", "content": "你好"}]
+    if token_cache is not None:
+        input_ids, _ = token_cache.encode(messages)
+        input_tensor = torch.tensor([input_ids], device=device)
+        model_inputs = {"input_ids": input_tensor, "attention_mask": torch.ones_like(input_tensor)}
+    else:
+        text = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        model_inputs = tokenizer([text], return_tensors="pt").to(device)
+    with torch.inference_mode():
+        model.generate(**model_inputs, max_new_tokens=WARMUP_MAX_TOKENS, do_sample=False)
+    if device == "cuda":
+        torch.cuda.synchronize()
 
-    # 生成会话ID（使用第一个用户消息作为标识）
-    session_id = "server_session"
-    first_user_msg = next((msg for msg in request.messages if msg.role == "user"), None)
-    if first_user_msg:
-        session_id = f"server_{hash(first_user_msg.content) % 10000}"
 
+def run_startup_pipeline():
+    """加载模型 -> 预热 -> 标记就绪，并记录各阶段耗时"""
+    timings = startup_state["timings"]
     try:
-        # 构造提示词
-        messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
-        
-        # 记录API请求
-        _write_log_entry(session_id, {
-            "type": "api_request",
-            "model": request.model,
-            "max_tokens": request.max_tokens,
-            "temperature": request.temperature,
-            "messages": messages
-        }, "api")
-
-        # 应用聊天模板
+        startup_state["status"] = "loading"
+        started = time.perf_counter()
+        load_model()
+        timings["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        if WARMUP_ENABLED:
+            startup_state["status"] = "warming"
+            started = time.perf_counter()
+            warm_up()
+            timings["warmup_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        timings["cold_start_ms"] = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+        startup_state["status"] = "ready"
+        print(f"模型服务已就绪，冷启动耗时 {timings['cold_start_ms'] / 1000:.1f} 秒")
+        _write_log_entry("system", {"type": "service_ready", "model": MODEL_NAME, "timings": timings}, "server")
+    except Exception as e:
+        startup_state["status"] = "failed"
+        startup_state["error"] = str(e)
+        print(f"模型服务启动失败: {e}")
+        _write_log_entry("system", {"type": "error", "error_type": "startup_error", "error_message": str(e)}, "error")
+
+
+@app.on_event("startup")
+async def start_loading():
+    """服务启动后在后台线程加载模型，加载期间 /health 返回加载进度"""
+    threading.Thread(target=run_startup_pipeline, name="model-startup", daemon=True).start()
+
+
+def _generate_completion(request: ChatCompletionRequest, session_id: str, queue_ms: float) -> ChatCompletionResponse:
+    """执行一次生成（阻塞调用，在线程池中运行）"""
+    started = time.perf_counter()
+
+    # 构造提示词
+    messages = [{"role": msg.role, "content": msg.content} for msg in request.messages]
+
+    # 记录API请求
+    _write_log_entry(session_id, {
+        "type": "api_request",
+        "model": request.model,
+        "max_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "messages": messages
+    }, "api")
+
+    # 应用聊天模板并编码输入，未变化的消息直接使用缓存的token id
+    tokenize_started = time.perf_counter()
+    tokenize_info = None
+    if token_cache is not None:
+        input_ids, tokenize_info = token_cache.encode(messages)
+        input_tensor = torch.tensor([input_ids], device=device)
+        model_inputs = {"input_ids": input_tensor, "attention_mask": torch.ones_like(input_tensor)}
+    else:
         text = tokenizer.apply_chat_template(
             messages,
             tokenize=False,
             add_generation_prompt=True
         )
-
-        # 编码输入
         model_inputs = tokenizer([text], return_tensors="pt").to(device)
+    tokenize_ms = (time.perf_counter() - tokenize_started) * 1000
+
+    # 确定投机解码方式（投机解码时草稿与验证步骤自行管理KV，不使用前缀缓存）
+    speculative_mode = resolve_mode(request.speculative, SPECULATIVE_MODE, assistant_model is not None)
+    use_prefix_cache = prefix_cache is not None and speculative_mode == "none"
+
+    # 查找可复用的前缀KV，命中时只需预填充新增的token
+    past_key_values, cached_tokens = None, 0
+    if use_prefix_cache:
+        past_key_values, cached_tokens = prefix_cache.lookup(model_inputs["input_ids"][0].tolist())
+
+    # 生成响应
+    generate_kwargs = dict(
+        max_new_tokens=request.max_tokens,
+        temperature=request.temperature,
+        return_dict_in_generate=True
+    )
+    if past_key_values is not None:
+        generate_kwargs["past_key_values"] = past_key_values
+    output, speculative_info = generate_with_metrics(
+        model, model_inputs, generate_kwargs,
+        mode=speculative_mode,
+        num_draft_tokens=request.num_draft_tokens or SPECULATIVE_NUM_TOKENS,
+        assistant_model=assistant_model
+    )
+    speculative_metrics.record(speculative_info)
+
+    # 缓存本轮的KV（覆盖提示词和已生成的回复），供下一轮对话复用
+    if use_prefix_cache and output.past_key_values is not None:
+        cache_length = output.past_key_values.get_seq_length()
+        prefix_cache.store(output.sequences[0][:cache_length].tolist(), output.past_key_values)
+
+    prompt_tokens = int(model_inputs["input_ids"].shape[1])
+    generated_ids = output.sequences[0][prompt_tokens:]
+    completion_tokens = int(generated_ids.shape[0])
+    response_text = tokenizer.decode(generated_ids, skip_special_tokens=True)
+    # 未遇到结束符而是达到 max_tokens 时标记为截断
+    eos_ids = model.generation_config.eos_token_id
+    eos_ids = set(eos_ids if isinstance(eos_ids, (list, tuple)) else [eos_ids])
+    finish_reason = "stop"
+    if completion_tokens >= request.max_tokens and (completion_tokens == 0 or int(generated_ids[-1]) not in eos_ids):
+        finish_reason = "length"
+
+    usage = build_usage(prompt_tokens, completion_tokens, cached_tokens)
+    timing = {
+        "queue_ms": round(queue_ms, 2),
+        "tokenize_ms": round(tokenize_ms, 2),
+        "prefill_ms": speculative_info["prefill_ms"],
+        "decode_ms": speculative_info["decode_ms"],
+        "total_ms": round(queue_ms + (time.perf_counter() - started) * 1000, 2),
+    }
+    throughput.record(prompt_tokens, completion_tokens, cached_tokens, timing)
+    completion_id = new_completion_id()
+
+    # 记录API响应
+    _write_log_entry(session_id, {
+        "type": "api_response",
+        "id": completion_id,
+        "response": response_text,
+        "usage": usage,
+        "timing": timing,
+        "tokenize": tokenize_info,
+        "speculative": speculative_info
+    }, "api")
+
+    # 构造响应
+    response_message = ChatMessage(role="assistant", content=response_text)
+    choice = ChatCompletionChoice(index=0, message=response_message, finish_reason=finish_reason)
+
+    return ChatCompletionResponse(
+        id=completion_id,
+        created=int(time.time()),
+        model=request.model,
+        choices=[choice],
+        usage=usage,
+        metrics={"cached_prompt_tokens": cached_tokens, "timing": timing, "tokenize": tokenize_info,
+                 "speculative": speculative_info}
+    )
 
-        # 生成响应
-        generated_ids = model.generate(
-            **model_inputs,
-            max_new_tokens=request.max_tokens,
-            temperature=request.temperature
-        )
-
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
 
-        response_text = tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-        
-        # 记录API响应
-        _write_log_entry(session_id, {
-            "type": "api_response",
-            "response": response_text
-        }, "api")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: ChatCompletionRequest):
+    # 模型未就绪时直接拒绝，请求不承担加载和预热的耗时
+    if startup_state["status"] != "ready":
+        return JSONResponse(
+            status_code=503,
+            content={"error": f"模型服务尚未就绪（{startup_state['status']}）", "detail": startup_state["error"]},
+            headers={"Retry-After": "5"}
+        )
 
-        # 构造响应
-        response_message = ChatMessage(role="assistant", content=response_text)
-        choice = ChatCompletionChoice(index=0, message=response_message, finish_reason="stop")
+    # 生成会话ID（使用第一个用户消息作为标识）
+    session_id = "server_session"
+    first_user_msg = next((msg for msg in request.messages if msg.role == "user"), None)
+    if first_user_msg:
+        session_id = f"server_{hash(first_user_msg.content) % 10000}"
 
-        return ChatCompletionResponse(
-            model=request.model,
-            choices=[choice]
-        )
+    arrived = time.perf_counter()
+    try:
+        # 同一进程内的生成串行执行，等待锁的时间即排队耗时；生成在线程池中运行，不阻塞事件循环
+        async with generation_lock:
+            queue_ms = (time.perf_counter() - arrived) * 1000
+            return await run_in_threadpool(_generate_completion, request, session_id, queue_ms)
     except Exception as e:
         print(f"生成响应时出错: {e}")
+        throughput.record_error()
         # 记录错误
         _write_log_entry(session_id, {
             "type": "error",
@@ -194,6 +401,8 @@ async def chat_completions(request: ChatCompletionRequest):
             "error_message": str(e)
         }, "error")
         return ChatCompletionResponse(
+            id=new_completion_id(),
+            created=int(time.time()),
             model=request.model,
             choices=[ChatCompletionChoice(
                 index=0,
@@ -217,6 +426,38 @@ async def list_models():
     }
 
 
+@app.get("/health")
+async def health():
+    """健康检查：预热完成后才返回ok，供路由进程和部署探针判断是否可以分发请求"""
+    ready = startup_state["status"] == "ready"
+    content = {
+        "status": "ok" if ready else startup_state["status"],
+        "model": MODEL_NAME,
+        "device": device,
+        "error": startup_state["error"],
+        "timings": startup_state["timings"],
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=content)
+
+
+@app.get("/v1/stats")
+async def get_stats():
+    """获取模型服务的运行时统计"""
+    return {
+        "prefix_cache": prefix_cache.get_stats() if prefix_cache is not None else {"enabled": False},
+        "token_cache": token_cache.get_stats() if token_cache is not None else {"enabled": False},
+        "speculative": speculative_metrics.get_stats(),
+        "throughput": throughput.get_stats(),
+        "startup": startup_state,
+    }
+
+
+@app.get("/v1/throughput")
+async def get_throughput():
+    """获取累计和最近窗口内的请求数、token吞吐量及平均排队/预填充/解码耗时"""
+    return throughput.get_stats()
+
+
 if __name__ == "__main__":
     print("启动Qwen模型服务...")
     # 记录服务启动
@@ -224,6 +465,7 @@ if __name__ == "__main__":
         "type": "service_start",
         "message": "Qwen model service starting"
     }, "server")
-    # 立即加载模型
-    load_model()
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # 模型在应用启动事件中加载和预热，就绪前 /health 返回503
+    # 由 model_router.py 启动多个工作进程时通过 MODEL_WORKER_PORT 指定端口
+    port = int(os.getenv("MODEL_WORKER_PORT", os.getenv("MODEL_SERVICE_PORT", "8001")))
+    uvicorn.run(app, host="0.0.0.0", port=port)
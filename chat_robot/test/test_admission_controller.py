@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试上游模型调用准入控制（令牌桶限流、并发限制、快速拒绝）
+"""
+
+import sys
+import os
+import time
+import threading
+from types import SimpleNamespace
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.admission_controller import (
+    AdmissionController, AdmittedChatClient, AdmissionRejectedError
+)
+
+
+class _FakeCompletions:
+    """模拟 chat.completions 接口"""
+
+    def __init__(self, delay=0.0, total_tokens=50):
+        self.delay = delay
+        self.total_tokens = total_tokens
+        self.calls = 0
+
+    def create(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.delay)
+        return SimpleNamespace(usage=SimpleNamespace(total_tokens=self.total_tokens))
+
+
+def _fake_client(**kwargs):
+    return SimpleNamespace(chat=SimpleNamespace(completions=_FakeCompletions(**kwargs)),
+                           embeddings="embeddings-api")
+
+
+def test_request_rate_limit_rejects_fast():
+    """请求数超过令牌桶且等待超过SLO时立即拒绝"""
+    controller = AdmissionController({"zhipu": {"rpm": 2, "tpm": 100000, "max_concurrency": 8}},
+                                     max_wait_seconds=0.5)
+    for _ in range(2):
+        with controller.admit("zhipu", 10):
+            pass
+
+    started = time.perf_counter()
+    try:
+        with controller.admit("zhipu", 10):
+            assert False, "应当被拒绝"
+    except AdmissionRejectedError as e:
+        assert e.reason == "slo"
+        assert e.retry_after >= 1
+    assert time.perf_counter() - started < 0.1
+    assert controller.get_stats()["zhipu"]["rejected_slo"] == 1
+    print("✅ 请求速率限流测试通过")
+
+
+def test_concurrency_limit_waits():
+    """超过最大并发时排队等待，前一个请求结束后获得准入"""
+    controller = AdmissionController({"local": {"rpm": 600, "tpm": 100000, "max_concurrency": 1}},
+                                     max_wait_seconds=2)
+    timeline = []
+
+    def worker(label):
+        with controller.admit("local", 10):
+            timeline.append(f"{label}:start")
+            time.sleep(0.1)
+            timeline.append(f"{label}:end")
+
+    threads = [threading.Thread(target=worker, args=(f"t{i}",)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert timeline[1].endswith(":end") and timeline[2].endswith(":start")
+    print("✅ 并发限制测试通过")
+
+
+def test_queue_full_rejects():
+    """等待队列满时立即拒绝"""
+    controller = AdmissionController({"local": {"rpm": 600, "tpm": 100000, "max_concurrency": 1}},
+                                     max_queue=1, max_wait_seconds=2)
+    errors = []
+    release = threading.Event()
+
+    def holder():
+        with controller.admit("local", 1):
+            release.wait()
+
+    def waiter():
+        try:
+            with controller.admit("local", 1):
+                pass
+        except AdmissionRejectedError as e:
+            errors.append(e.reason)
+
+    threads = [threading.Thread(target=holder), threading.Thread(target=waiter)]
+    threads[0].start()
+    time.sleep(0.05)
+    threads[1].start()
+    time.sleep(0.05)
+    waiter()  # 队列中已有一个等待者，本次应被拒绝
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert errors == ["queue_full"]
+    print("✅ 队列背压测试通过")
+
+
+def test_client_wrapper_reconciles_usage():
+    """包装客户端按实际usage校正token桶，并透传其他属性"""
+    controller = AdmissionController({"openai": {"rpm": 600, "tpm": 10000, "max_concurrency": 4}})
+    raw = _fake_client(total_tokens=120)
+    client = AdmittedChatClient(raw, controller, "openai")
+
+    client.chat.completions.create(model="m", messages=[{"role": "user", "content": "你好"}], max_tokens=2000)
+    stats = controller.get_stats()["openai"]
+    assert stats["tokens_used"] == 120
+    assert 9800 <= stats["available_tokens"] <= 10000
+    assert raw.chat.completions.calls == 1
+    assert client.embeddings == "embeddings-api"
+    print("✅ 用量校正测试通过")
+
+
+if __name__ == "__main__":
+    test_request_rate_limit_rejects_fast()
+    test_concurrency_limit_waits()
+    test_queue_full_rejects()
+    test_client_wrapper_reconciles_usage()
+    print("测试完成!")
+
+
+def _chat_api(tmp_path, completions):
+    """组装只依赖SQLite和假模型客户端的 ChatAPI（不执行读取配置和连接模型的初始化）"""
+    from chat_robot.chat_api import ChatAPI
+    from chat_robot.data_manager import DataManager
+    from chat_robot.prompt_manager import PromptManager
+    from chat_robot.search_manager import SearchManager
+    from chat_robot.single_flight import SingleFlight
+
+    chat_api = ChatAPI.__new__(ChatAPI)
+    chat_api.data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    chat_api.data_manager.create_tables()
+    chat_api.ai_config = {"local_model_enabled": True, "local_model_name": "fake", "model_name": "fake",
+                          "max_tokens": 64, "temperature": 0.7}
+    chat_api.context_config = {"enable_compression": False, "window_size": 4}
+    chat_api.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+    chat_api.prompt_manager = PromptManager(chat_api.client)
+    chat_api.response_cache = None
+    chat_api.summary_flight = SingleFlight()
+    chat_api.search_manager = SearchManager(chat_api.data_manager)
+    chat_api.long_term_memory = None
+    chat_api.usage_ledger = None
+    chat_api.quota_manager = None
+    return chat_api
+
+
+def test_rejected_chat_turn_discards_user_message(tmp_path):
+    """未获准入时撤销本轮的用户消息，客户端重试后上下文中不会重复出现该提问"""
+    class _Rejecting:
+        def create(self, **kwargs):
+            raise AdmissionRejectedError("local", "slo", 3)
+
+    chat_api = _chat_api(tmp_path, _Rejecting())
+    try:
+        chat_api.chat_with_history("s1", "你好")
+        assert False, "应当拒绝"
+    except AdmissionRejectedError:
+        pass
+    assert chat_api.data_manager.get_message_count("s1") == 0
+    assert chat_api.search_manager.search("你好")["total"] == 0
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试长消息内容压缩：超过阈值的消息压缩存储、读取时透明解压、训练字典后旧消息仍可解压
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+from chat_robot.content_compression import ContentCompressor
+
+
+def _reply(i):
+    return (f"好的，下面是第{i}个问题的详细解答。\n\n## 步骤一\n首先需要确认环境配置是否正确，"
+            f"包括Python版本、依赖包和数据库连接。\n\n## 步骤二\n然后运行 `pip install -r requirements.txt` "
+            f"安装依赖，检查输出中是否有错误信息。编号 {i * 7919 % 1000}。\n\n## 总结\n"
+            f"如果还有问题，请提供完整的错误日志，我会继续帮助你排查。") * 3
+
+
+def test_long_messages_are_compressed_and_read_transparently(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    manager.save_message("s1", "user", "你好")
+    manager.save_message("s1", "assistant", _reply(0))
+
+    compressor = ContentCompressor(manager, enabled=True, min_bytes=512, dict_size=8192, search_prefix_chars=64)
+    manager.content_compressor = compressor
+    # 还没有字典时使用不带字典的zstd
+    manager.save_message("s1", "assistant", _reply(1))
+    for i in range(2, 120):
+        manager.save_message("corpus", "assistant", _reply(i)[:100])
+    info = compressor.train_dictionary()
+    assert info is not None and compressor.get_stats()["dict_id"] == info["dict_id"]
+    manager.save_message("s1", "assistant", _reply(2))
+
+    rows = manager._query("SELECT content, content_compressed FROM chat_messages m JOIN chat_sessions s "
+                          "ON m.session_id = s.id WHERE s.session_id = 's1' ORDER BY m.id")
+    assert [bool(row["content_compressed"]) for row in rows] == [False, False, True, True]
+    # content 列只保留开头部分供全文索引使用
+    assert rows[2]["content"] == _reply(1)[:64] and rows[3]["content"] == _reply(2)[:64]
+
+    expected = [{"role": "user", "content": "你好"}] + \
+        [{"role": "assistant", "content": _reply(i)} for i in range(3)]
+    assert manager.get_history_messages("s1") == expected
+    assert manager.get_recent_messages("s1", limit=2) == expected[2:]
+    # 重新加载字典的新实例也能解压
+    manager.content_compressor = ContentCompressor(manager)
+    assert manager.get_history_messages("s1") == expected
+    assert [row["content"] for row in manager.iter_messages_for_search()
+            if row["session_id"] == "s1"] == [message["content"] for message in expected]
+
+    stats = compressor.get_stats()
+    assert stats["compressed_messages"] == 2 and stats["saved_bytes"] > 0
+
+    report = compressor.benchmark(min_bytes=512)
+    assert report["messages"] == 3
+    assert report["zstd_dict"]["stored_bytes"] <= report["zstd"]["stored_bytes"] < report["raw_bytes"]
+
+
+def test_compressed_messages_keep_a_searchable_prefix(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    manager.content_compressor = ContentCompressor(manager, enabled=True, min_bytes=512, search_prefix_chars=16)
+    manager.save_message("s1", "assistant", "独特开头词 " + _reply(3))
+
+    # 开头部分仍可被基于 content 列的查询命中，结尾部分只存在于压缩内容中
+    rows = manager._query("SELECT content, content_compressed FROM chat_messages WHERE content LIKE :term",
+                          {"term": "%独特开头词%"})
+    assert len(rows) == 1 and rows[0]["content_compressed"]
+    assert not manager._query("SELECT id FROM chat_messages WHERE content LIKE :term", {"term": "%完整的错误日志%"})
+    assert manager.get_history_messages("s1")[0]["content"].endswith("继续帮助你排查。")
+
+
+def test_archive_round_trip_keeps_compressed_messages(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    manager.content_compressor = ContentCompressor(manager, enabled=True, min_bytes=512, search_prefix_chars=64)
+    manager.save_message("cold", "assistant", _reply(1))
+    manager._query("UPDATE chat_messages SET created_at = '2020-01-01 00:00:00'")
+    manager._query("UPDATE chat_sessions SET updated_at = '2020-01-01 00:00:00'")
+
+    assert manager.message_archive.run_once()["messages"] == 1
+    assert manager.get_history_messages("cold") == [{"role": "assistant", "content": _reply(1)}]
+    manager.save_message("cold", "user", "继续")
+    assert manager._query("SELECT content_compressed FROM chat_messages ORDER BY id")[0]["content_compressed"]
+    assert manager.get_history_messages("cold")[0]["content"] == _reply(1)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试旧版数据迁移：分块读取和批量写入、会话与人设ID映射、中断后从检查点继续且不重复写入
+"""
+
+import sys
+import os
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+
+
+def _create_legacy_tables(manager):
+    for statement in [
+        "CREATE TABLE ai_personas_old (id INTEGER PRIMARY KEY, name TEXT, description TEXT, system_prompt TEXT)",
+        "CREATE TABLE chat_sessions_old (id INTEGER PRIMARY KEY, session_id TEXT, title TEXT, persona_id INTEGER)",
+        "CREATE TABLE chat_messages_old (id INTEGER PRIMARY KEY, session_id TEXT, role TEXT, content TEXT, "
+        "created_at TIMESTAMP)",
+        "CREATE TABLE chat_summaries_old (id INTEGER PRIMARY KEY, session_id TEXT, summary TEXT, message_count INTEGER)",
+    ]:
+        manager._query(statement)
+    manager._query("INSERT INTO ai_personas_old VALUES (7, '旧人设', '描述', '你是旧人设')")
+    manager._query("INSERT INTO ai_personas_old VALUES (8, '通用助手', '与默认人设同名', '你是一个有用的AI助手')")
+    manager._query("INSERT INTO chat_sessions_old VALUES (1, 'old-a', '会话A', 7)")
+    manager._query("INSERT INTO chat_sessions_old VALUES (2, 'old-b', NULL, NULL)")
+    manager.backend.execute_many(
+        "INSERT INTO chat_messages_old (session_id, role, content, created_at) VALUES (:s, :r, :c, :t)",
+        [{"s": ("old-a", "old-b", "old-c")[i % 3], "r": "user" if i % 2 == 0 else "assistant",
+          "c": f"消息 {i}, '引号'", "t": f"2024-01-01 00:00:{i:02d}"} for i in range(25)]
+        + [{"s": "old-a", "r": "bogus", "c": "无效角色", "t": "2024-01-01 00:01:00"}])
+    manager._query("INSERT INTO chat_summaries_old (session_id, summary, message_count) VALUES ('old-c', '摘要', 9)")
+
+
+def test_legacy_migration_is_chunked_and_resumable(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    _create_legacy_tables(manager)
+
+    # 第3次批量写入时失败，之前已提交的块不应重复写入
+    original = manager.backend.execute_many
+    calls = {"count": 0}
+
+    def failing_execute_many(sql, rows):
+        calls["count"] += 1
+        if calls["count"] == 3:
+            raise RuntimeError("模拟中断")
+        return original(sql, rows)
+
+    manager.backend.execute_many = failing_execute_many
+    with pytest.raises(RuntimeError):
+        manager.create_tables(chunk_size=10)
+    legacy_step = next(step for step in manager.migrations.get_status() if step["version"] == 5)
+    assert legacy_step["status"] == "running"
+    assert legacy_step["checkpoint"]["phase"] == 2
+
+    manager.backend.execute_many = original
+    manager.create_tables(chunk_size=10)
+    legacy_step = next(step for step in manager.migrations.get_status() if step["version"] == 5)
+    checkpoint = legacy_step["checkpoint"]
+    assert legacy_step["status"] == "done"
+    assert checkpoint["progress"] == 1.0 and checkpoint["eta_seconds"] == 0
+    assert checkpoint["processed"] == {"ai_personas_old": 2, "chat_sessions_old": 2,
+                                       "chat_messages_old": 26, "chat_summaries_old": 1}
+    assert checkpoint["skipped"] == 1
+
+    assert manager.get_message_count("old-a") == 9
+    assert manager.get_message_count("old-b") == 8
+    assert manager.get_message_count("old-c") == 8
+    assert manager.get_history_messages("old-a", limit=1)[0]["content"] == "消息 0, '引号'"
+    assert manager.get_recent_summary("old-c") == "摘要"
+
+    sessions = {row["session_id"]: row for row in manager._query(
+        "SELECT s.session_id, s.title, p.name AS persona FROM chat_sessions s "
+        "LEFT JOIN ai_personas p ON s.persona_id = p.id")}
+    assert sessions["old-a"]["title"] == "会话A" and sessions["old-a"]["persona"] == "旧人设"
+    assert sessions["old-c"]["title"] == "新对话"
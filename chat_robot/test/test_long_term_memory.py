@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试长期记忆的写入、召回和删除
+"""
+
+import sys
+import os
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.embedding import HashingEmbedder
+from chat_robot.long_term_memory import LongTermMemory
+from chat_robot.prompt_manager import PromptManager
+
+
+def _build_memory(directory):
+    memory = LongTermMemory(HashingEmbedder(256), storage_dir=directory, top_k=2, min_similarity=0.1)
+    memory.remember("s1", "user", "我养了一只叫豆豆的柯基犬")
+    memory.remember("s1", "assistant", "柯基犬很可爱，豆豆几岁了？")
+    memory.remember("s1", "user", "今天的天气预报说会下雨")
+    memory.remember("s1", "user", "明天要去上班")
+    return memory
+
+
+def test_recall_excludes_recent_window():
+    """只召回最近窗口之外的相关消息，并保持原始顺序"""
+    with tempfile.TemporaryDirectory() as directory:
+        memory = _build_memory(directory)
+        results = memory.recall("s1", "我的柯基犬叫什么名字", exclude_recent=1)
+        contents = [r["content"] for r in results]
+        assert contents[0] == "我养了一只叫豆豆的柯基犬"
+        assert "明天要去上班" not in contents
+
+        assert memory.recall("s1", "柯基犬", exclude_recent=4) == []
+
+
+def test_recall_excludes_window_by_message_id():
+    """按消息ID排除上下文窗口：当前消息尚未写入时，窗口外最新的相关消息仍能召回"""
+    with tempfile.TemporaryDirectory() as directory:
+        memory = LongTermMemory(HashingEmbedder(256), storage_dir=directory, top_k=2, min_similarity=0.1)
+        memory.remember("s1", "user", "我养了一只叫豆豆的柯基犬", message_id=1)
+        memory.remember("s1", "assistant", "柯基犬很可爱，豆豆几岁了？", message_id=2)
+        memory.remember("s1", "user", "明天要去上班", message_id=3)
+
+        # 窗口为消息3和尚未写入长期记忆的当前消息4，按条数排除2条会误排除消息2
+        results = memory.recall("s1", "豆豆几岁了", exclude_ids=[3, 4])
+        assert [r["content"] for r in results] == ["我养了一只叫豆豆的柯基犬", "柯基犬很可爱，豆豆几岁了？"]
+        assert [r["content"] for r in memory.recall("s1", "豆豆", exclude_ids=[2, 3, 4])] == [
+            "我养了一只叫豆豆的柯基犬"]
+
+
+def test_memory_persists_and_forget():
+    """新实例从磁盘映射已有向量，forget后清空"""
+    with tempfile.TemporaryDirectory() as directory:
+        _build_memory(directory)
+        reopened = LongTermMemory(HashingEmbedder(256), storage_dir=directory, top_k=1, min_similarity=0.1)
+        assert "豆豆" in reopened.recall("s1", "豆豆")[0]["content"]
+
+        reopened.forget("s1")
+        assert reopened.recall("s1", "豆豆") == []
+
+
+def test_build_system_prompt_with_memories():
+    """召回的消息附加到系统提示词中"""
+    prompt = PromptManager(None).build_system_prompt(
+        "基础提示", "", "", [{"role": "user", "content": "我养了一只柯基"}]
+    )
+    assert "相关的历史对话片段" in prompt and "用户: 我养了一只柯基" in prompt
+
+
+def test_remote_embedder_dimension_is_probed_before_store():
+    """远程向量模型的维度在创建向量存储前通过一次探测调用确定"""
+    from types import SimpleNamespace
+    from chat_robot.embedding import OpenAIEmbedder
+    from chat_robot.vector_store import VectorStore
+
+    calls = []
+
+    def create(model, input):
+        calls.append(input)
+        return SimpleNamespace(data=[SimpleNamespace(embedding=[1.0, 0.0, 0.0]) for _ in input])
+
+    embedder = OpenAIEmbedder(SimpleNamespace(embeddings=SimpleNamespace(create=create)), "remote")
+    assert embedder.dim is None
+    assert embedder.ensure_dim() == 3 and embedder.ensure_dim() == 3
+    assert len(calls) == 1
+    with tempfile.TemporaryDirectory() as directory:
+        memory = LongTermMemory(embedder, vector_store=VectorStore(directory, dim=embedder.dim), min_similarity=0.1)
+        memory.remember("s1", "user", "你好")
+        assert memory.recall("s1", "你好")[0]["content"] == "你好"
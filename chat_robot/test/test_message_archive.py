@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试冷会话消息归档：归档后热表为空、读取历史透明合并归档、会话有新消息时恢复到热表
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+from chat_robot.message_archive import decode_messages, encode_messages
+from chat_robot.search_manager import SearchManager
+
+
+def _make_cold(manager, session_id):
+    manager._query("UPDATE chat_messages SET created_at = '2020-01-01 00:00:00' WHERE session_id = "
+                   "(SELECT id FROM chat_sessions WHERE session_id = :session_id)", {"session_id": session_id})
+    manager._query("UPDATE chat_sessions SET updated_at = '2020-01-01 00:00:00' WHERE session_id = :session_id",
+                   {"session_id": session_id})
+
+
+def test_encode_round_trip():
+    messages = [{"id": 1, "role": "user", "content": "你好\n换行", "created_at": "2020-01-01 00:00:00"}]
+    encoded = encode_messages(messages)
+    assert decode_messages(encoded["codec"], encoded["payload"]) == messages
+
+
+def test_cold_sessions_are_archived_and_read_transparently(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    for i in range(6):
+        manager.save_message("cold", "user" if i % 2 == 0 else "assistant", f"消息 {i}")
+    manager.save_message("warm", "user", "最近的消息")
+    _make_cold(manager, "cold")
+
+    history = manager.get_history_messages("cold")
+    recent = manager.get_recent_messages("cold", limit=4)
+
+    result = manager.message_archive.run_once()
+    assert result == {"sessions": 1, "messages": 6, "skipped": False}
+    assert manager._query("SELECT COUNT(*) AS count FROM chat_messages m JOIN chat_sessions s "
+                          "ON m.session_id = s.id WHERE s.session_id = 'cold'")[0]["count"] == 0
+    assert manager.get_message_count("warm") == 1
+    # 已归档的会话不会重复归档
+    assert manager.message_archive.run_once()["sessions"] == 0
+
+    assert manager.get_history_messages("cold") == history
+    assert manager.get_history_messages("cold", limit=2) == history[:2]
+    assert manager.get_recent_messages("cold", limit=4) == recent
+    assert manager.get_message_count("cold") == 6
+    assert manager.message_archive.get_stats()["compressed_bytes"] > 0
+
+    # 新消息写入前先恢复归档，顺序保持不变
+    manager.save_message("cold", "user", "回来了")
+    assert manager._query("SELECT COUNT(*) AS count FROM chat_message_archives")[0]["count"] == 0
+    assert manager.get_history_messages("cold") == history + [{"role": "user", "content": "回来了"}]
+    assert manager.get_message_count("cold") == 7
+
+
+def test_archived_messages_are_included_in_search_index(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    manager.save_message("cold", "user", "归档前的旧问题")
+    manager.save_message("warm", "user", "最近的消息")
+    _make_cold(manager, "cold")
+    assert manager.message_archive.run_once()["messages"] == 1
+
+    rows = list(manager.iter_messages_for_search())
+    assert sorted((row["session_id"], row["content"]) for row in rows) == [
+        ("cold", "归档前的旧问题"), ("warm", "最近的消息")]
+    assert len({row["id"] for row in rows}) == 2
+
+    results = SearchManager(manager, backend="memory").search("旧问题")["results"]
+    assert [result["session_id"] for result in results] == ["cold"]
+
+
+def test_clear_session_removes_archive(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    manager.save_message("cold", "user", "旧消息")
+    _make_cold(manager, "cold")
+    manager.message_archive.run_once()
+
+    assert manager.clear_session_messages("cold")
+    assert manager.get_history_messages("cold") == []
+    assert manager.get_message_count("cold") == 0
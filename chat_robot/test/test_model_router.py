@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试本地模型请求路由：最少未完成token、会话亲和性、故障转移和接口汇总
+"""
+
+import sys
+import os
+
+import httpx
+from fastapi.testclient import TestClient
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.model_router import ModelRouter, create_router_app
+
+
+def _conversation(first_user):
+    return [{"role": "system", "content": "人设"}, {"role": "user", "content": first_user}]
+
+
+def test_least_outstanding_tokens_and_affinity():
+    """新对话发往最空闲的进程，后续轮次保持在同一进程，负载差距过大时放弃亲和性"""
+    router = ModelRouter(["http://w0", "http://w1"], affinity_slack_tokens=100)
+    w0, w1 = router.workers
+    key = ModelRouter.affinity_key(_conversation("你好"))
+
+    w0.outstanding_tokens = 300
+    first = router.acquire(key, 50)
+    assert first is w1
+    router.release(first, 50)
+
+    # 亲和进程负载略高但在容忍范围内，仍然发往它
+    w0.outstanding_tokens = 0
+    w1.outstanding_tokens = 80
+    assert router.acquire(key, 50) is w1
+    router.release(w1, 50)
+    assert router.get_stats()["affinity_hits"] == 1
+
+    # 负载差距超过容忍值，改发到空闲进程并更新亲和关系
+    w1.outstanding_tokens = 500
+    assert router.acquire(key, 50) is w0
+    assert router.get_stats()["affinity_overrides"] == 1
+    assert router.acquire(key, 50) is w0
+
+
+def _transport(failing=()):
+    def handler(request: httpx.Request):
+        host = request.url.host
+        if host in failing:
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.path == "/v1/chat/completions":
+            return httpx.Response(200, json={"object": "chat.completion", "worker": host})
+        if request.url.path == "/v1/models":
+            return httpx.Response(200, json={"data": [{"id": "qwen2.5-3b"}, {"id": f"model-{host}"}]})
+        if request.url.path == "/health":
+            return httpx.Response(200, json={"status": "ok"})
+        return httpx.Response(404)
+    return httpx.MockTransport(handler)
+
+
+def test_router_app_failover_and_aggregation():
+    """连接失败的进程被摘除并换进程重试，/v1/models 与 /health 汇总所有进程"""
+    router = ModelRouter(["http://w0", "http://w1"])
+    app = create_router_app(router, transport=_transport(failing={"w0"}), health_interval=0)
+    with TestClient(app) as client:
+        body = {"model": "qwen", "messages": _conversation("hi"), "max_tokens": 16}
+        for _ in range(3):
+            response = client.post("/v1/chat/completions", json=body)
+            assert response.status_code == 200
+            assert response.json()["worker"] == "w1"
+        stats = client.get("/v1/stats").json()
+        assert stats["errors"] == 1 and stats["retries"] == 1
+
+        models = {item["id"] for item in client.get("/v1/models").json()["data"]}
+        assert models == {"qwen2.5-3b", "model-w1"}
+
+        health = client.get("/health").json()
+        assert health["status"] == "ok" and health["healthy_workers"] == 1
+
+
+def test_router_app_passes_through_non_json_worker_responses():
+    """工作进程返回非JSON内容时不抛出异常：错误状态码透传，成功状态码改为502"""
+    def handler(request: httpx.Request):
+        if request.url.host == "w0":
+            return httpx.Response(500, text="Internal Server Error")
+        return httpx.Response(200, text="<html>not json</html>")
+
+    body = {"model": "qwen", "messages": _conversation("hi"), "max_tokens": 16}
+    for host, status_code, text in (("w0", 500, "Internal Server Error"), ("w1", 502, "<html>not json</html>")):
+        router = ModelRouter([f"http://{host}"])
+        app = create_router_app(router, transport=httpx.MockTransport(handler), health_interval=0)
+        with TestClient(app) as client:
+            response = client.post("/v1/chat/completions", json=body)
+            assert response.status_code == status_code
+            assert response.json() == {"error": text}
+            assert router.get_stats()["errors"] == 0
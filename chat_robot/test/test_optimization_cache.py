@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试人设优化结果缓存
+"""
+
+import sys
+import os
+import time
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.optimization_cache import OptimizationCache
+
+
+def _make_cache(**kwargs):
+    tmp_dir = tempfile.mkdtemp()
+    return OptimizationCache(os.path.join(tmp_dir, "optimize.sqlite3"), **kwargs)
+
+
+def test_hit_and_persistence():
+    """写入后命中，重新打开缓存文件后仍然命中"""
+    cache = _make_cache()
+    assert cache.get("诗人", "glm-4.6", "1") is None
+    cache.set("诗人", "glm-4.6", "1", '{"description": "浪漫的诗人"}')
+
+    started = time.perf_counter()
+    assert cache.get(" 诗人 ", "glm-4.6", "1") == '{"description": "浪漫的诗人"}'
+    assert (time.perf_counter() - started) < 0.05
+
+    reopened = OptimizationCache(str(cache.db_path))
+    assert reopened.get("诗人", "glm-4.6", "1") is not None
+    print("✅ 命中与持久化测试通过")
+
+
+def test_key_includes_model_and_template_version():
+    """模型或模板版本不同不命中"""
+    cache = _make_cache()
+    cache.set("诗人", "glm-4.6", "1", "v1")
+    assert cache.get("诗人", "deepseek-chat", "1") is None
+    assert cache.get("诗人", "glm-4.6", "2") is None
+    print("✅ 缓存键测试通过")
+
+
+def test_eviction_and_ttl():
+    """超过上限淘汰最久未使用条目，过期条目不返回"""
+    cache = _make_cache(max_entries=2)
+    cache.set("a", "m", "1", "A")
+    time.sleep(0.01)
+    cache.set("b", "m", "1", "B")
+    time.sleep(0.01)
+    cache.get("a", "m", "1")
+    cache.set("c", "m", "1", "C")
+    assert cache.get("b", "m", "1") is None
+    assert cache.get("a", "m", "1") == "A"
+    assert cache.get_stats()["entries"] == 2
+
+    expiring = _make_cache(ttl_days=0)
+    expiring.set("a", "m", "1", "A")
+    assert expiring.get("a", "m", "1") is None
+    print("✅ 淘汰与过期测试通过")
+
+
+if __name__ == "__main__":
+    test_hit_and_persistence()
+    test_key_includes_model_and_template_version()
+    test_eviction_and_ttl()
+    print("测试完成!")
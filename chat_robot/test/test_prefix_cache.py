@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试前缀KV缓存（用token列表模拟 past_key_values）
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.prefix_cache import PrefixKVCache
+
+
+def test_next_turn_reuses_previous_prefix():
+    """下一轮输入以上一轮的提示词和回复为前缀时，只需预填充新增部分"""
+    cache = PrefixKVCache(max_bytes=1000, block_size=4)
+    turn_1 = list(range(10))
+    cache.store(turn_1, list(turn_1))
+
+    turn_2 = turn_1 + [100, 101, 102]
+    kv, reused = cache.lookup(turn_2)
+    assert reused == 8
+    assert kv == turn_1[:8]
+
+    stats = cache.get_stats()
+    assert stats["hits"] == 1 and stats["reused_tokens"] == 8 and stats["prefilled_tokens"] == 5
+
+
+def test_lookup_returns_copy_and_keeps_last_token():
+    """返回的是副本，且至少保留最后一个token用于预填充"""
+    cache = PrefixKVCache(max_bytes=1000, block_size=4)
+    stored = list(range(8))
+    cache.store(stored, stored)
+
+    kv, reused = cache.lookup(list(range(8)))
+    assert reused == 4
+    kv.append("mutated")
+    assert stored == list(range(8))
+
+
+def test_divergent_prefix_and_miss():
+    """只复用与缓存一致的块，完全不同的输入不命中"""
+    cache = PrefixKVCache(max_bytes=1000, block_size=4)
+    cache.store(list(range(12)), list(range(12)))
+
+    _, reused = cache.lookup([0, 1, 2, 3, 4, 99, 6, 7, 8, 9])
+    assert reused == 4
+    kv, reused = cache.lookup([50, 51, 52, 53, 54])
+    assert kv is None and reused == 0
+
+
+def test_lru_memory_budget():
+    """超过内存预算时淘汰最久未使用的条目，并清理其索引"""
+    cache = PrefixKVCache(max_bytes=20, block_size=4)
+    cache.store([1] * 8, [0] * 8)
+    cache.store([2] * 8, [0] * 8)
+    cache.lookup([1] * 9)
+    cache.store([3] * 8, [0] * 8)
+
+    assert cache.lookup([2] * 9)[1] == 0
+    assert cache.lookup([1] * 9)[1] == 8
+    stats = cache.get_stats()
+    assert stats["evictions"] == 1 and stats["bytes"] == 16
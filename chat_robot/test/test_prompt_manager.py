@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试人设提示词编译缓存：同一人设版本复用编译结果，每轮只附加摘要，人设更新后重新编译
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.prompt_manager import PromptManager
+from chat_robot.token_counter import estimate_tokens
+
+
+def test_compiled_prompt_is_reused_across_turns():
+    manager = PromptManager(None)
+    first = manager.compile_persona_prompt("基础提示", "你是一只猫", persona_id=1, persona_version="v1")
+    second = manager.compile_persona_prompt("基础提示", "你是一只猫", persona_id=1, persona_version="v1")
+    assert second is first
+    assert "你是一只猫" in first.text and first.tokens == estimate_tokens(first.text)
+
+    prompt = manager.render_system_prompt(first, "聊过天气")
+    assert prompt.startswith(first.text) and prompt.endswith("历史对话摘要：聊过天气")
+    assert manager.estimate_system_prompt_tokens(first, prompt) == first.tokens + estimate_tokens(prompt[len(first.text):])
+    assert manager.build_system_prompt("基础提示", "你是一只猫", "聊过天气", persona_id=1, persona_version="v1") == prompt
+    assert manager.get_stats() == {"compile_hits": 2, "compile_misses": 1, "compiled_prompts": 1}
+
+
+def test_persona_change_recompiles_with_new_prefix_hash():
+    manager = PromptManager(None)
+    old = manager.compile_persona_prompt("基础提示", "你是一只猫", persona_id=1, persona_version="v1")
+    new_version = manager.compile_persona_prompt("基础提示", "你是一只狗", persona_id=1, persona_version="v2")
+    # 内容变化但版本未变时也重新编译
+    same_version = manager.compile_persona_prompt("基础提示", "你是一只鸟", persona_id=1, persona_version="v2")
+    assert len({old.prefix_hash, new_version.prefix_hash, same_version.prefix_hash}) == 3
+    assert "你是一只鸟" in same_version.text
+
+    # 没有人设ID时按内容缓存
+    inline = manager.compile_persona_prompt("基础提示")
+    assert manager.compile_persona_prompt("基础提示") is inline
+    assert manager.compile_persona_prompt("", "").text == "你是一个AI助手，请根据用户的需求提供准确、有用的回答。"
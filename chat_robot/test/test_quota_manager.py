@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试用户配额：软限制提醒、硬限制拒绝、按用户覆盖默认配额和重置时间
+"""
+
+import sys
+import os
+from datetime import datetime
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.usage_ledger import UsageLedger, SYSTEM_USER_ID
+from chat_robot.quota_manager import QuotaManager, QuotaExceededError, AnonymousQuotaError
+
+
+class _FakeDataManager:
+    def __init__(self, quotas):
+        self.quotas = quotas
+        self.quota_loads = 0
+
+    def get_user_quota(self, user_id):
+        self.quota_loads += 1
+        return self.quotas.get(user_id)
+
+    def get_user_usage_totals(self, user_id, month_start, today):
+        return {}
+
+    def record_usage(self, *args):
+        pass
+
+
+def test_soft_and_hard_token_limits():
+    """达到软限制时放行并提醒，预计超出硬限制时拒绝，并在次日零点后可重试"""
+    now = datetime(2026, 10, 19, 23, 0).timestamp()
+    ledger = UsageLedger(clock=lambda: now)
+    quotas = QuotaManager(ledger, default_limits={"daily_tokens": 1000}, soft_ratio=0.8, clock=lambda: now)
+
+    assert quotas.enforce(1, 100) == {"allowed": True, "warnings": [], "exceeded": None}
+    ledger.record("s1", 1, "local", "qwen", 600, 200)
+    result = quotas.enforce(1, 50)
+    assert result["allowed"] and result["warnings"][0]["quota"] == "daily_tokens"
+
+    with pytest.raises(QuotaExceededError) as exc:
+        quotas.enforce(1, 300)
+    assert exc.value.quota == "daily_tokens" and exc.value.used == 800
+    assert exc.value.retry_after == 3600
+
+    # 其他用户不受影响
+    assert quotas.enforce(2, 300)["allowed"]
+    assert quotas.get_stats()["rejected"] == 1
+
+
+def test_internal_usage_is_separate_from_anonymous_quota():
+    """系统内部调用单独计数且不受配额限制；匿名请求共用一个计数，可配置为直接拒绝"""
+    now = datetime(2026, 10, 19, 12, 0).timestamp()
+    ledger = UsageLedger(clock=lambda: now)
+    quotas = QuotaManager(ledger, default_limits={"daily_tokens": 100}, clock=lambda: now)
+
+    ledger.record("system_internal", SYSTEM_USER_ID, "local", "qwen", 500, 500)
+    assert ledger.get_user_usage(None)["total_tokens"] == 0
+    assert quotas.enforce(None, 50)["allowed"]
+    assert quotas.enforce(SYSTEM_USER_ID, 10_000)["allowed"]
+
+    ledger.record("s1", None, "local", "qwen", 60, 0)
+    with pytest.raises(QuotaExceededError):
+        quotas.enforce(None, 50)
+
+    strict = QuotaManager(ledger, default_limits={"daily_tokens": 100}, clock=lambda: now, allow_anonymous=False)
+    with pytest.raises(AnonymousQuotaError):
+        strict.enforce(None)
+    assert strict.enforce(1, 50)["allowed"]
+
+
+def test_per_user_overrides_and_request_quota():
+    """user_quotas 中的设置覆盖默认值，0表示不限制；配额缓存后不再读取数据库"""
+    now = datetime(2026, 12, 31, 12, 0).timestamp()
+    data_manager = _FakeDataManager({5: {"daily_tokens": 0, "monthly_tokens": None, "monthly_requests": 2}})
+    ledger = UsageLedger(data_manager, clock=lambda: now)
+    quotas = QuotaManager(ledger, data_manager, default_limits={"daily_tokens": 10, "monthly_requests": 100},
+                          clock=lambda: now)
+
+    assert quotas.enforce(5, 10_000)["allowed"]
+    ledger.record("s", 5, "local", "qwen", 1, 1)
+    ledger.record("s", 5, "local", "qwen", 1, 1)
+    with pytest.raises(QuotaExceededError) as exc:
+        quotas.enforce(5)
+    # 月度配额在次年1月1日重置
+    assert exc.value.quota == "monthly_requests" and exc.value.retry_after == 12 * 3600
+    assert data_manager.quota_loads == 1
+
+    status = quotas.get_user_status(5)["quotas"]
+    assert status["monthly_requests"] == {"limit": 2, "used": 2, "remaining": 0}
+    assert status["daily_tokens"]["remaining"] is None
+
+
+def test_chat_turn_over_quota_is_rejected_before_summary(tmp_path):
+    """按人设提示词和上下文预估超出配额时，在调用摘要模型之前拒绝并撤销本轮的用户消息"""
+    from types import SimpleNamespace
+    from chat_robot.chat_api import ChatAPI
+    from chat_robot.data_manager import DataManager
+    from chat_robot.prompt_manager import PromptManager
+    from chat_robot.search_manager import SearchManager
+    from chat_robot.single_flight import SingleFlight
+
+    calls = []
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(
+        create=lambda **kwargs: calls.append(kwargs))))
+    chat_api = ChatAPI.__new__(ChatAPI)
+    chat_api.data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    chat_api.data_manager.create_tables()
+    chat_api.ai_config = {"local_model_enabled": True, "local_model_name": "fake", "model_name": "fake"}
+    # 消息数超过阈值，通过配额检查时会调用模型生成摘要
+    chat_api.context_config = {"enable_compression": True, "summary_threshold": 0, "window_size": 1}
+    chat_api.client = client
+    chat_api.prompt_manager = PromptManager(client)
+    chat_api.response_cache = None
+    chat_api.summary_flight = SingleFlight()
+    chat_api.search_manager = SearchManager(chat_api.data_manager)
+    chat_api.long_term_memory = None
+    chat_api.usage_ledger = UsageLedger()
+    chat_api.quota_manager = QuotaManager(chat_api.usage_ledger, default_limits={"daily_tokens": 50})
+
+    chat_api.data_manager.save_message("s1", "user", "之前的问题")
+    with pytest.raises(QuotaExceededError):
+        chat_api.chat_with_history("s1", "请详细解释" * 20)
+    assert calls == []
+    assert chat_api.data_manager.get_history_messages("s1") == [{"role": "user", "content": "之前的问题"}]
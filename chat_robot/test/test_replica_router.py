@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试只读副本路由：只读查询走副本、写后读固定主库、延迟过大或查询失败的副本回退主库
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+from chat_robot.replica_router import ReplicaRouter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _setup(tmp_path):
+    primary_url = f"sqlite:///{tmp_path / 'primary.sqlite3'}"
+    replica_url = f"sqlite:///{tmp_path / 'replica.sqlite3'}"
+    # 用两个独立的SQLite文件模拟主库和尚未同步的副本
+    replica = DataManager(replica_url)
+    replica.create_tables()
+    replica.save_message("s1", "user", "副本中的旧消息")
+
+    manager = DataManager(primary_url)
+    manager.create_tables()
+    manager.save_message("s1", "user", "主库中的消息")
+    clock = FakeClock()
+    manager.replicas = ReplicaRouter(manager.backend, [replica_url], max_lag_seconds=5, pin_seconds=5,
+                                     health_interval=10, clock=clock)
+    return manager, clock
+
+
+def test_reads_go_to_replica_unless_session_just_wrote(tmp_path):
+    manager, clock = _setup(tmp_path)
+    assert manager.get_history_messages("s1") == [{"role": "user", "content": "副本中的旧消息"}]
+
+    manager.save_message("s1", "assistant", "刚写入")
+    assert [m["content"] for m in manager.get_history_messages("s1")] == ["主库中的消息", "刚写入"]
+    assert manager.get_message_count("s1") == 2
+    # 其他会话不受影响
+    assert manager.get_message_count("s2") == 0
+
+    clock.now += 6
+    assert manager.get_history_messages("s1") == [{"role": "user", "content": "副本中的旧消息"}]
+    stats = manager.replicas.get_stats()
+    assert stats["pinned_reads"] >= 2 and stats["replica_reads"] >= 3
+    assert stats["replicas"][0]["healthy"]
+
+
+def test_lagging_or_failing_replica_falls_back_to_primary(tmp_path):
+    manager, clock = _setup(tmp_path)
+    replica = manager.replicas.replicas[0]
+
+    replica.backend.replication_lag = lambda: 30.0
+    clock.now += 10
+    assert manager.get_history_messages("s1") == [{"role": "user", "content": "主库中的消息"}]
+    assert not replica.healthy and replica.lag == 30.0
+
+    replica.backend.replication_lag = lambda: 0.0
+    clock.now += 10
+    assert manager.get_history_messages("s1") == [{"role": "user", "content": "副本中的旧消息"}]
+
+    def broken(sql, parameters=None):
+        raise RuntimeError("连接断开")
+
+    replica.backend.query = broken
+    assert manager.get_history_messages("s1") == [{"role": "user", "content": "主库中的消息"}]
+    assert not replica.healthy and manager.replicas.get_stats()["replica_errors"] == 1
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试响应缓存（精确匹配、语义匹配、TTL与淘汰）
+"""
+
+import sys
+import os
+import time
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.embedding import HashingEmbedder
+from chat_robot.response_cache import ResponseCache
+
+
+def _context(system_prompt="你是通用助手"):
+    return [{"role": "system", "content": system_prompt}]
+
+
+def test_exact_hit_after_normalization():
+    """规范化后完全相同的输入命中精确层"""
+    cache = ResponseCache(embedder=None)
+    partition = cache.make_partition_key(1, "glm-4.6", _context())
+    assert cache.lookup(partition, "你好，介绍一下你自己") is None
+
+    cache.store(partition, "你好，介绍一下你自己", "我是通用助手。", latency_ms=800)
+    hit = cache.lookup(partition, "  你好,介绍一下你自己 ")
+    assert hit is not None and hit.tier == "exact"
+    assert hit.response == "我是通用助手。"
+
+    stats = cache.get_stats()
+    assert stats["exact_hits"] == 1 and stats["misses"] == 1
+    assert stats["hit_ratio"] == 0.5
+    assert stats["latency_saved_ms"] == 800
+    print("✅ 精确匹配测试通过")
+
+
+def test_partition_isolation():
+    """不同人设或模型之间不共享缓存"""
+    cache = ResponseCache(embedder=None)
+    partition_a = cache.make_partition_key(1, "glm-4.6", _context())
+    partition_b = cache.make_partition_key(2, "glm-4.6", _context())
+    partition_c = cache.make_partition_key(1, "deepseek-chat", _context())
+    cache.store(partition_a, "你好", "A")
+    assert cache.lookup(partition_b, "你好") is None
+    assert cache.lookup(partition_c, "你好") is None
+    print("✅ 分区隔离测试通过")
+
+
+def test_semantic_hit():
+    """近似输入命中语义层，无关输入不命中"""
+    cache = ResponseCache(embedder=HashingEmbedder(256), similarity_threshold=0.75)
+    partition = cache.make_partition_key(1, "glm-4.6", _context())
+    cache.store(partition, "你好，请介绍一下你自己", "我是通用助手。")
+
+    hit = cache.lookup(partition, "你好，介绍一下你自己吧")
+    assert hit is not None and hit.tier == "semantic", hit
+    assert cache.lookup(partition, "帮我写一个快速排序") is None
+    print("✅ 语义匹配测试通过")
+
+
+def test_ttl_and_lru_eviction():
+    """过期条目失效，超过条目上限时淘汰最久未使用的条目"""
+    cache = ResponseCache(embedder=None, ttl_seconds=0.05, max_entries=2)
+    partition = cache.make_partition_key(None, "m", [])
+    cache.store(partition, "q1", "a1")
+    time.sleep(0.1)
+    assert cache.lookup(partition, "q1") is None
+    assert cache.get_stats()["evictions_ttl"] == 1
+
+    cache.ttl_seconds = 60
+    cache.store(partition, "q1", "a1")
+    cache.store(partition, "q2", "a2")
+    cache.lookup(partition, "q1")  # q1 变为最近使用
+    cache.store(partition, "q3", "a3")
+    assert cache.lookup(partition, "q2") is None
+    assert cache.lookup(partition, "q1") is not None
+    assert cache.get_stats()["evictions_lru"] == 1
+    print("✅ TTL与LRU淘汰测试通过")
+
+
+def test_memory_cap():
+    """内存上限约束缓存总大小"""
+    cache = ResponseCache(embedder=None, max_memory_bytes=2000)
+    partition = cache.make_partition_key(None, "m", [])
+    for i in range(10):
+        cache.store(partition, f"q{i}", "回复" * 100)
+    stats = cache.get_stats()
+    assert stats["memory_bytes"] <= 2000
+    assert stats["evictions_memory"] > 0
+    print("✅ 内存上限测试通过")
+
+
+def test_embedder_failure_does_not_break_chat_turn(tmp_path):
+    """语义层向量化失败时按未命中处理，模型回复照常返回并保存"""
+    from types import SimpleNamespace
+    from chat_robot.chat_api import ChatAPI
+    from chat_robot.data_manager import DataManager
+    from chat_robot.prompt_manager import PromptManager
+    from chat_robot.search_manager import SearchManager
+    from chat_robot.single_flight import SingleFlight
+
+    class _FailingEmbedder:
+        name = "failing"
+        dim = 8
+
+        def embed(self, texts):
+            raise TimeoutError("embedding timeout")
+
+    reply = SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="模型回复"))],
+                            usage=SimpleNamespace(prompt_tokens=10, completion_tokens=5))
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: reply)))
+    chat_api = ChatAPI.__new__(ChatAPI)
+    chat_api.data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    chat_api.data_manager.create_tables()
+    chat_api.ai_config = {"local_model_enabled": True, "local_model_name": "fake", "model_name": "fake",
+                          "max_tokens": 64, "temperature": 0.7}
+    chat_api.context_config = {"enable_compression": False, "window_size": 4}
+    chat_api.client = client
+    chat_api.prompt_manager = PromptManager(client)
+    chat_api.response_cache = ResponseCache(embedder=_FailingEmbedder())
+    chat_api.summary_flight = SingleFlight()
+    chat_api.search_manager = SearchManager(chat_api.data_manager)
+    chat_api.long_term_memory = None
+    chat_api.usage_ledger = None
+    chat_api.quota_manager = None
+
+    assert chat_api.chat_with_history("s1", "你好") == "模型回复"
+    assert chat_api.data_manager.get_history_messages("s1") == [
+        {"role": "user", "content": "你好"}, {"role": "assistant", "content": "模型回复"}]
+
+
+if __name__ == "__main__":
+    test_exact_hit_after_normalization()
+    test_partition_isolation()
+    test_semantic_hit()
+    test_ttl_and_lru_eviction()
+    test_memory_cap()
+    print("测试完成!")
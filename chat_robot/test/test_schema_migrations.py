@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试数据库迁移：版本记录、表结构最新时只执行一次查询、分块迁移中断后从检查点继续
+"""
+
+import sys
+import os
+
+import pytest
+from sqlalchemy import event
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+from chat_robot.schema_migrations import MIGRATIONS, Migration, MigrationRunner
+
+
+def test_startup_is_a_single_query_when_current(tmp_path):
+    url = f"sqlite:///{tmp_path / 'chat.sqlite3'}"
+    result = DataManager(url).create_tables()
+    assert result == {"version": MIGRATIONS[-1].version, "applied": [m.version for m in MIGRATIONS]}
+
+    manager = DataManager(url)
+    statements = []
+    event.listen(manager.backend.engine, "before_cursor_execute",
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    assert manager.create_tables()["applied"] == []
+    assert len(statements) == 1
+    assert all(step["status"] == "done" for step in manager.migrations.get_status())
+
+
+def test_chunked_migration_resumes_from_checkpoint(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    manager._query("CREATE TABLE numbers (n INTEGER PRIMARY KEY)")
+    calls = {"chunks": 0, "fail_at": 2}
+
+    def copy_numbers(data_manager, checkpoint, chunk_size):
+        start = (checkpoint or {}).get("next", 0)
+        if calls["chunks"] == calls["fail_at"]:
+            raise RuntimeError("模拟中断")
+        calls["chunks"] += 1
+        end = min(start + chunk_size, 10)
+        for n in range(start, end):
+            data_manager._query("INSERT INTO numbers (n) VALUES (:n)", {"n": n})
+        return {"next": end}, end >= 10
+
+    migrations = MIGRATIONS + [Migration(100, "复制数字", apply_chunk=copy_numbers)]
+    with pytest.raises(RuntimeError):
+        MigrationRunner(manager, migrations).migrate(chunk_size=3)
+    status = MigrationRunner(manager, migrations).get_status()[-1]
+    assert status["status"] == "running" and status["checkpoint"] == {"next": 6}
+
+    calls["fail_at"] = None
+    result = MigrationRunner(manager, migrations).migrate(chunk_size=3)
+    assert result == {"version": 100, "applied": [100]}
+    # 从检查点继续，没有重复插入
+    assert manager._query("SELECT COUNT(*) AS count FROM numbers")[0]["count"] == 10
+    assert calls["chunks"] == 4
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试聊天记录搜索（内存倒排索引后端）
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.search_manager import InvertedIndex, SearchManager, tokenize_for_search, make_snippet
+
+
+class _FakeDataManager:
+    """只提供搜索所需接口的数据管理器"""
+
+    database_url = "sqlite:///:memory:"
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def iter_messages_for_search(self, batch_size=1000):
+        yield from self.rows
+
+
+def test_tokenize_mixed_text():
+    """英文按单词切分，中文按双字切分"""
+    assert tokenize_for_search("Python 数据库") == ["python", "数据", "据库"]
+
+
+def test_bm25_ranking_and_user_filter():
+    """命中词越集中的消息排名越靠前，并且只返回指定用户的会话"""
+    index = InvertedIndex()
+    index.add("s1", "user", "如何优化数据库查询性能", user_id=1, message_id=1)
+    index.add("s2", "user", "今天天气怎么样", user_id=1, message_id=2)
+    index.add("s3", "assistant", "数据库索引可以加速查询，数据库连接池也很重要", user_id=2, message_id=3)
+
+    results = index.search("数据库查询", limit=10)
+    assert [r["id"] for r in results][:2] in ([1, 3], [3, 1])
+    assert 2 not in [r["id"] for r in results]
+
+    only_user_1 = index.search("数据库", user_id=1)
+    assert [r["id"] for r in only_user_1] == [1]
+    # 其他用户的高分文档不会挤占指定用户的结果数
+    assert [r["id"] for r in index.search("数据库", user_id=1, limit=1)] == [1]
+    assert index.search("数据库", user_id=3) == []
+    index.remove_session("s1")
+    assert index.search("数据库", user_id=1) == []
+
+
+def test_remove_session():
+    """删除会话后不再出现在搜索结果中"""
+    index = InvertedIndex()
+    index.add("s1", "user", "hello world", message_id=1)
+    index.add("s2", "user", "hello there", message_id=2)
+    assert index.remove_session("s1") == 1
+    assert [r["id"] for r in index.search("hello")] == [2]
+    assert index.search("world") == []
+
+
+def test_search_manager_lazy_build_and_snippet():
+    """首次搜索时从数据库构建索引，之后新消息增量写入，结果带摘录"""
+    long_text = "前言" * 60 + "关键结论：缓存命中率提升明显" + "结尾" * 60
+    manager = SearchManager(_FakeDataManager([
+        {"id": 1, "session_id": "s1", "user_id": None, "title": "性能", "role": "assistant",
+         "content": long_text, "created_at": "2024-01-01 00:00:00"},
+    ]))
+    assert manager.backend == "memory"
+
+    result = manager.search("命中率")
+    assert result["total"] == 1
+    snippet = result["results"][0]["snippet"]
+    assert "命中率" in snippet and snippet.startswith("…") and len(snippet) < len(long_text)
+
+    manager.index_message("s2", "user", "命中率怎么计算")
+    assert manager.search("命中率")["total"] == 2
+
+
+def test_make_snippet_short_content():
+    """短内容原样返回"""
+    assert make_snippet("short text", "text") == "short text"
+
+
+def test_user_scoped_search_over_sqlite(tmp_path):
+    """会话记录所属用户，全量构建和增量写入的消息都能按用户过滤并带完整字段"""
+    from chat_robot.data_manager import DataManager
+
+    data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    data_manager.create_tables()
+    data_manager.save_user("alice")
+    user_id = data_manager._query("SELECT id FROM users WHERE username = 'alice'")[0]["id"]
+
+    data_manager.save_session("s1", "数据库", user_id=user_id)
+    data_manager.save_message("s1", "user", "如何优化数据库查询")
+    # 不存在的用户不关联，会话照常创建
+    data_manager.save_session("s2", "其他", user_id=99999)
+    data_manager.save_message("s2", "user", "数据库连接池")
+
+    manager = SearchManager(data_manager)
+    assert [r["session_id"] for r in manager.search("数据库", user_id=user_id)["results"]] == ["s1"]
+
+    saved = data_manager.save_message("s1", "assistant", "给查询字段加上数据库索引")
+    assert saved["user_id"] == user_id and saved["title"] == "数据库"
+    manager.index_message("s1", "assistant", "给查询字段加上数据库索引", saved["user_id"], saved["title"],
+                          saved["created_at"], saved["id"])
+    results = manager.search("索引", user_id=user_id)["results"]
+    assert results[0]["message_id"] == saved["id"] and results[0]["session_title"] == "数据库"
+    assert results[0]["created_at"] is not None
+    assert manager.search("索引", user_id=user_id + 1)["total"] == 0
+
+
+def test_memory_index_refresh_sees_other_workers_writes(tmp_path):
+    """多进程部署时超过 refresh_seconds 后重新构建索引，能搜到其他进程写入的消息、搜不到其他进程删除的会话"""
+    from chat_robot.data_manager import DataManager
+
+    data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    data_manager.create_tables()
+    data_manager.save_message("s1", "user", "数据库查询优化")
+    worker = SearchManager(data_manager, backend="memory", refresh_seconds=60)
+    assert worker.search("数据库")["total"] == 1
+
+    # 另一个进程写入和删除（本进程的索引没有收到增量）
+    data_manager.save_message("s2", "user", "数据库连接池")
+    data_manager.delete_session("s1")
+    assert worker.search("数据库")["total"] == 1
+
+    worker._loaded_at -= 61
+    assert [r["session_id"] for r in worker.search("数据库")["results"]] == ["s2"]
+
+
+def test_make_snippet_maps_normalized_offsets_back():
+    """全角字符、大小写和连续空白规范化后，摘录仍定位到原文中的命中位置"""
+    content = "Ｈｅｌｌｏ" + " \n\t " * 40 + "前言" * 20 + "ＤＡＴＡＢＡＳＥ 调优" + "结尾" * 40
+    snippet = make_snippet(content, "database")
+    assert "ＤＡＴＡＢＡＳＥ" in snippet and snippet.startswith("…")
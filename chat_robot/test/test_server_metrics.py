@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试模型服务的用量字段、吞吐量滑动窗口统计和多进程汇总
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.server_metrics import (ThroughputTracker, build_usage, merge_throughput_stats,
+                                       new_completion_id)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_usage_and_completion_ids():
+    """usage按实际token数计算，响应ID每次不同"""
+    usage = build_usage(120, 30, cached_tokens=96)
+    assert usage["total_tokens"] == 150
+    assert usage["prompt_tokens_details"]["cached_tokens"] == 96
+    ids = {new_completion_id() for _ in range(100)}
+    assert len(ids) == 100 and all(i.startswith("chatcmpl-") for i in ids)
+
+
+def test_throughput_window_and_averages():
+    """窗口只统计最近完成的请求，累计值保留全部请求"""
+    clock = _Clock()
+    tracker = ThroughputTracker(window_seconds=10, clock=clock)
+    clock.now += 10
+    tracker.record(100, 20, timing={"queue_ms": 0, "prefill_ms": 50, "decode_ms": 400, "total_ms": 460})
+    tracker.record(200, 40, cached_tokens=64,
+                   timing={"queue_ms": 300, "prefill_ms": 30, "decode_ms": 800, "total_ms": 1140})
+    tracker.record_error()
+
+    stats = tracker.get_stats()
+    assert stats["totals"] == {"requests": 2, "errors": 1, "prompt_tokens": 300, "completion_tokens": 60,
+                               "cached_tokens": 64}
+    window = stats["window"]
+    assert window["requests"] == 2
+    assert window["completion_tokens_per_second"] == 6.0
+    assert window["avg_queue_ms"] == 150 and window["avg_decode_ms"] == 600
+    assert window["avg_tokenize_ms"] is None
+
+    clock.now += 11
+    tracker.record(50, 10, timing={"queue_ms": 10, "prefill_ms": 5, "decode_ms": 100, "total_ms": 120})
+    stats = tracker.get_stats()
+    assert stats["totals"]["requests"] == 3
+    assert stats["window"]["requests"] == 1 and stats["window"]["avg_queue_ms"] == 10
+
+    merged = merge_throughput_stats([stats, tracker.get_stats()])
+    assert merged["workers"] == 2
+    assert merged["totals"]["completion_tokens"] == 140
+    assert merged["window"]["requests"] == 2 and merged["window"]["avg_decode_ms"] == 100
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试软删除和后台清理：删除和清空立即生效、同名会话可重新创建、清理器分批物理删除
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+from chat_robot.session_purger import SessionPurger
+
+
+def _count(manager, table):
+    return manager._query(f"SELECT COUNT(*) AS count FROM {table}")[0]["count"]
+
+
+def test_delete_message_reports_missing_rows(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    saved = manager.save_message("s1", "user", "撤销的消息")
+    # 消息不属于该会话或已删除时返回False
+    assert not manager.delete_message("other", saved["id"])
+    assert manager.delete_message("s1", saved["id"])
+    assert not manager.delete_message("s1", saved["id"])
+    assert manager.get_message_count("s1") == 0
+
+def test_soft_delete_then_batched_purge(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    for i in range(7):
+        manager.save_message("gone", "user", f"消息 {i}")
+    manager.save_summary("gone", "摘要", 7)
+    for i in range(5):
+        manager.save_message("kept", "user", f"保留 {i}")
+
+    assert manager.delete_session("gone")
+    # 会话不存在或已删除时返回False
+    assert not manager.delete_session("gone")
+    assert not manager.delete_session("missing")
+    assert manager.clear_session_messages("kept")
+    assert manager.get_history_messages("gone") == []
+    assert manager.get_history_messages("kept") == []
+    assert manager.get_message_count("kept") == 0
+    assert "gone" not in [session["session_id"] for session in manager.get_all_sessions()]
+    # 行仍在，等待后台清理
+    assert _count(manager, "chat_messages") == 12
+
+    # 同名会话可以立即重新创建，看不到旧消息
+    manager.save_message("gone", "user", "新的开始")
+    assert manager.get_history_messages("gone") == [{"role": "user", "content": "新的开始"}]
+
+    purger = SessionPurger(manager, batch_size=3, batch_pause=0)
+    assert purger.get_pending() == {"sessions": 1, "messages": 5}
+    result = purger.run_once()
+    assert result == {"messages": 12, "summaries": 1, "sessions": 1, "skipped": False}
+    assert purger.get_stats()["batches"] >= 5
+    assert purger.get_pending() == {"sessions": 0, "messages": 0}
+    assert _count(manager, "chat_messages") == 1
+    assert _count(manager, "chat_summaries") == 0
+    assert sorted(row["session_id"] for row in manager._query("SELECT session_id FROM chat_sessions")) == \
+        ["gone", "kept"]
+
+    manager.save_message("kept", "assistant", "清空后的新消息")
+    assert manager.get_history_messages("kept") == [{"role": "assistant", "content": "清空后的新消息"}]
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试会话级请求排队（串行化、背压、失效锁回收）
+"""
+
+import sys
+import os
+import time
+import asyncio
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.session_queue_manager import SessionQueueManager, SessionQueueFullError
+
+
+async def _turn(manager, session_id, order, label, duration=0.05):
+    async with manager.turn(session_id):
+        order.append(f"{label}:start")
+        await asyncio.sleep(duration)
+        order.append(f"{label}:end")
+
+
+def test_same_session_is_serialized():
+    """同一会话的轮次按到达顺序依次执行，不会交错"""
+    async def run():
+        manager = SessionQueueManager(max_queue_depth=4)
+        order = []
+        await asyncio.gather(*[_turn(manager, "s1", order, f"t{i}") for i in range(3)])
+        return manager, order
+
+    manager, order = asyncio.run(run())
+    assert order == ["t0:start", "t0:end", "t1:start", "t1:end", "t2:start", "t2:end"]
+    assert manager.get_stats()["active_sessions"] == 0
+    print("✅ 同会话串行测试通过")
+
+
+def test_different_sessions_run_in_parallel():
+    """不同会话之间互不等待"""
+    async def run():
+        manager = SessionQueueManager()
+        started = time.perf_counter()
+        await asyncio.gather(*[_turn(manager, f"s{i}", [], "t", 0.2) for i in range(5)])
+        return time.perf_counter() - started
+
+    assert asyncio.run(run()) < 0.5
+    print("✅ 跨会话并行测试通过")
+
+
+def test_queue_full_rejects_immediately():
+    """排队超过上限时立即拒绝"""
+    async def run():
+        manager = SessionQueueManager(max_queue_depth=2)
+        results = await asyncio.gather(*[_turn(manager, "s1", [], f"t{i}", 0.1) for i in range(4)],
+                                       return_exceptions=True)
+        return manager, results
+
+    manager, results = asyncio.run(run())
+    rejected = [r for r in results if isinstance(r, SessionQueueFullError)]
+    assert len(rejected) == 2
+    assert manager.get_stats()["rejected_full"] == 2
+    print("✅ 排队背压测试通过")
+
+
+def test_stale_lock_is_evicted():
+    """持锁超时的请求不会永久阻塞后续请求"""
+    async def run():
+        manager = SessionQueueManager(max_queue_depth=4, stale_lock_seconds=0.1)
+        order = []
+        await asyncio.gather(_turn(manager, "s1", order, "stuck", 0.5),
+                             _turn(manager, "s1", order, "next", 0.01))
+        return manager, order
+
+    manager, order = asyncio.run(run())
+    assert order.index("next:end") < order.index("stuck:end")
+    assert manager.get_stats()["stale_evictions"] == 1
+    print("✅ 失效锁回收测试通过")
+
+
+if __name__ == "__main__":
+    test_same_session_is_serialized()
+    test_different_sessions_run_in_parallel()
+    test_queue_full_rejects_immediately()
+    test_stale_lock_is_evicted()
+    print("测试完成!")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试会话分片：按哈希路由、跨分片合并会话列表、人设同步、增加分片后按目录路由以及在线迁移
+"""
+
+import sys
+import os
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.session_purger import SessionPurger
+from chat_robot.shard_manager import ShardedDataManager, create_data_manager, shard_hash
+
+
+def _urls(tmp_path, count):
+    # 用多个独立的SQLite文件模拟分片数据库
+    return [f"sqlite:///{tmp_path / f'shard{index}.sqlite3'}" for index in range(count)]
+
+
+def _manager(tmp_path, count):
+    manager = ShardedDataManager(_urls(tmp_path, count), directory_ttl=0)
+    manager.create_tables()
+    return manager
+
+
+def test_sessions_are_routed_by_hash_and_merged(tmp_path):
+    manager = _manager(tmp_path, 2)
+    session_ids = [f"s{i}" for i in range(8)]
+    for session_id in session_ids:
+        manager.save_session(session_id, title=f"会话 {session_id}")
+        saved = manager.save_message(session_id, "user", f"你好 {session_id}")
+        # 最近消息ID与 save_message 返回的ID换算方式一致
+        assert manager.get_recent_message_ids(session_id, limit=2) == [saved["id"]]
+
+    for session_id in session_ids:
+        home = manager.shards[manager.home_shard(session_id)]
+        other = manager.shards[1 - manager.home_shard(session_id)]
+        assert home.get_message_count(session_id) == 1
+        assert other.get_message_count(session_id) == 0
+        assert manager.get_history_messages(session_id) == [{"role": "user", "content": f"你好 {session_id}"}]
+    assert {len(shard.get_all_sessions()) for shard in manager.shards} != {0}
+
+    assert sorted(session["session_id"] for session in manager.get_all_sessions()) == sorted(session_ids)
+    ids = [row["id"] for row in manager.iter_messages_for_search()]
+    assert len(ids) == len(set(ids)) == len(session_ids)
+
+    # 人设保存在全局分片并同步到其他分片
+    manager.save_persona("分片人设", "描述", "系统提示词")
+    assert [p["name"] for p in manager.shards[1].get_all_personas()] == [
+        p["name"] for p in manager.get_all_personas()]
+    assert "分片人设" in [p["name"] for p in manager.shards[1].get_all_personas()]
+
+    assert manager.delete_session("s0")
+    assert not manager.delete_session("s0")
+    assert "s0" not in [session["session_id"] for session in manager.get_all_sessions()]
+
+
+def test_added_shard_keeps_routing_and_rebalance_moves_sessions(tmp_path):
+    manager = _manager(tmp_path, 2)
+    manager.save_user("owner", "会话所有者")
+    user_id = manager.global_shard._query("SELECT id FROM users WHERE username = 'owner'")[0]["id"]
+    session_ids = [f"s{i}" for i in range(12)]
+    for session_id in session_ids:
+        manager.save_session(session_id, user_id=user_id)
+        manager.save_summary(session_id, f"摘要 {session_id}", 2)
+        for turn in range(2):
+            manager.save_message(session_id, "user", f"{session_id} 第{turn}轮")
+        manager.shard_for(session_id)._query(
+            "UPDATE chat_sessions SET message_count = 2, total_tokens = 30, updated_at = '2024-01-02 03:04:05' "
+            "WHERE session_id = :session_id", {"session_id": session_id})
+
+    manager = _manager(tmp_path, 3)
+    misplaced = [session_id for session_id in session_ids
+                 if manager.home_shard(session_id) != shard_hash(session_id) % 2]
+    assert misplaced
+    # 迁移前旧会话仍按目录路由到原分片
+    for session_id in session_ids:
+        assert manager.get_message_count(session_id) == 2
+
+    result = manager.rebalance()
+    assert result["moved"] == len(misplaced) and result["messages"] == 2 * len(misplaced)
+    assert manager.rebalance()["moved"] == 0
+
+    for session_id in session_ids:
+        assert manager.locate(session_id) == manager.home_shard(session_id)
+        assert [m["content"] for m in manager.get_history_messages(session_id)] == [
+            f"{session_id} 第0轮", f"{session_id} 第1轮"]
+        assert manager.get_recent_summary(session_id) == f"摘要 {session_id}"
+        # 所有者、计数和更新时间随会话一起迁移
+        row = manager.shard_for(session_id)._query(
+            "SELECT user_id, message_count, total_tokens, updated_at FROM chat_sessions "
+            "WHERE session_id = :session_id", {"session_id": session_id})[0]
+        assert row == {"user_id": user_id, "message_count": 2, "total_tokens": 30,
+                       "updated_at": "2024-01-02 03:04:05"}
+    assert len(manager.get_all_sessions()) == len(session_ids)
+    assert {row["user_id"] for row in manager.iter_messages_for_search()} == {user_id}
+
+    # 源分片上的副本已软删除，由清理器分批删除
+    for shard in manager.shards[:2]:
+        SessionPurger(shard).run_once()
+    assert sum(len(shard._query("SELECT id FROM chat_sessions")) for shard in manager.shards) == len(session_ids)
+
+
+def test_rebalance_waits_for_directory_cache_once_per_batch(tmp_path, monkeypatch):
+    manager = _manager(tmp_path, 2)
+    session_ids = [f"s{i}" for i in range(12)]
+    for session_id in session_ids:
+        manager.save_message(session_id, "user", f"你好 {session_id}")
+
+    manager = ShardedDataManager(_urls(tmp_path, 3), directory_ttl=30)
+    manager.create_tables()
+    misplaced = [session_id for session_id in session_ids
+                 if manager.home_shard(session_id) != shard_hash(session_id) % 2]
+    sleeps = []
+    monkeypatch.setattr("chat_robot.shard_manager.time.sleep", sleeps.append)
+
+    result = manager.rebalance(batch_size=100)
+    assert result["moved"] == len(misplaced) and result["messages"] == len(misplaced)
+    # 整批切换目录后只等待一次，而不是每个会话等待一次
+    assert sleeps == [30]
+    for session_id in session_ids:
+        assert manager.locate(session_id) == manager.home_shard(session_id)
+        assert manager.get_message_count(session_id) == 1
+
+
+def test_replica_settings_are_forwarded_to_shards(tmp_path):
+    manager = create_data_manager(_urls(tmp_path, 2), directory_ttl=0, replica_urls=[], replica_pin_seconds=1.5)
+    assert [shard.replicas.pin_seconds for shard in manager.shards] == [1.5, 1.5]
+    # 副本只属于一个主库，不能在分片间共用
+    with pytest.raises(ValueError):
+        create_data_manager(_urls(tmp_path, 2), replica_urls=[f"sqlite:///{tmp_path / 'replica.sqlite3'}"])
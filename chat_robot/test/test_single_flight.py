@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试并发摘要请求合并（single-flight）
+"""
+
+import sys
+import os
+import time
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.single_flight import SingleFlight
+
+
+def test_concurrent_calls_coalesce():
+    """同一键的并发调用只执行一次，所有调用方拿到同一结果"""
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def summarize(session_id):
+        calls.append(session_id)
+        time.sleep(0.2)
+        return f"summary of {session_id}"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.do("s1", summarize, "s1")))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["s1"]
+    assert results == ["summary of s1"] * 5
+    stats = flight.get_stats()
+    assert stats["executions"] == 1 and stats["coalesced"] == 4
+    assert stats["in_flight"] == 0
+    print("✅ 并发合并测试通过")
+
+
+def test_different_keys_run_in_parallel():
+    """不同键互不阻塞"""
+    flight = SingleFlight()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=flight.do, args=(f"s{i}", time.sleep, 0.2)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert time.perf_counter() - started < 0.6
+    assert flight.get_stats()["executions"] == 4
+    print("✅ 不同会话并行测试通过")
+
+
+def test_error_propagates_to_waiters():
+    """leader 抛出的异常同样传递给等待者，之后的调用重新执行"""
+    flight = SingleFlight()
+    errors = []
+
+    def failing():
+        time.sleep(0.1)
+        raise RuntimeError("summary failed")
+
+    def worker():
+        try:
+            flight.do("s1", failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == ["summary failed"] * 3
+    assert flight.do("s1", lambda: "ok") == "ok"
+    print("✅ 异常传递测试通过")
+
+
+if __name__ == "__main__":
+    test_concurrent_calls_coalesce()
+    test_different_keys_run_in_parallel()
+    test_error_propagates_to_waiters()
+    print("测试完成!")
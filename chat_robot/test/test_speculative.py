@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试投机解码的方式选择和指标计算；安装了torch/transformers时用随机初始化的小模型在CPU上验证输出一致
+"""
+
+import sys
+import os
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.speculative import resolve_mode, compute_metrics, SpeculativeMetrics, generate_with_metrics
+
+
+def test_resolve_mode():
+    """请求优先，未加载草稿模型时退回prompt lookup，非法值报错"""
+    assert resolve_mode(None, "none", False) == "none"
+    assert resolve_mode("prompt_lookup", "none", False) == "prompt_lookup"
+    assert resolve_mode("assistant", "none", False) == "prompt_lookup"
+    assert resolve_mode(None, "assistant", True) == "assistant"
+    with pytest.raises(ValueError):
+        resolve_mode("medusa", "none", True)
+
+
+def test_compute_and_aggregate_metrics():
+    """接受率 = 被接受的草稿数 / 草稿总数"""
+    metrics = compute_metrics("assistant", new_tokens=40, target_steps=10, draft_tokens=50,
+                              num_draft_tokens=5, elapsed_seconds=2.0)
+    assert metrics["accepted_tokens"] == 30
+    assert metrics["acceptance_rate"] == 0.6
+    assert metrics["tokens_per_step"] == 4.0 and metrics["tokens_per_second"] == 20.0
+
+    estimated = compute_metrics("prompt_lookup", 20, 10, None, 4, 1.0)
+    assert estimated["acceptance_estimated"] and estimated["acceptance_rate"] == 0.25
+
+    aggregate = SpeculativeMetrics()
+    aggregate.record(metrics)
+    aggregate.record(compute_metrics("none", 10, 10, None, 5, 1.0))
+    stats = aggregate.get_stats()
+    assert stats["assistant"]["acceptance_rate"] == 0.6
+    assert stats["none"]["acceptance_rate"] is None
+
+
+def _tiny_model(seed):
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+    torch.manual_seed(seed)
+    config = transformers.LlamaConfig(vocab_size=64, hidden_size=16, intermediate_size=32, num_hidden_layers=2,
+                                      num_attention_heads=2, num_key_value_heads=2, max_position_embeddings=128)
+    model = transformers.LlamaForCausalLM(config).eval()
+    model.generation_config.pad_token_id = 0
+    model.generation_config.eos_token_id = None
+    return model
+
+
+def test_greedy_output_identical_across_modes_on_cpu():
+    """贪心解码下三种方式输出完全一致，且投机方式产出接受率"""
+    torch = pytest.importorskip("torch")
+    target = _tiny_model(0)
+    draft = _tiny_model(1)
+    input_ids = torch.tensor([[1, 2, 3, 4, 1, 2, 3, 4, 1, 2]])
+    inputs = {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+    kwargs = {"max_new_tokens": 12, "do_sample": False, "return_dict_in_generate": True}
+
+    baseline, base_metrics = generate_with_metrics(target, inputs, kwargs, mode="none")
+    assert base_metrics["new_tokens"] == 12
+    for mode in ("assistant", "prompt_lookup"):
+        output, metrics = generate_with_metrics(target, inputs, kwargs, mode=mode, num_draft_tokens=3,
+                                                assistant_model=draft)
+        assert torch.equal(output.sequences, baseline.sequences)
+        assert 0.0 <= metrics["acceptance_rate"] <= 1.0
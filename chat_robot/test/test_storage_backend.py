@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试SQLite存储后端：连接参数、建表、会话消息读写、用量汇总upsert和命名锁
+"""
+
+import sys
+import os
+
+import pytest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.data_manager import DataManager
+from chat_robot import storage_backend
+from chat_robot.storage_backend import SQLiteBackend, StorageBackend, create_backend
+
+
+def test_sqlite_backend_pragmas(tmp_path):
+    backend = create_backend(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    assert isinstance(backend, SQLiteBackend)
+    assert backend.query("PRAGMA journal_mode")[0]["journal_mode"] == "wal"
+    assert backend.query("PRAGMA synchronous")[0]["synchronous"] == 1
+    assert backend.query("PRAGMA foreign_keys")[0]["foreign_keys"] == 1
+    assert "ON CONFLICT(user_id) DO UPDATE SET" in backend.upsert_clause(("user_id",), {"daily_tokens": "set"})
+
+    with backend.advisory_lock("summary:s1", timeout=1) as acquired:
+        assert acquired
+
+
+def test_advisory_lock_without_fcntl(tmp_path, monkeypatch):
+    # 基类的方言方法都是抽象方法，不能直接实例化
+    with pytest.raises(TypeError):
+        StorageBackend("sqlite://", None)
+
+    backend = create_backend(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    monkeypatch.setattr(storage_backend, "fcntl", None)
+    with backend.advisory_lock("summary:s1", timeout=1) as acquired:
+        assert acquired
+    assert not list(tmp_path.glob("*.lock"))
+
+
+def test_data_manager_on_sqlite(tmp_path):
+    manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    manager.create_tables()
+    # 重复建表是幂等的
+    manager.create_tables()
+
+    assert manager.backend.table_exists("chat_messages")
+    indexes = {row["name"] for row in manager._query("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_messages_session_created", "idx_sessions_user_updated", "idx_usage_user_date"} <= indexes
+    assert len(manager.get_all_personas()) == 4
+
+    manager.save_session("s1", title="测试")
+    manager.save_message("s1", "user", "你好, 'quoted' (text)")
+    manager.save_message("s1", "assistant", "回复", tokens_used=12, cost=0.01, model_name="glm-4.6")
+    manager.save_message("s1", "user", "第二个问题")
+
+    assert manager.get_message_count("s1") == 3
+    assert manager.get_recent_messages("s1", limit=2) == [
+        {"role": "assistant", "content": "回复"}, {"role": "user", "content": "第二个问题"}]
+    assert manager.get_history_messages("s1")[0]["content"] == "你好, 'quoted' (text)"
+
+    manager.save_summary("s1", "摘要内容", 3)
+    assert manager.get_recent_summary("s1") == "摘要内容"
+
+    manager.record_usage("2026-01-05", 0, "s1", "zhipu", "glm-4.6", 100, 20, 0.5)
+    manager.record_usage("2026-01-05", 0, "s1", "zhipu", "glm-4.6", 50, 10, 0.25)
+    rows = manager.get_usage_rollup("session", "2026-01-01", "2026-01-31")
+    assert rows == [{"session_id": "s1", "requests": 2, "prompt_tokens": 150, "completion_tokens": 30,
+                     "total_tokens": 180, "cost": 0.75}]
+
+    assert manager.save_user_quota(1, daily_tokens=1000)
+    assert manager.save_user_quota(1, daily_tokens=2000)
+    assert manager.get_user_quota(1)["daily_tokens"] == 2000
+
+    assert manager.clear_session_messages("s1")
+    assert manager.get_message_count("s1") == 0
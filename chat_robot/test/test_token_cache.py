@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试聊天模板分词缓存（使用按字符分词的简易ChatML分词器）
+"""
+
+import sys
+import os
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.token_cache import ChatTemplateTokenCache
+
+
+class _CharTokenizer:
+    """特殊token整体编码，其余按字符编码"""
+
+    all_special_tokens = ["<|im_start|>", "<|im_end|>"]
+
+    def __init__(self):
+        self.calls = 0
+
+    def apply_chat_template(self, messages, tokenize=False, add_generation_prompt=True):
+        text = "".join(f"<|im_start|>{m['role']}\n{m['content']}<|im_end|>\n" for m in messages)
+        return text + ("<|im_start|>assistant\n" if add_generation_prompt else "")
+
+    def __call__(self, text, add_special_tokens=False):
+        self.calls += 1
+        ids = []
+        index = 0
+        while index < len(text):
+            for number, token in enumerate(self.all_special_tokens):
+                if text.startswith(token, index):
+                    ids.append(-1 - number)
+                    index += len(token)
+                    break
+            else:
+                ids.append(ord(text[index]))
+                index += 1
+        return {"input_ids": ids}
+
+
+def test_segments_match_full_tokenization_and_hit_cache():
+    """分段拼接结果与整体分词一致，下一轮只对新消息分词"""
+    tokenizer = _CharTokenizer()
+    cache = ChatTemplateTokenCache(tokenizer, verify_requests=0)
+    turn_1 = [{"role": "system", "content": "你是一个助手" * 20}, {"role": "user", "content": "你好"}]
+    ids, info = cache.encode(turn_1)
+    assert ids == tokenizer(tokenizer.apply_chat_template(turn_1))["input_ids"]
+    assert info["segments"] == 3 and info["segment_hits"] == 0
+
+    turn_2 = turn_1 + [{"role": "assistant", "content": "你好！"}, {"role": "user", "content": "再见"}]
+    tokenizer.calls = 0
+    ids, info = cache.encode(turn_2)
+    assert ids == tokenizer(tokenizer.apply_chat_template(turn_2))["input_ids"]
+    assert info["segment_hits"] == 3 and tokenizer.calls == 3  # 2条新消息 + 计算期望值的1次调用
+    assert info["saved_ms"] >= 0
+
+
+def test_disabled_when_marker_not_special():
+    """切分标记不是特殊token时退回整体分词"""
+    tokenizer = _CharTokenizer()
+    tokenizer.all_special_tokens = ["<|im_end|>"]
+    cache = ChatTemplateTokenCache(tokenizer)
+    ids, info = cache.encode([{"role": "user", "content": "hi"}])
+    assert not cache.enabled and info["segments"] == 1
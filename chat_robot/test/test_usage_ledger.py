@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试用量账本：价格计算、按用户日/月计数、从数据库加载已有用量和跨日清理
+"""
+
+import sys
+import os
+from datetime import datetime
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.usage_ledger import UsageLedger, compute_cost
+
+
+class _FakeDataManager:
+    """记录写入的用量，并返回预设的历史用量"""
+
+    def __init__(self, existing):
+        self.existing = existing
+        self.recorded = []
+        self.loads = 0
+
+    def get_user_usage_totals(self, user_id, month_start, today):
+        self.loads += 1
+        return self.existing.get(user_id, {})
+
+    def record_usage(self, *args):
+        self.recorded.append(args)
+
+
+PRICING = {"zhipu": {"glm-4.6": {"input": 2.0, "output": 8.0}, "*": {"input": 1.0, "output": 1.0}}}
+
+
+def test_compute_cost_with_fallback():
+    """按模型价格计算，未配置的模型使用 "*" 价格，未配置的提供商免费"""
+    assert compute_cost(PRICING, "zhipu", "glm-4.6", 1_000_000, 500_000) == 6.0
+    assert compute_cost(PRICING, "zhipu", "glm-4-flash", 1000, 1000) == 0.002
+    assert compute_cost(PRICING, "local", "qwen", 1000, 1000) == 0.0
+
+
+def test_ledger_counters_load_and_rollover():
+    """首次访问加载数据库中的已有用量，之后只在内存累加；跨日后当日计数归零、当月计数保留"""
+    now = [datetime(2026, 10, 19, 23, 59).timestamp()]
+    data_manager = _FakeDataManager({7: {
+        "day": {"requests": 2, "prompt_tokens": 100, "completion_tokens": 50, "cost": 0.1},
+        "month": {"requests": 10, "prompt_tokens": 1000, "completion_tokens": 500, "cost": 1.0},
+    }})
+    ledger = UsageLedger(data_manager, PRICING, clock=lambda: now[0])
+
+    usage = ledger.record("s1", 7, "zhipu", "glm-4.6", 1000, 250)
+    assert usage == {"prompt_tokens": 1000, "completion_tokens": 250, "total_tokens": 1250, "cost": 0.004}
+    assert data_manager.recorded[0] == ("2026-10-19", 7, "s1", "zhipu", "glm-4.6", 1000, 250, 0.004)
+
+    day = ledger.get_user_usage(7, "day")
+    assert day["requests"] == 3 and day["total_tokens"] == 1400
+    assert ledger.get_user_usage(7, "month")["total_tokens"] == 2750
+    assert ledger.get_session_usage("s1")["total_tokens"] == 1250
+    assert data_manager.loads == 1
+
+    now[0] += 120
+    ledger.record("s1", 7, "zhipu", "glm-4.6", 10, 10)
+    assert ledger.get_user_usage(7, "day")["total_tokens"] == 20
+    assert ledger.get_user_usage(7, "month")["total_tokens"] == 2770
+    assert data_manager.loads == 1
+
+    # 未关联用户的调用记在匿名用户下
+    ledger.record("system_internal", None, "local", "qwen", 5, 5)
+    assert ledger.get_user_usage(None)["cost"] == 0.0 and ledger.get_user_usage(0)["requests"] == 1
+
+
+def test_ledger_refresh_sees_other_workers_usage(tmp_path):
+    """多个进程共用数据库时，超过 refresh_seconds 后重新加载，计数包含其他进程写入的用量"""
+    from chat_robot.data_manager import DataManager
+
+    data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    data_manager.create_tables()
+    now = [datetime(2026, 10, 19, 12, 0).timestamp()]
+    worker_a = UsageLedger(data_manager, PRICING, clock=lambda: now[0], refresh_seconds=10)
+    worker_b = UsageLedger(data_manager, PRICING, clock=lambda: now[0], refresh_seconds=10)
+
+    assert worker_b.get_user_usage(7)["total_tokens"] == 0
+    worker_a.record("s1", 7, "zhipu", "glm-4.6", 100, 50)
+    worker_b.record("s2", 7, "zhipu", "glm-4.6", 10, 10)
+    assert worker_b.get_user_usage(7)["total_tokens"] == 20
+
+    now[0] += 11
+    assert worker_b.get_user_usage(7)["total_tokens"] == 170
+    assert worker_b.get_user_usage(7, "month")["requests"] == 2
+
+
+def test_summary_call_usage_is_recorded(tmp_path):
+    """生成历史摘要的模型调用和对话调用一样记入会话和用户的用量"""
+    from types import SimpleNamespace
+    from chat_robot.chat_api import ChatAPI
+    from chat_robot.data_manager import DataManager
+    from chat_robot.prompt_manager import PromptManager
+    from chat_robot.search_manager import SearchManager
+    from chat_robot.single_flight import SingleFlight
+
+    calls = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"回复{len(calls)}"))],
+                               usage=SimpleNamespace(prompt_tokens=100, completion_tokens=20))
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    chat_api = ChatAPI.__new__(ChatAPI)
+    chat_api.data_manager = DataManager(f"sqlite:///{tmp_path / 'chat.sqlite3'}")
+    chat_api.data_manager.create_tables()
+    chat_api.ai_config = {"local_model_enabled": True, "local_model_name": "fake", "model_name": "fake",
+                          "max_tokens": 64, "temperature": 0.7}
+    chat_api.context_config = {"enable_compression": True, "summary_threshold": 0, "window_size": 1}
+    chat_api.client = client
+    chat_api.prompt_manager = PromptManager(client)
+    chat_api.response_cache = None
+    chat_api.summary_flight = SingleFlight()
+    chat_api.search_manager = SearchManager(chat_api.data_manager)
+    chat_api.long_term_memory = None
+    chat_api.usage_ledger = UsageLedger()
+    chat_api.quota_manager = None
+
+    chat_api.data_manager.save_message("s1", "user", "之前的问题")
+    chat_api.data_manager.save_message("s1", "assistant", "之前的回答")
+    chat_api.chat_with_history("s1", "新的问题", user_id=7)
+
+    assert len(calls) == 2 and calls[0]["temperature"] == 0.3
+    usage = chat_api.usage_ledger.get_user_usage(7)
+    assert usage["requests"] == 2 and usage["total_tokens"] == 240
+    assert chat_api.usage_ledger.get_session_usage("s1")["total_tokens"] == 240
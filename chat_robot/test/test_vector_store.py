@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+测试内存映射向量存储：分段追加、删除标记、压缩和多实例共享
+"""
+
+import sys
+import os
+import tempfile
+
+import numpy as np
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from chat_robot.vector_store import VectorStore
+
+
+def _unit_vectors(count, dim, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_batched_search_across_segments():
+    """写入跨越多个分段，批量查询与暴力计算结果一致"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = VectorStore(directory, dim=16, segment_rows=8)
+        vectors = _unit_vectors(30, 16)
+        for start in range(0, 30, 10):
+            store.add("s1", vectors[start:start + 10], [{"i": i} for i in range(start, start + 10)])
+        assert store.get_stats()["segments"] == 4
+
+        results = store.search(vectors[[3, 17, 29]], top_k=3)
+        expected = np.argsort(-(vectors[[3, 17, 29]] @ vectors.T), axis=1)[:, :3]
+        for result, indices in zip(results, expected):
+            assert [item["i"] for item in result] == list(indices)
+            assert result[0]["similarity"] > 0.99
+
+
+def test_namespace_filter_and_exclude_last():
+    """按命名空间过滤，并能排除最近写入的条数"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = VectorStore(directory, dim=8, segment_rows=4)
+        vectors = _unit_vectors(6, 8)
+        store.add("a", vectors[:3], [{"i": i} for i in range(3)])
+        store.add("b", vectors[3:], [{"i": i} for i in range(3, 6)])
+
+        assert {item["i"] for item in store.search(vectors[0], top_k=10, namespace="a")[0]} == {0, 1, 2}
+        assert {item["i"] for item in store.search(vectors[0], top_k=10, namespace="a", exclude_last=1)[0]} == {0, 1}
+
+
+def test_tombstones_visible_to_other_instance_and_compaction():
+    """删除标记对其他实例（worker）立即可见，压缩后空间回收且结果不变"""
+    with tempfile.TemporaryDirectory() as directory:
+        writer = VectorStore(directory, dim=8, segment_rows=4)
+        reader = VectorStore(directory, dim=8, read_only=True)
+        vectors = _unit_vectors(10, 8)
+        writer.add("a", vectors[:6], [{"i": i} for i in range(6)])
+        writer.add("b", vectors[6:], [{"i": i} for i in range(6, 10)])
+
+        assert len(reader.search(vectors[0], top_k=20)[0]) == 10
+        assert writer.delete_namespace("a") == 6
+        remaining = {item["i"] for item in reader.search(vectors[0], top_k=20)[0]}
+        assert remaining == {6, 7, 8, 9}
+
+        result = writer.compact(min_dead_ratio=0.5)
+        assert result["compacted"] and result["rows"] == 4
+        assert writer.get_stats()["segments"] == 1
+        assert {item["i"] for item in reader.search(vectors[0], top_k=20)[0]} == remaining
+        assert not any(name.startswith("seg_000001") for name in os.listdir(directory))
+
+
+def test_reopen_ignores_unrecorded_tail():
+    """清单之外的残留数据（写入中断）在重新打开后被忽略并被覆盖"""
+    with tempfile.TemporaryDirectory() as directory:
+        store = VectorStore(directory, dim=4, segment_rows=16)
+        vectors = _unit_vectors(3, 4)
+        store.add("a", vectors[:2], [{"i": 0}, {"i": 1}])
+        with open(os.path.join(directory, "seg_000001.f16"), "ab") as f:
+            f.write(b"\x00" * 8)
+
+        reopened = VectorStore(directory, dim=4, segment_rows=16)
+        reopened.add("a", vectors[2:], [{"i": 2}])
+        assert os.path.getsize(os.path.join(directory, "seg_000001.f16")) == 3 * 4 * 2
+        assert reopened.search(vectors[2], top_k=1)[0][0]["i"] == 2
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+聊天模板分词缓存模块
+按消息缓存token id，请求时只对新消息分词，再拼接得到完整的模板化输入
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+
+
+class ChatTemplateTokenCache:
+    """
+    按消息分段的token id缓存
+
+    聊天模板渲染后的文本按消息起始标记（ChatML为 <|im_start|>）切分为分段，
+    标记本身是特殊token，分词不会跨越分段边界，因此逐段分词后拼接与整体分词结果一致。
+    每个分段以内容哈希为键缓存token id，人设提示词和历史消息在后续轮次中直接命中。
+
+    前 verify_requests 次请求会与整体分词结果比对，不一致时自动关闭分段缓存。
+    """
+
+    def __init__(self, tokenizer, max_entries: int = 4096, segment_marker: str = "<|im_start|>",
+                 verify_requests: int = 8):
+        """初始化分词缓存"""
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.segment_marker = segment_marker
+        self.verify_requests = verify_requests
+
+        special_tokens = set(getattr(tokenizer, "all_special_tokens", []) or [])
+        special_tokens.update(getattr(tokenizer, "additional_special_tokens", []) or [])
+        self.enabled = segment_marker in special_tokens
+
+        # 内容哈希 -> (token ids, 首次分词耗时ms)
+        self._entries: "OrderedDict[str, Tuple[List[int], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._verified = 0
+        self._stats = {"requests": 0, "segments": 0, "segment_hits": 0, "tokenize_ms": 0.0,
+                       "saved_ms": 0.0, "verify_failures": 0}
+
+    def _split(self, text: str) -> List[str]:
+        """按消息起始标记切分模板文本，标记保留在每个分段开头"""
+        parts = text.split(self.segment_marker)
+        segments = [parts[0]] if parts[0] else []
+        segments.extend(self.segment_marker + part for part in parts[1:])
+        return segments
+
+    def _encode_full(self, text: str) -> List[int]:
+        """整体分词（与服务原有行为一致）"""
+        return list(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    def encode(self, messages: List[Dict[str, str]]) -> Tuple[List[int], Dict[str, Any]]:
+        """
+        将消息列表渲染为聊天模板并分词
+
+        Args:
+            messages (List[Dict]): OpenAI格式的消息列表
+
+        Returns:
+            Tuple: (token ids, 本次分词统计：tokenize_ms、saved_ms、segments、segment_hits)
+        """
+        started = time.perf_counter()
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+
+        if not self.enabled:
+            ids = self._encode_full(text)
+            elapsed = (time.perf_counter() - started) * 1000
+            self._record(1, 0, elapsed, 0.0)
+            return ids, {"tokenize_ms": round(elapsed, 3), "saved_ms": 0.0, "segments": 1, "segment_hits": 0}
+
+        ids: List[int] = []
+        hits = 0
+        saved_ms = 0.0
+        segments = self._split(text)
+        for segment in segments:
+            key = hashlib.blake2b(segment.encode("utf-8"), digest_size=16).hexdigest()
+            with self._lock:
+                cached = self._entries.get(key)
+                if cached is not None:
+                    self._entries.move_to_end(key)
+            if cached is not None:
+                hits += 1
+                saved_ms += cached[1]
+                ids.extend(cached[0])
+                continue
+
+            segment_started = time.perf_counter()
+            segment_ids = self._encode_full(segment)
+            segment_ms = (time.perf_counter() - segment_started) * 1000
+            ids.extend(segment_ids)
+            with self._lock:
+                self._entries[key] = (segment_ids, segment_ms)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        if self._verified < self.verify_requests:
+            self._verified += 1
+            full_ids = self._encode_full(text)
+            if full_ids != ids:
+                # 分段分词与整体分词不一致（模板或分词器不满足前提），关闭分段缓存
+                self.enabled = False
+                with self._lock:
+                    self._entries.clear()
+                    self._stats["verify_failures"] += 1
+                ids = full_ids
+
+        elapsed = (time.perf_counter() - started) * 1000
+        self._record(len(segments), hits, elapsed, saved_ms)
+        return ids, {"tokenize_ms": round(elapsed, 3), "saved_ms": round(saved_ms, 3),
+                     "segments": len(segments), "segment_hits": hits}
+
+    def _record(self, segments: int, hits: int, elapsed_ms: float, saved_ms: float):
+        """累计统计"""
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["segments"] += segments
+            self._stats["segment_hits"] += hits
+            self._stats["tokenize_ms"] += elapsed_ms
+            self._stats["saved_ms"] += saved_ms
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取分词缓存统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tokenize_ms"] = round(stats["tokenize_ms"], 2)
+            stats["saved_ms"] = round(stats["saved_ms"], 2)
+            stats["hit_ratio"] = round(stats["segment_hits"] / stats["segments"], 4) if stats["segments"] else 0.0
+            stats["entries"] = len(self._entries)
+            stats["enabled"] = self.enabled
+            return stats
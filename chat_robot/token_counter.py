@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Token估算模块
+在拿不到模型分词器时粗略估算文本的token数量，用于限流、配额和提示词统计
+"""
+
+import re
+from typing import List, Dict
+
+# 中日韩字符通常每个字对应约一个token
+_CJK_PATTERN = re.compile(r"[\u4e00-\u9fff\u3040-\u30ff\uac00-\ud7af]")
+
+# 每条消息的角色、分隔符等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """估算单段文本的token数：中日韩字符按1个计，其余字符按每4个1个计"""
+    if not text:
+        return 0
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    other_count = len(text) - cjk_count
+    return cjk_count + (other_count + 3) // 4
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """估算消息列表的token数"""
+    return sum(estimate_tokens(msg.get("content") or "") + MESSAGE_OVERHEAD_TOKENS for msg in messages)
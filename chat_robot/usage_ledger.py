@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+用量账本模块
+按模型返回的 usage 记录每次调用的token数和费用，并维护按会话、用户、日期汇总的计数
+"""
+
+import time
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 未提供 user_id 的聊天请求记在该用户ID下（所有匿名请求共用一个计数）
+ANONYMOUS_USER_ID = 0
+
+# 系统内部调用（如人设优化）记在该用户ID下，与匿名请求分开统计，不受配额限制
+SYSTEM_USER_ID = -1
+
+
+def compute_cost(pricing: Dict[str, Dict[str, Dict[str, float]]], provider: str, model: str,
+                 prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    按价格表计算一次调用的费用
+
+    价格表格式为 {提供商: {模型名: {"input": 每百万输入token价格, "output": 每百万输出token价格}}}，
+    模型名未配置时使用该提供商的 "*" 条目，都未配置时费用为0。
+    """
+    models = pricing.get(provider) or {}
+    price = models.get(model) or models.get("*")
+    if not price:
+        return 0.0
+    cost = (prompt_tokens * price.get("input", 0) + completion_tokens * price.get("output", 0)) / 1_000_000
+    return round(cost, 6)
+
+
+def _new_counter() -> Dict[str, Any]:
+    return {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost": 0.0}
+
+
+def _add(counter: Dict[str, Any], prompt_tokens: int, completion_tokens: int, cost: float, requests: int = 1):
+    counter["requests"] += requests
+    counter["prompt_tokens"] += prompt_tokens
+    counter["completion_tokens"] += completion_tokens
+    counter["total_tokens"] += prompt_tokens + completion_tokens
+    counter["cost"] = round(counter["cost"] + cost, 6)
+
+
+class UsageLedger:
+    """
+    token与费用账本
+
+    每次调用写入数据库的按日汇总表（usage_daily），同时在内存中维护当日/当月的用户计数和会话计数，
+    供配额检查等热路径以O(1)读取。用户计数首次访问时从数据库加载当月已有用量，之后在内存中累加；
+    日期或月份变化时旧的计数自动丢弃。
+
+    内存计数只包含本进程的调用。多进程部署时设置 refresh_seconds，用户计数超过该秒数后重新从数据库
+    （各进程共同写入）加载，配额按所有进程的用量判断，最多少计其他进程在最近 refresh_seconds 内的用量；
+    为0时不重新加载，配额实际上按进程分别计算。
+    """
+
+    def __init__(self, data_manager=None, pricing: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None,
+                 currency: str = "CNY", clock: Callable[[], float] = time.time, refresh_seconds: float = 0):
+        """初始化用量账本"""
+        self.data_manager = data_manager
+        self.pricing = pricing or {}
+        self.currency = currency
+        self._clock = clock
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._day = ""
+        self._month = ""
+        # (user_id, 日期或月份) -> 计数
+        self._user_counters: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        # user_id -> 从数据库加载计数的时间
+        self._loaded_users: Dict[int, float] = {}
+        self._session_counters: Dict[str, Dict[str, Any]] = {}
+        self._stats = {"records": 0, "persist_errors": 0}
+
+    def _periods(self) -> Tuple[str, str]:
+        """当前日期和月份，跨日/跨月时清理过期计数（调用方需持有锁）"""
+        now = datetime.fromtimestamp(self._clock())
+        day, month = now.strftime("%Y-%m-%d"), now.strftime("%Y-%m")
+        if day != self._day:
+            if month != self._month:
+                self._user_counters.clear()
+                self._loaded_users.clear()
+                self._session_counters.clear()
+            else:
+                self._user_counters = {key: value for key, value in self._user_counters.items()
+                                       if key[1] in (day, month)}
+            self._day, self._month = day, month
+        return day, month
+
+    def _is_loaded(self, user_id: int) -> bool:
+        """用户计数已加载且未超过 refresh_seconds（调用方需持有锁）"""
+        loaded_at = self._loaded_users.get(user_id)
+        if loaded_at is None:
+            return False
+        return self.refresh_seconds <= 0 or self._clock() - loaded_at < self.refresh_seconds
+
+    def _ensure_user_loaded(self, user_id: int):
+        """首次访问或超过 refresh_seconds 时从数据库加载当日和当月已有用量"""
+        with self._lock:
+            if self._is_loaded(user_id):
+                return
+            day, month = self._periods()
+        totals = {}
+        if self.data_manager is not None:
+            try:
+                totals = self.data_manager.get_user_usage_totals(user_id, f"{month}-01", day)
+            except Exception as e:
+                print(f"加载用户用量时出错: {e}")
+        with self._lock:
+            if self._is_loaded(user_id) or self._month != month:
+                return
+            reload = user_id in self._loaded_users
+            for period, key in (("day", day), ("month", month)):
+                loaded = totals.get(period) or {}
+                if reload:
+                    # 数据库中的用量已包含本进程写入的记录，直接替换内存计数
+                    counter = self._user_counters[(user_id, key)] = _new_counter()
+                else:
+                    counter = self._user_counters.setdefault((user_id, key), _new_counter())
+                _add(counter, int(loaded.get("prompt_tokens") or 0), int(loaded.get("completion_tokens") or 0),
+                     float(loaded.get("cost") or 0), int(loaded.get("requests") or 0))
+            self._loaded_users[user_id] = self._clock()
+
+    def record(self, session_id: str, user_id: Optional[int], provider: str, model: str,
+               prompt_tokens: int, completion_tokens: int) -> Dict[str, Any]:
+        """
+        记录一次模型调用的用量
+
+        Returns:
+            Dict: prompt_tokens、completion_tokens、total_tokens、cost
+        """
+        user_id = user_id if user_id is not None else ANONYMOUS_USER_ID
+        prompt_tokens, completion_tokens = int(prompt_tokens or 0), int(completion_tokens or 0)
+        cost = compute_cost(self.pricing, provider, model, prompt_tokens, completion_tokens)
+        self._ensure_user_loaded(user_id)
+
+        with self._lock:
+            day, month = self._periods()
+            for key in ((user_id, day), (user_id, month)):
+                _add(self._user_counters.setdefault(key, _new_counter()), prompt_tokens, completion_tokens, cost)
+            _add(self._session_counters.setdefault(session_id, _new_counter()), prompt_tokens, completion_tokens, cost)
+            self._stats["records"] += 1
+
+        if self.data_manager is not None:
+            try:
+                self.data_manager.record_usage(day, user_id, session_id, provider, model,
+                                               prompt_tokens, completion_tokens, cost)
+            except Exception as e:
+                self._stats["persist_errors"] += 1
+                print(f"写入用量记录时出错: {e}")
+
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens, "cost": cost}
+
+    def get_user_usage(self, user_id: Optional[int], period: str = "day") -> Dict[str, Any]:
+        """
+        获取用户当日（period="day"）或当月（period="month"）的用量计数
+
+        加载后为一次字典查找，不访问数据库。
+        """
+        user_id = user_id if user_id is not None else ANONYMOUS_USER_ID
+        self._ensure_user_loaded(user_id)
+        with self._lock:
+            day, month = self._periods()
+            counter = self._user_counters.get((user_id, day if period == "day" else month))
+            return dict(counter) if counter else _new_counter()
+
+    def get_session_usage(self, session_id: str) -> Dict[str, Any]:
+        """获取会话在本进程内当月累计的用量"""
+        with self._lock:
+            counter = self._session_counters.get(session_id)
+            return dict(counter) if counter else _new_counter()
+
+    def get_usage(self, group_by: str = "day", user_id: Optional[int] = None, session_id: Optional[str] = None,
+                  days: int = 30) -> Dict[str, Any]:
+        """
+        查询汇总用量
+
+        Args:
+            group_by (str): day / session / user / model
+            user_id (int): 只统计该用户
+            session_id (str): 只统计该会话
+            days (int): 统计最近多少天（含今天）
+
+        Returns:
+            Dict: {group_by, currency, start_date, end_date, rows, totals}
+        """
+        if group_by not in ("day", "session", "user", "model"):
+            raise ValueError(f"不支持的分组方式: {group_by}")
+        end = datetime.fromtimestamp(self._clock())
+        start = datetime.fromtimestamp(self._clock() - max(days - 1, 0) * 86400)
+        start_date, end_date = start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
+
+        rows: List[Dict[str, Any]] = []
+        if self.data_manager is not None:
+            rows = self.data_manager.get_usage_rollup(group_by, start_date, end_date, user_id, session_id)
+
+        totals = _new_counter()
+        for row in rows:
+            _add(totals, int(row.get("prompt_tokens") or 0), int(row.get("completion_tokens") or 0),
+                 float(row.get("cost") or 0), int(row.get("requests") or 0))
+        return {"group_by": group_by, "currency": self.currency, "start_date": start_date,
+                "end_date": end_date, "rows": rows, "totals": totals}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取账本运行统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["tracked_users"] = len(self._loaded_users)
+            stats["tracked_sessions"] = len(self._session_counters)
+            return stats
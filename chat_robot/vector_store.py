@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+内存映射向量存储模块
+向量以float16追加写入分段文件，检索时通过 np.memmap 映射，多个worker进程共享同一份页缓存而无需各自载入内存
+"""
+
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy为可选依赖，缺失时向量功能自动关闭
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，只支持单进程写入
+    fcntl = None
+
+try:
+    from .log_manager import log_manager
+except ImportError:
+    from log_manager import log_manager
+
+
+class _Segment:
+    """
+    单个分段
+
+    {name}.f16   只追加的float16矩阵，每行一个向量
+    {name}.jsonl 每行对应矩阵中一行的命名空间和附加数据
+    {name}.tomb  删除标记位图（np.packbits）
+    """
+
+    def __init__(self, root_dir: Path, name: str, dim: int):
+        self.name = name
+        self.dim = dim
+        self.vectors_path = root_dir / f"{name}.f16"
+        self.meta_path = root_dir / f"{name}.jsonl"
+        self.tomb_path = root_dir / f"{name}.tomb"
+        self.rows = 0
+        self.meta_bytes = 0
+        self.deleted = np.zeros(0, dtype=bool)
+        self.namespaces: List[str] = []
+        self.payloads: List[Dict[str, Any]] = []
+        self._matrix = None
+        self._mapped_rows = 0
+
+    @property
+    def deleted_count(self) -> int:
+        return int(self.deleted.sum())
+
+    def load(self, rows: int, meta_bytes: int, deleted_count: int):
+        """按清单记录的行数增量加载元数据，忽略清单之外（写入中断）的内容"""
+        if meta_bytes > self.meta_bytes:
+            with open(self.meta_path, "rb") as f:
+                f.seek(self.meta_bytes)
+                chunk = f.read(meta_bytes - self.meta_bytes)
+            for line in chunk.decode("utf-8").splitlines():
+                if line:
+                    item = json.loads(line)
+                    self.namespaces.append(item.pop("ns"))
+                    self.payloads.append(item)
+            self.meta_bytes = meta_bytes
+        if rows > self.rows:
+            self.deleted = np.concatenate([self.deleted, np.zeros(rows - self.rows, dtype=bool)])
+            self.rows = rows
+        if deleted_count != self.deleted_count:
+            self.load_tombstones()
+
+    def load_tombstones(self):
+        """从位图文件读取删除标记"""
+        deleted = np.zeros(self.rows, dtype=bool)
+        if self.tomb_path.exists():
+            bits = np.unpackbits(np.fromfile(self.tomb_path, dtype=np.uint8)).astype(bool)
+            count = min(len(bits), self.rows)
+            deleted[:count] = bits[:count]
+        self.deleted = deleted
+
+    def write_tombstones(self):
+        """写入删除标记位图（先写临时文件再替换，读取方不会看到半个文件）"""
+        tmp_path = self.tomb_path.with_suffix(".tomb.tmp")
+        np.packbits(self.deleted).tofile(tmp_path)
+        os.replace(tmp_path, self.tomb_path)
+
+    def append(self, vectors, namespaces: List[str], payloads: List[Dict[str, Any]]):
+        """从清单记录的末尾写入，覆盖可能存在的中断残留"""
+        with open(self.vectors_path, "r+b" if self.vectors_path.exists() else "wb") as f:
+            f.seek(self.rows * self.dim * 2)
+            f.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+            f.truncate()
+        lines = "".join(json.dumps({"ns": namespace, **payload}, ensure_ascii=False) + "\n"
+                        for namespace, payload in zip(namespaces, payloads))
+        encoded = lines.encode("utf-8")
+        with open(self.meta_path, "r+b" if self.meta_path.exists() else "wb") as f:
+            f.seek(self.meta_bytes)
+            f.write(encoded)
+            f.truncate()
+        self.namespaces.extend(namespaces)
+        self.payloads.extend(payloads)
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(payloads), dtype=bool)])
+        self.rows += len(payloads)
+        self.meta_bytes += len(encoded)
+
+    def matrix(self):
+        """返回当前行数的只读内存映射"""
+        if self.rows == 0:
+            return None
+        if self._matrix is None or self._mapped_rows != self.rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float16, mode="r", shape=(self.rows, self.dim))
+            self._mapped_rows = self.rows
+        return self._matrix
+
+    def unlink(self):
+        """删除分段文件（已映射的读取方在POSIX下仍可继续使用旧文件）"""
+        for path in (self.vectors_path, self.meta_path, self.tomb_path):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class VectorStore:
+    """
+    分段追加的内存映射向量存储
+
+    1. 写入只追加到最后一个分段，分段达到 segment_rows 行后封存并新建分段
+    2. 删除命名空间只在位图中打标记，检索时跳过，由压缩任务重写分段后真正回收空间
+    3. manifest.json 记录各分段的有效行数，写入方更新后原子替换；读取方发现清单变化时增量加载
+    4. 多进程写入通过文件锁串行化，检索不加文件锁
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, root_dir: Optional[str] = None, dim: int = 256, segment_rows: int = 4096,
+                 read_only: bool = False):
+        """初始化向量存储"""
+        if np is None:
+            raise ImportError("VectorStore 需要安装 numpy")
+        if root_dir:
+            self.root_dir = Path(root_dir)
+        else:
+            # 与日志目录同级：chat_robot/vector_store
+            self.root_dir = Path(__file__).parent / "vector_store"
+        self.dim = dim
+        self.segment_rows = segment_rows
+        self.read_only = read_only
+        if not read_only:
+            self.root_dir.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.RLock()
+        self._segments: List[_Segment] = []
+        self._next_segment_id = 1
+        self._version = 0
+        self._manifest_stamp = None
+        # 命名空间 -> [(分段序号, 行号)]，按写入顺序排列（含已删除行，检索时过滤）
+        self._namespace_rows: Dict[str, List[Tuple[int, int]]] = {}
+        self._stats = {"appends": 0, "searches": 0, "search_ms": 0.0, "deletes": 0, "compactions": 0}
+
+        self._compaction_thread = None
+        self._compaction_stop = threading.Event()
+
+        self.refresh()
+
+    # ===== 清单与加载 =====
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root_dir / self.MANIFEST
+
+    def refresh(self):
+        """清单变化时（其他进程写入、删除或压缩后）重新加载"""
+        with self._lock:
+            try:
+                stat = self.manifest_path.stat()
+            except FileNotFoundError:
+                return
+            stamp = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+            if stamp == self._manifest_stamp:
+                return
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["dim"] != self.dim:
+                raise ValueError(f"向量维度不一致: 存储为{manifest['dim']}，当前为{self.dim}")
+            self._apply_manifest(manifest)
+            self._manifest_stamp = stamp
+
+    def _apply_manifest(self, manifest: Dict[str, Any]):
+        """按清单更新内存中的分段状态（调用方需持有锁）"""
+        existing = {segment.name: segment for segment in self._segments}
+        names = [entry["name"] for entry in manifest["segments"]]
+        rebuild_index = names[:len(self._segments)] != [segment.name for segment in self._segments]
+
+        segments = []
+        for index, entry in enumerate(manifest["segments"]):
+            segment = existing.get(entry["name"]) if not rebuild_index else None
+            if segment is None:
+                segment = _Segment(self.root_dir, entry["name"], self.dim)
+            previous_rows = segment.rows
+            segment.load(entry["rows"], entry["meta_bytes"], entry["deleted"])
+            if not rebuild_index:
+                for row in range(previous_rows, segment.rows):
+                    self._namespace_rows.setdefault(segment.namespaces[row], []).append((index, row))
+            segments.append(segment)
+
+        self._segments = segments
+        self._next_segment_id = manifest["next_segment_id"]
+        self._version = manifest["version"]
+        if rebuild_index:
+            self._rebuild_namespace_index()
+
+    def _rebuild_namespace_index(self):
+        """重建命名空间索引（调用方需持有锁）"""
+        self._namespace_rows = {}
+        for index, segment in enumerate(self._segments):
+            for row, namespace in enumerate(segment.namespaces):
+                self._namespace_rows.setdefault(namespace, []).append((index, row))
+
+    def _write_manifest(self):
+        """原子写入清单（调用方需持有写锁）"""
+        self._version += 1
+        manifest = {
+            "dim": self.dim,
+            "version": self._version,
+            "next_segment_id": self._next_segment_id,
+            "segments": [{"name": s.name, "rows": s.rows, "meta_bytes": s.meta_bytes, "deleted": s.deleted_count}
+                         for s in self._segments],
+        }
+        tmp_path = self.manifest_path.with_suffix(".json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        stat = self.manifest_path.stat()
+        self._manifest_stamp = (stat.st_mtime_ns, stat.st_ino, stat.st_size)
+
+    @contextmanager
+    def _write_lock(self):
+        """进程内线程锁 + 跨进程文件锁，进入后先同步其他进程的写入"""
+        if self.read_only:
+            raise PermissionError("只读向量存储不能写入")
+        with self._lock:
+            if fcntl is None:
+                self.refresh()
+                yield
+                return
+            with open(self.root_dir / ".lock", "a+") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _new_segment(self) -> _Segment:
+        """新建分段（调用方需持有写锁）"""
+        segment = _Segment(self.root_dir, f"seg_{self._next_segment_id:06d}", self.dim)
+        self._next_segment_id += 1
+        self._segments.append(segment)
+        return segment
+
+    # ===== 写入与删除 =====
+
+    def add(self, namespace: str, vectors, payloads: List[Dict[str, Any]]):
+        """
+        追加向量
+
+        Args:
+            namespace (str): 命名空间，通常为会话ID
+            vectors: (n, dim) 的向量矩阵，应已做L2归一化
+            payloads (List[Dict]): 每个向量对应的附加数据
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(payloads):
+            raise ValueError("向量数量与附加数据数量不一致")
+        with self._write_lock():
+            offset = 0
+            while offset < len(vectors):
+                segment = self._segments[-1] if self._segments else None
+                if segment is None or segment.rows >= self.segment_rows:
+                    segment = self._new_segment()
+                index = len(self._segments) - 1
+                take = min(len(vectors) - offset, self.segment_rows - segment.rows)
+                first_row = segment.rows
+                segment.append(vectors[offset:offset + take], [namespace] * take, payloads[offset:offset + take])
+                rows = self._namespace_rows.setdefault(namespace, [])
+                rows.extend((index, row) for row in range(first_row, segment.rows))
+                offset += take
+            self._write_manifest()
+            self._stats["appends"] += len(vectors)
+
+    def delete_namespace(self, namespace: str) -> int:
+        """标记删除命名空间的全部向量，返回标记的行数"""
+        with self._write_lock():
+            refs = self._namespace_rows.pop(namespace, [])
+            touched = set()
+            for index, row in refs:
+                self._segments[index].deleted[row] = True
+                touched.add(index)
+            for index in touched:
+                self._segments[index].write_tombstones()
+            if refs:
+                self._write_manifest()
+                self._stats["deletes"] += len(refs)
+            return len(refs)
+
+    # ===== 检索 =====
+
+    def search(self, queries, top_k: int = 5, namespace: Optional[str] = None,
+               exclude_last: int = 0) -> List[List[Dict[str, Any]]]:
+        """
+        批量余弦相似度检索
+
+        Args:
+            queries: (q, dim) 的查询向量矩阵（或单个向量），应已做L2归一化
+            top_k (int): 每个查询返回的数量
+            namespace (str): 只在该命名空间内检索，None表示全部
+            exclude_last (int): 排除该命名空间最近写入的条数
+
+        Returns:
+            List[List[Dict]]: 每个查询的结果，按相似度降序，包含 namespace、similarity 和附加数据
+        """
+        started = time.perf_counter()
+        self.refresh()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+        with self._lock:
+            segments = list(self._segments)
+            refs = None
+            if namespace is not None:
+                refs = [ref for ref in self._namespace_rows.get(namespace, [])
+                        if not segments[ref[0]].deleted[ref[1]]]
+                if exclude_last > 0:
+                    refs = refs[:-exclude_last]
+
+        # 逐分段计算相似度，每个分段先取局部top_k，最后统一合并
+        blocks = []
+        if refs is not None:
+            by_segment: Dict[int, List[int]] = {}
+            for index, row in refs:
+                by_segment.setdefault(index, []).append(row)
+            for index, rows in by_segment.items():
+                rows = np.asarray(rows, dtype=np.int64)
+                blocks.append(self._top_block(queries, segments[index].matrix()[rows], index, rows, top_k))
+        else:
+            for index, segment in enumerate(segments):
+                matrix = segment.matrix()
+                if matrix is None:
+                    continue
+                live = np.flatnonzero(~segment.deleted[:len(matrix)])
+                if len(live) == 0:
+                    continue
+                block = matrix if len(live) == len(matrix) else matrix[live]
+                blocks.append(self._top_block(queries, block, index, live, top_k))
+
+        results: List[List[Dict[str, Any]]] = [[] for _ in range(len(queries))]
+        if blocks:
+            scores = np.concatenate([block[0] for block in blocks], axis=1)
+            segment_ids = np.concatenate([block[1] for block in blocks], axis=1)
+            row_ids = np.concatenate([block[2] for block in blocks], axis=1)
+            k = min(top_k, scores.shape[1])
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            for q in range(len(queries)):
+                for column in best[q][np.argsort(-scores[q, best[q]])]:
+                    segment = segments[segment_ids[q, column]]
+                    row = row_ids[q, column]
+                    results[q].append({"namespace": segment.namespaces[row],
+                                       "similarity": round(float(scores[q, column]), 4),
+                                       **segment.payloads[row]})
+
+        with self._lock:
+            self._stats["searches"] += len(queries)
+            self._stats["search_ms"] += (time.perf_counter() - started) * 1000
+        return results
+
+    @staticmethod
+    def _top_block(queries, block, segment_index: int, rows, top_k: int):
+        """计算一个分段块的相似度，返回每个查询局部top_k的 (分数, 分段序号, 行号)"""
+        scores = queries @ np.asarray(block, dtype=np.float32).T
+        k = min(top_k, scores.shape[1])
+        if k < scores.shape[1]:
+            local = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            local = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        return (np.take_along_axis(scores, local, axis=1),
+                np.full(local.shape, segment_index),
+                np.asarray(rows)[local])
+
+    # ===== 压缩 =====
+
+    def dead_ratio(self) -> float:
+        """已删除行占总行数的比例"""
+        with self._lock:
+            total = sum(segment.rows for segment in self._segments)
+            dead = sum(segment.deleted_count for segment in self._segments)
+        return dead / total if total else 0.0
+
+    def compact(self, min_dead_ratio: float = 0.2) -> Dict[str, Any]:
+        """
+        重写分段以回收已删除行
+
+        新分段写完后再原子替换清单，随后删除旧文件；已映射旧文件的读取方不受影响。
+
+        Returns:
+            Dict: 压缩前后的行数，未达到阈值时 compacted 为 False
+        """
+        started = time.perf_counter()
+        with self._write_lock():
+            total = sum(segment.rows for segment in self._segments)
+            dead = sum(segment.deleted_count for segment in self._segments)
+            if dead == 0 or dead / total < min_dead_ratio:
+                return {"compacted": False, "rows": total, "deleted": dead}
+
+            old_segments = self._segments
+            self._segments = []
+            for segment in old_segments:
+                live = np.flatnonzero(~segment.deleted)
+                matrix = segment.matrix()
+                position = 0
+                while position < len(live):
+                    current = self._segments[-1] if self._segments else None
+                    if current is None or current.rows >= self.segment_rows:
+                        current = self._new_segment()
+                    rows = live[position:position + self.segment_rows - current.rows]
+                    current.append(matrix[rows], [segment.namespaces[row] for row in rows],
+                                   [segment.payloads[row] for row in rows])
+                    position += len(rows)
+
+            self._rebuild_namespace_index()
+            self._write_manifest()
+            for segment in old_segments:
+                segment._matrix = None
+                segment.unlink()
+            self._stats["compactions"] += 1
+
+        result = {"compacted": True, "rows": total - dead, "deleted": dead,
+                  "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)}
+        log_manager.log_database_operation("system", "compact", "vector_store", result, "database")
+        return result
+
+    def start_compaction(self, interval_seconds: float = 600, min_dead_ratio: float = 0.2):
+        """启动后台压缩线程"""
+        if self.read_only or self._compaction_thread is not None:
+            return
+
+        def _run():
+            while not self._compaction_stop.wait(interval_seconds):
+                try:
+                    self.compact(min_dead_ratio)
+                except Exception as e:
+                    print(f"压缩向量存储时出错: {e}")
+                    log_manager.log_error("system", "vector_store_compaction_error", str(e), "database")
+
+        self._compaction_thread = threading.Thread(target=_run, name="vector-store-compaction", daemon=True)
+        self._compaction_thread.start()
+
+    def close(self):
+        """停止后台压缩线程"""
+        self._compaction_stop.set()
+        if self._compaction_thread is not None:
+            self._compaction_thread.join(timeout=5)
+            self._compaction_thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取存储统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["search_ms"] = round(stats["search_ms"], 2)
+            stats["segments"] = len(self._segments)
+            stats["rows"] = sum(segment.rows for segment in self._segments)
+            stats["deleted"] = sum(segment.deleted_count for segment in self._segments)
+            stats["namespaces"] = len(self._namespace_rows)
+            stats["version"] = self._version
+            return stats
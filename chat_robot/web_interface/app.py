@@ -10,6 +10,7 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 import os
@@ -20,8 +21,12 @@ import uuid
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 from chat_robot.chat_api import ChatAPI
-from chat_robot.data_manager import DataManager
 from chat_robot.config_manager import config_manager
+from chat_robot.optimization_cache import OptimizationCache
+from chat_robot.session_queue_manager import SessionQueueManager, SessionQueueFullError
+from chat_robot.admission_controller import AdmissionRejectedError
+from chat_robot.quota_manager import QuotaExceededError, AnonymousQuotaError
+from chat_robot.token_counter import estimate_tokens
 
 # 创建FastAPI应用实例
 app = FastAPI(
@@ -46,8 +51,25 @@ app.mount("/static", StaticFiles(directory=os.path.join(os.path.dirname(__file__
 templates = Jinja2Templates(directory=os.path.join(os.path.dirname(__file__), "templates"))
 
 # 初始化组件
-data_manager = DataManager()
 chat_api = ChatAPI()
+# 与ChatAPI共用数据管理器：聊天写入后的写后读固定对历史记录等页面接口同样生效
+data_manager = chat_api.data_manager
+
+# 人设优化结果缓存
+optimize_cache_config = config_manager.get_persona_optimize_cache_config()
+optimization_cache = None
+if optimize_cache_config["enabled"]:
+    try:
+        optimization_cache = OptimizationCache(
+            optimize_cache_config["path"],
+            optimize_cache_config["max_entries"],
+            optimize_cache_config["ttl_days"]
+        )
+    except Exception as e:
+        print(f"初始化人设优化缓存时出错: {e}")
+
+# 同一会话的聊天请求串行执行
+session_queue_manager = SessionQueueManager(**config_manager.get_session_queue_config())
 
 # 确保数据库表存在
 try:
@@ -60,11 +82,13 @@ class ChatRequest(BaseModel):
     session_id: str
     message: str
     persona_id: Optional[int] = None
+    user_id: Optional[int] = None
     settings: Optional[Dict[str, Any]] = None
 
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    quota_warnings: Optional[List[Dict[str, Any]]] = None
 
 class PersonaCreateRequest(BaseModel):
     name: str
@@ -138,19 +162,12 @@ async def create_persona(request: PersonaCreateRequest):
 class PersonaOptimizeRequest(BaseModel):
     name: str
 
-# API路由：优化人设描述
-@app.post("/api/personas/optimize")
-async def optimize_persona(request: PersonaOptimizeRequest):
-    """根据人设名称生成优化的人设描述"""
-    try:
-        from chat_robot.chat_api import ChatAPI
-        temp_chat_api = ChatAPI()
-
-        # 生成优化的提示词
-        optimization_prompt = f"""
+# 人设优化提示词模板，修改模板内容时需同步提升版本号以使缓存失效
+PERSONA_OPTIMIZE_TEMPLATE_VERSION = "1"
+PERSONA_OPTIMIZE_TEMPLATE = """
 请根据以下人设名称，创建一个详细、专业且富有特色的AI人设描述。要求：
 
-1. 人设名称：{request.name}
+1. 人设名称：{name}
 
 请提供：
 1. 一段简洁的人设描述（50-100字）
@@ -166,42 +183,42 @@ async def optimize_persona(request: PersonaOptimizeRequest):
 请直接返回JSON格式的结果，注意system_prompt必须是完整的字符串：
 {{
     "description": "人设描述",
-    "system_prompt": "你是{request.name}，一个具体的AI角色。角色定位：...。专业领域：...。交流风格：...。回答特点：...。互动方式：..."
+    "system_prompt": "你是{name}，一个具体的AI角色。角色定位：...。专业领域：...。交流风格：...。回答特点：...。互动方式：..."
 }}
 """
 
-        # 使用临时会话ID生成优化内容，但标记为系统内部使用，不保存到数据库
-        temp_session_id = f"system_optimize_{hash(request.name)}"
-
-        # 直接调用ChatAPI的内部方法，避免保存到数据库
-        try:
-            # 获取AI配置和模型
-            ai_config = config_manager.get_ai_config()
-
-            # 直接调用底层API，不通过chat_with_history方法
-            result = await temp_chat_api._call_api_directly(optimization_prompt, ai_config)
+# API路由：优化人设描述
+@app.post("/api/personas/optimize")
+async def optimize_persona(request: PersonaOptimizeRequest):
+    """根据人设名称生成优化的人设描述"""
+    try:
+        model_name = chat_api._get_model_name()
 
-            if result:
-                return {"success": True, "optimized_content": result}
-            else:
-                raise HTTPException(status_code=400, detail="优化人设描述失败")
+        # 优先返回缓存的优化结果
+        if optimization_cache is not None:
+            cached = optimization_cache.get(request.name, model_name, PERSONA_OPTIMIZE_TEMPLATE_VERSION)
+            if cached:
+                return {"success": True, "optimized_content": cached, "cached": True}
 
-        except AttributeError:
-            # 如果ChatAPI没有_direct方法，使用临时方法并清理
-            result = temp_chat_api.chat_with_history(temp_session_id, optimization_prompt)
+        # 生成优化的提示词
+        optimization_prompt = PERSONA_OPTIMIZE_TEMPLATE.format(name=request.name)
 
-            # 清理临时会话记录
-            try:
-                # 删除临时创建的会话记录
-                data_manager.delete_session(temp_session_id)
-            except:
-                pass  # 如果删除失败也不影响主流程
+        # 直接调用底层API，不通过chat_with_history方法，避免保存到数据库
+        # 同步客户端调用和准入等待都会阻塞，放到线程池中执行，避免阻塞事件循环
+        ai_config = config_manager.get_ai_config()
+        result = await run_in_threadpool(chat_api.call_api_directly, optimization_prompt, ai_config)
 
-            if result:
-                return {"success": True, "optimized_content": result}
-            else:
-                raise HTTPException(status_code=400, detail="优化人设描述失败")
+        if result:
+            if optimization_cache is not None:
+                optimization_cache.set(request.name, model_name, PERSONA_OPTIMIZE_TEMPLATE_VERSION, result)
+            return {"success": True, "optimized_content": result, "cached": False}
+        else:
+            raise HTTPException(status_code=400, detail="优化人设描述失败")
 
+    except HTTPException:
+        raise
+    except AdmissionRejectedError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"优化人设时出错: {str(e)}")
 
@@ -266,6 +283,7 @@ async def clear_session_messages(session_id: str):
         # 由于当前的data_manager没有直接清空消息的方法，我们需要添加一个
         success = data_manager.clear_session_messages(session_id)
         if success:
+            chat_api.forget_session(session_id)
             return {"success": True, "message": "会话消息已清空"}
         else:
             raise HTTPException(status_code=400, detail="清空会话消息失败")
@@ -279,6 +297,7 @@ async def delete_session(session_id: str):
     try:
         success = data_manager.delete_session(session_id)
         if success:
+            chat_api.forget_session(session_id)
             return {"success": True, "message": "会话删除成功"}
         else:
             raise HTTPException(status_code=400, detail="会话删除失败")
@@ -290,21 +309,36 @@ async def delete_session(session_id: str):
 async def chat_endpoint(chat_request: ChatRequest):
     """处理聊天消息的POST请求"""
     try:
-        # 如果指定了人设，先更新会话的人设
-        if chat_request.persona_id:
-            data_manager.update_session(
+        # 配额检查只读取内存计数，超出配额的请求不进入排队、不访问数据库和模型
+        quota_warnings = None
+        if chat_api.quota_manager is not None:
+            quota_result = chat_api.quota_manager.enforce(chat_request.user_id, estimate_tokens(chat_request.message))
+            quota_warnings = quota_result["warnings"] or None
+
+        # 同一会话的请求排队执行，避免并发读取同一上下文窗口、写入的消息顺序错乱
+        async with session_queue_manager.turn(chat_request.session_id):
+            # 如果指定了人设，先更新会话的人设
+            if chat_request.persona_id:
+                await run_in_threadpool(
+                    data_manager.update_session,
+                    chat_request.session_id,
+                    persona_id=chat_request.persona_id
+                )
+
+            # 调用ChatAPI处理聊天请求（在线程池中执行，不阻塞其他会话）
+            response = await run_in_threadpool(
+                chat_api.chat_with_history,
                 chat_request.session_id,
-                persona_id=chat_request.persona_id
+                chat_request.message,
+                persona_id=chat_request.persona_id,
+                user_id=chat_request.user_id
             )
 
-        # 调用ChatAPI处理聊天请求
-        response = chat_api.chat_with_history(
-            chat_request.session_id,
-            chat_request.message,
-            persona_id=chat_request.persona_id
-        )
-
-        return ChatResponse(response=response, session_id=chat_request.session_id)
+        return ChatResponse(response=response, session_id=chat_request.session_id, quota_warnings=quota_warnings)
+    except AnonymousQuotaError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    except (SessionQueueFullError, AdmissionRejectedError, QuotaExceededError) as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
         print(f"处理聊天请求时出错: {e}")
         raise HTTPException(status_code=500, detail=f"处理聊天请求时出错: {str(e)}")
@@ -319,6 +353,15 @@ async def get_chat_history(session_id: str, limit: int = 100):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取聊天历史时出错: {str(e)}")
 
+# API路由：搜索聊天记录
+@app.get("/api/search")
+async def search_messages(q: str, user_id: int, limit: int = 20):
+    """在指定用户的会话中全文搜索聊天记录，按相关度排序并返回摘录（user_id 必填，不提供跨用户搜索）"""
+    try:
+        return await run_in_threadpool(chat_api.search_manager.search, q, user_id, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"搜索聊天记录时出错: {str(e)}")
+
 # API路由：保存设置
 @app.post("/api/settings")
 async def save_settings(request: SettingsUpdateRequest):
@@ -414,6 +457,51 @@ async def get_system_status():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取系统状态时出错: {str(e)}")
 
+# API路由：查询用量
+@app.get("/api/usage")
+async def get_usage(group_by: str = "day", user_id: Optional[int] = None, session_id: Optional[str] = None,
+                    days: int = 30):
+    """按日期、会话、用户或模型汇总token用量和费用"""
+    if chat_api.usage_ledger is None:
+        raise HTTPException(status_code=404, detail="用量账本未启用")
+    try:
+        return await run_in_threadpool(chat_api.usage_ledger.get_usage, group_by, user_id, session_id, days)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询用量时出错: {str(e)}")
+
+# API路由：查询用户配额
+@app.get("/api/quota")
+async def get_quota(user_id: Optional[int] = None):
+    """获取用户的每日/每月配额和已用量"""
+    if chat_api.quota_manager is None:
+        raise HTTPException(status_code=404, detail="用户配额未启用")
+    try:
+        return await run_in_threadpool(chat_api.quota_manager.get_user_status, user_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"查询配额时出错: {str(e)}")
+
+# API路由：获取性能指标
+@app.get("/api/metrics")
+async def get_metrics():
+    """获取缓存命中率等运行时性能指标"""
+    try:
+        return {
+            "response_cache": chat_api.response_cache.get_stats() if chat_api.response_cache else {"enabled": False},
+            "persona_optimize_cache": optimization_cache.get_stats() if optimization_cache else {"enabled": False},
+            "summary_flight": chat_api.summary_flight.get_stats(),
+            "prompt_compilation": chat_api.prompt_manager.get_stats(),
+            "session_queue": session_queue_manager.get_stats(),
+            "admission": chat_api.admission_controller.get_stats() if chat_api.admission_controller else {"enabled": False},
+            "long_term_memory": chat_api.long_term_memory.get_stats() if chat_api.long_term_memory else {"enabled": False},
+            "usage_ledger": chat_api.usage_ledger.get_stats() if chat_api.usage_ledger else {"enabled": False},
+            "quota": chat_api.quota_manager.get_stats() if chat_api.quota_manager else {"enabled": False},
+            "storage": chat_api.data_manager.get_storage_stats(),
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取性能指标时出错: {str(e)}")
+
 # 健康检查路由
 @app.get("/api/health")
 async def health_check():